@@ -1,18 +1,25 @@
 from aiogram import Router, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message, CallbackQuery
+from typing import Optional, Tuple
 import logging
 
 from database import Database
+from broadcast import BroadcastEngine
+from pagination import Page, pack_page
 from keyboards import *
 from utils import *
-from config import ADMIN_PASSWORD, ROLE_ADMIN, PAGINATION_SIZE, ADMIN_SESSION_HOURS
+from config import (
+    ADMIN_PASSWORD, ROLE_ADMIN, PAGINATION_SIZE, ADMIN_SESSION_HOURS, MESSAGE_TEXT_LIMIT,
+    LIST_FETCH_BATCH
+)
 
 logger = logging.getLogger(__name__)
 router = Router()
 db = Database()
+broadcaster = BroadcastEngine(db)
 
 
 # ===== STATES =====
@@ -25,12 +32,21 @@ class Broadcast(StatesGroup):
     confirm = State()
 
 
+class AdminSearch(StatesGroup):
+    query = State()
+
+
+# Кнопки меню администратора работают и в режиме поиска, а не ищутся как запрос
+ADMIN_MENU_BUTTONS = (
+    "👥 Пользователи", "🏠 Парковочные места", "🔍 Поиск", "📊 Статистика",
+    "📢 Рассылка", "⚙️ Настройки", "🔙 Выйти из админки"
+)
+
+
 # ===== ВХОД В АДМИНКУ =====
 @router.message(Command("admin"))
-async def admin_login(message: Message, state: FSMContext):
+async def admin_login(message: Message, state: FSMContext, user: Optional[dict]):
     """Вход в админ-панель"""
-    user = await db.get_user_by_telegram_id(message.from_user.id)
-    
     if not user:
         await message.answer("❌ Вы не зарегистрированы. Используйте /start")
         return
@@ -54,11 +70,10 @@ async def admin_login(message: Message, state: FSMContext):
 
 
 @router.message(AdminAuth.password)
-async def process_admin_password(message: Message, state: FSMContext):
+async def process_admin_password(message: Message, state: FSMContext, user: Optional[dict]):
     """Обработка ввода пароля админа"""
     if message.text == "❌ Отмена":
         await state.clear()
-        user = await db.get_user_by_telegram_id(message.from_user.id)
         await message.answer(
             "Отменено.",
             reply_markup=get_main_menu(user['role'] if user else 'customer')
@@ -66,8 +81,6 @@ async def process_admin_password(message: Message, state: FSMContext):
         return
     
     if message.text == ADMIN_PASSWORD:
-        user = await db.get_user_by_telegram_id(message.from_user.id)
-        
         # Создаем временную админскую сессию
         success = await db.create_admin_session(user['id'], ADMIN_SESSION_HOURS)
         
@@ -87,10 +100,9 @@ async def process_admin_password(message: Message, state: FSMContext):
 
 # ===== ВЫХОД ИЗ АДМИНКИ =====
 @router.message(F.text == "🔙 Выйти из админки")
-async def exit_admin_panel(message: Message):
+async def exit_admin_panel(message: Message, state: FSMContext, user: Optional[dict]):
     """Выход из админ-панели"""
-    user = await db.get_user_by_telegram_id(message.from_user.id)
-    
+    await state.clear()
     if not user:
         return
     
@@ -101,6 +113,56 @@ async def exit_admin_panel(message: Message):
 
 
 # ===== ПОЛЬЗОВАТЕЛИ =====
+ROLE_EMOJI = {
+    'customer': '🛒',
+    'supplier': '🏪',
+    'admin': '👑'
+}
+
+
+def format_users_page(page: Page, total_users: int) -> str:
+    """Текст страницы списка пользователей"""
+    text = f"👥 <b>Пользователи</b> (всего {total_users})\n\n"
+    
+    for user in page.items:
+        status = "✅" if user['is_active'] else "❌"
+        role_emoji = ROLE_EMOJI.get(user['role'], '❓')
+        
+        text += f"{status} {role_emoji} <b>{escape_html(user['full_name'])}</b>\n"
+        text += f"   ID: {user['telegram_id']}\n"
+        text += f"   Роль: {user['role']}\n\n"
+    
+    return text
+
+
+def format_user_card(user: dict) -> str:
+    """Карточка пользователя для администратора"""
+    status = "✅ Активен" if user['is_active'] else "❌ Заблокирован"
+    text = f"{ROLE_EMOJI.get(user['role'], '❓')} <b>{escape_html(user['full_name'])}</b>\n\n"
+    text += f"Telegram ID: {user['telegram_id']}\n"
+    if user.get('username'):
+        text += f"Username: @{escape_html(user['username'])}\n"
+    text += f"📱 {escape_html(user['phone'])}\n"
+    text += f"Роль: {user['role']}\n"
+    text += f"Статус: {status}\n"
+    return text
+
+
+async def show_user_card(callback: CallbackQuery, user_id: int) -> bool:
+    """Показать карточку пользователя по внутреннему ID; False, если его нет"""
+    target_user = await db.get_user_by_id(user_id)
+    if not target_user:
+        return False
+    
+    await callback.message.edit_text(
+        format_user_card(target_user),
+        reply_markup=get_user_actions_keyboard(target_user['id'], target_user['is_active'],
+                                               target_user['role'] == ROLE_ADMIN),
+        parse_mode="HTML"
+    )
+    return True
+
+
 @router.message(F.text == "👥 Пользователи")
 async def show_users(message: Message):
     """Показать список пользователей"""
@@ -110,63 +172,108 @@ async def show_users(message: Message):
         await message.answer("❌ У вас нет доступа к этой функции.")
         return
     
-    users = await db.get_all_users(offset=0, limit=PAGINATION_SIZE)
-    total_users = await db.get_users_count()
-    total_pages = (total_users + PAGINATION_SIZE - 1) // PAGINATION_SIZE
+    page = await db.get_all_users(limit=PAGINATION_SIZE)
     
-    if not users:
+    if not page.items:
         await message.answer("Пользователей пока нет.")
         return
     
-    text = f"👥 <b>Пользователи</b> (стр. 1/{total_pages})\n\n"
-    
-    for user in users:
-        status = "✅" if user['is_active'] else "❌"
-        role_emoji = {
-            'customer': '🛒',
-            'supplier': '🏪',
-            'admin': '👑'
-        }.get(user['role'], '❓')
-        
-        text += f"{status} {role_emoji} <b>{escape_html(user['full_name'])}</b>\n"
-        text += f"   ID: {user['telegram_id']}\n"
-        text += f"   Роль: {user['role']}\n\n"
-    
-    keyboard = get_pagination_keyboard(0, total_pages, "users")
-    
-    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+    total_users = await db.get_users_count()
+    await message.answer(
+        format_users_page(page, total_users),
+        reply_markup=get_users_keyboard(page.items, page),
+        parse_mode="HTML"
+    )
 
 
-@router.callback_query(F.data.startswith("users_page_"))
+@router.callback_query(F.data.startswith("users_next_") | F.data.startswith("users_prev_")
+                       | (F.data == "back_to_users"))
 async def paginate_users(callback: CallbackQuery):
-    """Пагинация пользователей"""
-    page = int(callback.data.replace("users_page_", ""))
+    """Пагинация пользователей по курсору"""
+    if not await db.is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
     
-    offset = page * PAGINATION_SIZE
-    users = await db.get_all_users(offset=offset, limit=PAGINATION_SIZE)
-    total_users = await db.get_users_count()
-    total_pages = (total_users + PAGINATION_SIZE - 1) // PAGINATION_SIZE
+    cursor, backward = None, False
+    if callback.data.startswith("users_"):
+        backward = callback.data.startswith("users_prev_")
+        cursor = callback.data[len("users_prev_"):]
     
-    text = f"👥 <b>Пользователи</b> (стр. {page + 1}/{total_pages})\n\n"
+    page = await db.get_all_users(cursor=cursor, limit=PAGINATION_SIZE, backward=backward)
+    if not page.items and cursor:
+        # Курсор устарел или поврежден — показываем первую страницу
+        page = await db.get_all_users(limit=PAGINATION_SIZE)
     
-    for user in users:
-        status = "✅" if user['is_active'] else "❌"
-        role_emoji = {
-            'customer': '🛒',
-            'supplier': '🏪',
-            'admin': '👑'
-        }.get(user['role'], '❓')
-        
-        text += f"{status} {role_emoji} <b>{escape_html(user['full_name'])}</b>\n"
-        text += f"   ID: {user['telegram_id']}\n"
-        text += f"   Роль: {user['role']}\n\n"
-    
-    keyboard = get_pagination_keyboard(page, total_pages, "users")
+    total_users = await db.get_users_count()
+    await callback.message.edit_text(
+        format_users_page(page, total_users),
+        reply_markup=get_users_keyboard(page.items, page),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_user_"))
+async def user_details(callback: CallbackQuery):
+    """Карточка пользователя с действиями"""
+    if not await db.is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
     
-    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    if await show_user_card(callback, int(callback.data.replace("admin_user_", ""))):
+        await callback.answer()
+    else:
+        await callback.answer("❌ Пользователь не найден")
 
 
 # ===== ПАРКОВОЧНЫЕ МЕСТА (АДМИН) =====
+SPOTS_HEADER = "🏠 <b>Все парковочные места</b>\n\n"
+
+
+async def attach_suppliers(spots: list) -> list:
+    """Имена поставщиков для выборки мест одним запросом вместо запроса на место"""
+    suppliers = await db.get_users_by_ids(list({spot['supplier_id'] for spot in spots}))
+    for spot in spots:
+        supplier = suppliers.get(spot['supplier_id'])
+        spot['supplier_name'] = supplier['full_name'] if supplier else None
+    return spots
+
+
+def format_spot_entry(spot: dict) -> str:
+    """Запись о месте в списке администратора"""
+    status = "🟢" if spot['is_available'] else "🔴"
+    partial = "🔀" if spot['is_partial_allowed'] else "🚫"
+    if spot.get('supplier_name'):
+        supplier = f"{escape_html(spot['supplier_name'])} (ID {spot['supplier_id']})"
+    else:
+        supplier = f"ID {spot['supplier_id']}"
+    lines = [
+        f"{status} {partial} <b>Место {escape_html(spot['spot_number'])}</b>",
+        f"   Цена: {spot['price_per_hour']} ₽/ч",
+        f"   Поставщик: {supplier}",
+    ]
+    if spot.get('address'):
+        lines.append(f"   📍 {escape_html(spot['address'][:50])}")
+    return '\n'.join(lines) + '\n\n'
+
+
+async def render_spots_page(cursor: Optional[str] = None,
+                            backward: bool = False) -> Tuple[str, Page]:
+    """
+    Страница мест размером с одно сообщение: места читаются выборками по курсору
+    и добавляются целыми записями, пока текст помещается в MESSAGE_TEXT_LIMIT
+    """
+    async def fetch(page_cursor: Optional[str], page_backward: bool) -> Page:
+        page = await db.get_all_parking_spots(cursor=page_cursor, limit=LIST_FETCH_BATCH,
+                                              backward=page_backward)
+        await attach_suppliers(page.items)
+        return page
+
+    page, entries = await pack_page(fetch, format_spot_entry,
+                                    MESSAGE_TEXT_LIMIT - len(SPOTS_HEADER), cursor, backward)
+    return SPOTS_HEADER + ''.join(entries), page
+
+
 @router.message(F.text == "🏠 Парковочные места")
 async def show_all_spots_admin(message: Message):
     """Показать все парковочные места (для админа)"""
@@ -176,34 +283,104 @@ async def show_all_spots_admin(message: Message):
         await message.answer("❌ У вас нет доступа к этой функции.")
         return
     
-    spots = await db.get_all_parking_spots()
+    text, page = await render_spots_page()
     
-    if not spots:
+    if not page.items:
         await message.answer("Парковочных мест пока нет.")
         return
     
-    text = f"🏠 <b>Все парковочные места</b> ({len(spots)})\n\n"
+    await message.answer(text, reply_markup=get_pagination_keyboard(page, "spots"), parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("spots_next_") | F.data.startswith("spots_prev_"))
+async def paginate_spots_admin(callback: CallbackQuery):
+    """Пагинация парковочных мест по курсору"""
+    if not await db.is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
     
-    for spot in spots:
-        status = "🟢" if spot['is_available'] else "🔴"
-        partial = "🔀" if spot['is_partial_allowed'] else "🚫"
-        
-        text += f"{status} {partial} <b>Место {escape_html(spot['spot_number'])}</b>\n"
-        text += f"   Цена: {spot['price_per_hour']} ₽/ч\n"
-        text += f"   Поставщик ID: {spot['supplier_id']}\n"
-        
-        if spot.get('address'):
-            text += f"   📍 {escape_html(spot['address'][:50])}\n"
-        
-        text += "\n"
+    backward = callback.data.startswith("spots_prev_")
+    cursor = callback.data[len("spots_prev_"):]
+    
+    text, page = await render_spots_page(cursor, backward)
+    if not page.items:
+        text, page = await render_spots_page()
+    
+    await callback.message.edit_text(text, reply_markup=get_pagination_keyboard(page, "spots"),
+                                     parse_mode="HTML")
+    await callback.answer()
+
+
+# ===== ПОИСК =====
+async def send_search_results(message: Message, text: str):
+    """Пользователи и места, найденные по началу слов запроса"""
+    users = await db.search_users(text)
+    spots = await db.search_spots(text)
+    
+    if not users and not spots:
+        await message.answer("🔍 Ничего не найдено.")
+        return
     
-    # Разбиваем на несколько сообщений если текст слишком длинный
-    if len(text) > 4000:
-        parts = [text[i:i+4000] for i in range(0, len(text), 4000)]
-        for part in parts:
-            await message.answer(part, parse_mode="HTML")
+    if users:
+        await message.answer(
+            f"👥 <b>Пользователи</b> по запросу «{escape_html(text)}»:",
+            reply_markup=get_users_keyboard(users),
+            parse_mode="HTML"
+        )
+    if spots:
+        result = f"🏠 <b>Парковочные места</b> по запросу «{escape_html(text)}»:\n\n"
+        for spot in await attach_suppliers(spots):
+            entry = format_spot_entry(spot)
+            if len(result) + len(entry) > MESSAGE_TEXT_LIMIT:
+                break
+            result += entry
+        await message.answer(result, parse_mode="HTML")
+
+
+@router.message(Command("find"))
+async def find_command(message: Message, command: CommandObject, state: FSMContext):
+    """Поиск пользователей и мест: /find запрос"""
+    if not await db.is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой функции.")
+        return
+    
+    if command.args:
+        await send_search_results(message, command.args)
     else:
-        await message.answer(text, parse_mode="HTML")
+        await start_search(message, state)
+
+
+@router.message(F.text == "🔍 Поиск")
+async def start_search(message: Message, state: FSMContext):
+    """Режим поиска: каждое сообщение — новый запрос"""
+    if not await db.is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой функции.")
+        return
+    
+    await message.answer(
+        "🔍 <b>Поиск</b>\n\n"
+        "Введите имя, username или телефон пользователя, номер места или часть адреса.\n"
+        "Можно вводить начала слов: «иван 999» найдет Ивана с телефоном +7 999 ...",
+        reply_markup=get_cancel_button(),
+        parse_mode="HTML"
+    )
+    await state.set_state(AdminSearch.query)
+
+
+@router.message(AdminSearch.query, ~F.text.in_(ADMIN_MENU_BUTTONS))
+async def process_search(message: Message, state: FSMContext):
+    """Обработка поискового запроса"""
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Админ-панель:", reply_markup=get_admin_menu())
+        return
+    
+    if not await db.is_admin(message.from_user.id):
+        await state.clear()
+        await message.answer("❌ У вас нет доступа к этой функции.")
+        return
+    
+    await send_search_results(message, message.text or "")
 
 
 # ===== СТАТИСТИКА =====
@@ -224,6 +401,13 @@ async def show_statistics(message: Message):
     text += f"📋 Всего бронирований: {stats['total_bookings']}\n"
     text += f"✅ Активных бронирований: {stats['active_bookings']}\n"
     
+    if stats['bookings_by_status']:
+        text += "\n<b>Бронирования по статусам:</b>\n"
+        for status, count in sorted(stats['bookings_by_status'].items()):
+            text += f"   {get_status_emoji(status)} {get_status_text(status)}: {count}\n"
+    
+    text += f"\n💰 Выручка: {stats['revenue']:.2f} ₽\n"
+    
     await message.answer(text, parse_mode="HTML")
 
 
@@ -269,45 +453,39 @@ async def process_broadcast_message(message: Message, state: FSMContext):
 
 @router.callback_query(Broadcast.confirm, F.data == "confirm_broadcast")
 async def confirm_broadcast(callback: CallbackQuery, state: FSMContext):
-    """Подтверждение и выполнение рассылки"""
+    """Подтверждение и запуск рассылки"""
     data = await state.get_data()
     message_text = data['message_text']
+    await state.clear()
     
-    # Получаем всех пользователей
-    all_users = []
-    offset = 0
-    while True:
-        users = await db.get_all_users(offset=offset, limit=100)
-        if not users:
-            break
-        all_users.extend(users)
-        offset += 100
-    
-    await callback.message.edit_text("📤 Начинаю рассылку...")
-    
-    success_count = 0
-    fail_count = 0
-    
-    for user in all_users:
-        try:
-            await callback.bot.send_message(
-                chat_id=user['telegram_id'],
-                text=f"📢 <b>Рассылка от администрации</b>\n\n{message_text}",
-                parse_mode="HTML"
-            )
-            success_count += 1
-        except Exception as e:
-            logger.error(f"Ошибка отправки сообщения пользователю {user['telegram_id']}: {e}")
-            fail_count += 1
-    
-    await callback.message.answer(
-        f"✅ Рассылка завершена!\n\n"
-        f"Успешно: {success_count}\n"
-        f"Ошибок: {fail_count}",
-        reply_markup=get_admin_menu()
+    # Рассылка идет в фоне, прогресс приходит отдельным сообщением
+    job_id = await broadcaster.start(
+        callback.bot,
+        admin_chat_id=callback.message.chat.id,
+        text=f"📢 <b>Рассылка от администрации</b>\n\n{message_text}"
     )
     
-    await state.clear()
+    if job_id is None:
+        await callback.message.edit_text("❌ Не удалось запустить рассылку.")
+        await callback.message.answer("Админ-панель:", reply_markup=get_admin_menu())
+        return
+    
+    await callback.message.edit_text(f"📤 Рассылка #{job_id} запущена.")
+
+
+@router.callback_query(F.data.startswith("stop_broadcast_"))
+async def stop_broadcast(callback: CallbackQuery):
+    """Остановка идущей рассылки"""
+    if not await db.is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    job_id = int(callback.data.replace("stop_broadcast_", ""))
+    
+    if await broadcaster.cancel(job_id):
+        await callback.answer("⏹ Рассылка останавливается...")
+    else:
+        await callback.answer("Рассылка уже завершена.", show_alert=True)
 
 
 @router.callback_query(Broadcast.confirm, F.data == "cancel_broadcast")
@@ -319,66 +497,59 @@ async def cancel_broadcast(callback: CallbackQuery, state: FSMContext):
 
 
 # ===== УПРАВЛЕНИЕ ПОЛЬЗОВАТЕЛЯМИ =====
-@router.callback_query(F.data.startswith("block_user_"))
-async def block_user(callback: CallbackQuery):
-    """Блокировка пользователя"""
-    user_id = int(callback.data.replace("block_user_", ""))
+@router.callback_query(F.data.startswith("block_user_") | F.data.startswith("unblock_user_"))
+async def toggle_user_block(callback: CallbackQuery):
+    """Блокировка и разблокировка пользователя"""
+    if not await db.is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
     
-    success = await db.block_user(user_id)
+    block = callback.data.startswith("block_user_")
+    user_id = int(callback.data.split("_")[-1])
     
-    if success:
-        await callback.answer("✅ Пользователь заблокирован")
-    else:
-        await callback.answer("❌ Ошибка блокировки")
-
-
-@router.callback_query(F.data.startswith("unblock_user_"))
-async def unblock_user(callback: CallbackQuery):
-    """Разблокировка пользователя"""
-    user_id = int(callback.data.replace("unblock_user_", ""))
+    updated = await db.set_users_active([user_id], not block)
     
-    success = await db.unblock_user(user_id)
+    if updated is None:
+        await callback.answer("❌ Ошибка блокировки" if block else "❌ Ошибка разблокировки")
+        return
+    if not updated:
+        await callback.answer("❌ Пользователь не найден")
+        return
     
-    if success:
-        await callback.answer("✅ Пользователь разблокирован")
-    else:
-        await callback.answer("❌ Ошибка разблокировки")
+    await show_user_card(callback, user_id)
+    await callback.answer("✅ Пользователь заблокирован" if block else "✅ Пользователь разблокирован")
 
 
 @router.callback_query(F.data.startswith("make_admin_"))
 async def make_admin(callback: CallbackQuery):
     """Назначение администратором"""
-    user_id = int(callback.data.replace("make_admin_", ""))
+    if not await db.is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
     
-    # Получаем пользователя по внутреннему ID
-    all_users = await db.get_all_users(offset=0, limit=10000)
-    target_user = None
+    user_id = int(callback.data.replace("make_admin_", ""))
     
-    for user in all_users:
-        if user['id'] == user_id:
-            target_user = user
-            break
+    updated = await db.set_users_role([user_id], ROLE_ADMIN)
     
-    if not target_user:
+    if updated is None:
+        await callback.answer("❌ Ошибка назначения")
+        return
+    if not updated:
         await callback.answer("❌ Пользователь не найден")
         return
     
-    success = await db.update_user_role(target_user['telegram_id'], ROLE_ADMIN)
+    await show_user_card(callback, user_id)
+    await callback.answer("✅ Пользователь назначен администратором")
     
-    if success:
-        await callback.answer("✅ Пользователь назначен администратором")
-        
-        # Уведомляем пользователя
-        try:
-            await callback.bot.send_message(
-                chat_id=target_user['telegram_id'],
-                text="🎉 Вы были назначены администратором системы!\n\n"
-                     "Используйте команду /admin для входа в админ-панель."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления нового админа: {e}")
-    else:
-        await callback.answer("❌ Ошибка назначения")
+    # Уведомляем пользователя
+    try:
+        await callback.bot.send_message(
+            chat_id=updated[0],
+            text="🎉 Вы были назначены администратором системы!\n\n"
+                 "Используйте команду /admin для входа в админ-панель."
+        )
+    except Exception as e:
+        logger.error(f"Ошибка уведомления нового админа: {e}")
 
 
 # ===== НАСТРОЙКИ =====
@@ -398,6 +569,13 @@ async def show_settings(message: Message):
     text += f"🔔 Напоминание о бронировании: за {NOTIFICATION_REMINDER_HOURS} ч\n"
     text += f"📄 Элементов на странице: {PAGINATION_SIZE}\n"
     text += f"\n💾 База данных: SQLite\n"
+
+    pool = db.pool_stats()
+    text += f"🔌 Соединений занято: {pool['checked_out']}/{pool['readers'] + 1}\n"
+    text += f"⏳ Ожидание пула: {pool['avg_wait_ms']} мс (макс. {pool['max_wait_ms']} мс)\n"
+
+    cache = db.cache_stats()
+    text += f"👥 Кэш пользователей: {cache['size']} записей, попаданий {cache['hit_rate']:.0%}\n"
     text += f"🤖 Версия бота: 1.0.0\n"
     
     await message.answer(text, parse_mode="HTML")
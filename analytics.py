@@ -0,0 +1,79 @@
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, Optional
+
+import aiosqlite
+
+from utils import EPOCH
+
+MINUTES_PER_DAY = 24 * 60
+
+# Бронирования, которые учитываются в аналитике (занятость и выручка)
+COUNTED_STATUSES = ('confirmed', 'completed')
+
+
+def epoch_day(day: date) -> int:
+    """Номер дня от эпохи — ключ дневных сводок"""
+    return (day - EPOCH.date()).days
+
+
+async def apply_booking_rollup(db: aiosqlite.Connection, spot_id: int, start_min: int,
+                               end_min: int, total_price: float, sign: int = 1):
+    """
+    Учет бронирования в сводках spot_daily_stats и spot_hourly_stats
+    (sign=-1 — снятие с учета). Количество, длительность и выручка относятся
+    ко дню начала, занятые минуты — к каждому дню и часу, который бронирование покрывает.
+    """
+    hours: Dict[tuple, int] = defaultdict(int)
+    minute = start_min
+    while minute < end_min:
+        hour_end = min((minute // 60 + 1) * 60, end_min)
+        hours[(minute // MINUTES_PER_DAY, minute % MINUTES_PER_DAY // 60)] += hour_end - minute
+        minute = hour_end
+
+    days: Dict[int, list] = defaultdict(lambda: [0, 0, 0, 0.0])  # бронирования, длительность, минуты, выручка
+    start_day = days[start_min // MINUTES_PER_DAY]
+    start_day[0] = sign
+    start_day[1] = sign * (end_min - start_min)
+    start_day[3] = sign * total_price
+    for (day, _), minutes in hours.items():
+        days[day][2] += sign * minutes
+
+    await db.executemany('''
+        INSERT INTO spot_daily_stats (spot_id, day, bookings, length_minutes, booked_minutes, revenue)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(spot_id, day) DO UPDATE SET
+            bookings = bookings + excluded.bookings,
+            length_minutes = length_minutes + excluded.length_minutes,
+            booked_minutes = booked_minutes + excluded.booked_minutes,
+            revenue = revenue + excluded.revenue
+    ''', [(spot_id, day, *values) for day, values in days.items()])
+    await db.executemany('''
+        INSERT INTO spot_hourly_stats (spot_id, day, hour, booked_minutes)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(spot_id, day, hour) DO UPDATE SET
+            booked_minutes = booked_minutes + excluded.booked_minutes
+    ''', [(spot_id, day, hour, sign * minutes) for (day, hour), minutes in hours.items()])
+
+
+def format_analytics(title: str, stats: Dict[str, Any], date_from: date, date_to: date) -> str:
+    """Текст отчета по месту или по всем местам поставщика"""
+    text = (
+        f"📊 <b>{title}</b>\n"
+        f"📅 {date_from.strftime('%d.%m.%Y')} - {date_to.strftime('%d.%m.%Y')}\n\n"
+        f"📋 Бронирований: {stats['bookings']}\n"
+        f"💰 Выручка: {stats['revenue']:.2f} ₽\n"
+    )
+
+    occupancy: Optional[float] = stats['occupancy']
+    if occupancy is not None:
+        text += f"📈 Занятость: {occupancy:.0f}% предложенного времени\n"
+    if stats['avg_minutes']:
+        hours, minutes = divmod(round(stats['avg_minutes']), 60)
+        text += f"⏱ Средняя длительность: {hours} ч {minutes:02d} мин\n"
+
+    if stats['peak_hours']:
+        text += "\n🔥 <b>Самые загруженные часы:</b>\n"
+        for hour, minutes in stats['peak_hours']:
+            text += f"   {hour:02d}:00-{(hour + 1) % 24:02d}:00 — {minutes / 60:.1f} ч\n"
+    return text
@@ -0,0 +1,203 @@
+import logging
+from bisect import bisect_left, bisect_right, insort
+from itertools import accumulate
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from analytics import MINUTES_PER_DAY
+from utils import to_epoch_minutes
+
+logger = logging.getLogger(__name__)
+
+
+class SpotTimeline:
+    """
+    Свободные интервалы одного места, отсортированные по началу (в минутах эпохи).
+    Для поиска покрывающего интервала хранится префиксный максимум концов: он не убывает,
+    поэтому первый интервал, дотягивающийся до конца запроса, находится бинарным поиском.
+    После изменения массив пересобирается лениво, при следующем поиске.
+    """
+
+    __slots__ = ('intervals', '_max_ends')
+
+    def __init__(self):
+        self.intervals: List[Tuple[int, int, int]] = []  # (start, end, slot_id)
+        self._max_ends: Optional[List[int]] = None
+
+    def add(self, start: int, end: int, slot_id: int):
+        insort(self.intervals, (start, end, slot_id))
+        self._max_ends = None
+
+    def remove(self, start: int, end: int, slot_id: int) -> bool:
+        i = bisect_left(self.intervals, (start, end, slot_id))
+        if i < len(self.intervals) and self.intervals[i] == (start, end, slot_id):
+            del self.intervals[i]
+            self._max_ends = None
+            return True
+        return False
+
+    def find_covering(self, start: int, end: int) -> Optional[int]:
+        """ID свободного интервала, целиком покрывающего [start, end)"""
+        if self._max_ends is None:
+            self._max_ends = list(accumulate((item[1] for item in self.intervals), max))
+        # Кандидаты — интервалы, начавшиеся не позже start; среди них первый с концом >= end
+        i = bisect_right(self.intervals, (start, float('inf'), 0))
+        j = bisect_left(self._max_ends, end, 0, i)
+        return self.intervals[j][2] if j < i else None
+
+
+def subtract_intervals(start: int, end: int, busy: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Части [start, end), не занятые интервалами busy"""
+    free = []
+    for busy_start, busy_end in sorted(busy):
+        if busy_end <= start:
+            continue
+        if busy_start >= end:
+            break
+        if busy_start > start:
+            free.append((start, busy_start))
+        start = max(start, busy_end)
+    if start < end:
+        free.append((start, end))
+    return free
+
+
+class AvailabilityEngine:
+    """
+    Индекс свободного времени в памяти.
+    Загружается из spot_availability при запуске и обновляется при каждой записи;
+    SQL остается источником истины: Database.verify_availability() (фоновая задача
+    AvailabilityVerifier) удаляет прошедшие слоты и сверяет индекс с БД.
+    Поиск по одному месту идет по его SpotTimeline, поиск по всем местам — по слотам
+    дня начала запроса (by_day), а не по всем местам.
+    """
+
+    def __init__(self):
+        self.timelines: Dict[int, SpotTimeline] = {}
+        self.slots: Dict[int, Tuple[int, int, int]] = {}  # slot_id -> (spot_id, start, end)
+        self.by_day: Dict[int, Set[int]] = {}  # день эпохи -> слоты, пересекающие этот день
+        self.hidden_spots: Set[int] = set()
+        self.loaded = False
+
+    def clear(self):
+        self.timelines.clear()
+        self.slots.clear()
+        self.by_day.clear()
+        self.hidden_spots.clear()
+        self.loaded = False
+
+    @staticmethod
+    def _days(start: int, end: int) -> range:
+        return range(start // MINUTES_PER_DAY, (max(end, start + 1) - 1) // MINUTES_PER_DAY + 1)
+
+    def add_slot(self, slot_id: int, spot_id: int, start_time: datetime, end_time: datetime):
+        self._add(slot_id, spot_id, to_epoch_minutes(start_time), to_epoch_minutes(end_time))
+
+    def _add(self, slot_id: int, spot_id: int, start: int, end: int):
+        if slot_id in self.slots:
+            self.remove_slot(slot_id)
+        self.slots[slot_id] = (spot_id, start, end)
+        self.timelines.setdefault(spot_id, SpotTimeline()).add(start, end, slot_id)
+        for day in self._days(start, end):
+            self.by_day.setdefault(day, set()).add(slot_id)
+
+    def remove_slot(self, slot_id: int):
+        entry = self.slots.pop(slot_id, None)
+        if entry is None:
+            return
+        spot_id, start, end = entry
+        timeline = self.timelines.get(spot_id)
+        if timeline:
+            timeline.remove(start, end, slot_id)
+        for day in self._days(start, end):
+            day_slots = self.by_day.get(day)
+            if day_slots is not None:
+                day_slots.discard(slot_id)
+                if not day_slots:
+                    del self.by_day[day]
+
+    def set_spot_visible(self, spot_id: int, visible: bool):
+        if visible:
+            self.hidden_spots.discard(spot_id)
+        else:
+            self.hidden_spots.add(spot_id)
+
+    def is_free(self, spot_id: int, start_time: datetime, end_time: datetime) -> bool:
+        """Видимо ли место и свободно ли оно на [start, end)"""
+        if spot_id in self.hidden_spots:
+            return False
+        return self.find_slot(spot_id, start_time, end_time) is not None
+
+    def find_slot(self, spot_id: int, start_time: datetime, end_time: datetime) -> Optional[int]:
+        """ID свободного слота места, покрывающего [start, end)"""
+        timeline = self.timelines.get(spot_id)
+        if not timeline:
+            return None
+        return timeline.find_covering(to_epoch_minutes(start_time), to_epoch_minutes(end_time))
+
+    def free_spots(self, start_time: datetime, end_time: datetime) -> Dict[int, int]:
+        """Видимые места, свободные на [start, end): spot_id -> slot_id"""
+        return self._free(to_epoch_minutes(start_time), to_epoch_minutes(end_time))
+
+    def free_by_window(self, windows: List[Tuple[datetime, datetime]]) -> List[Dict[int, int]]:
+        """Видимые свободные места для каждого окна: [{spot_id: slot_id}]"""
+        return [self._free(to_epoch_minutes(start), to_epoch_minutes(end)) for start, end in windows]
+
+    def _free(self, start: int, end: int) -> Dict[int, int]:
+        # Покрывающий слот пересекает день начала запроса — остальные дни не смотрим
+        result = {}
+        for slot_id in self.by_day.get(start // MINUTES_PER_DAY, ()):
+            spot_id, slot_start, slot_end = self.slots[slot_id]
+            if slot_start <= start and slot_end >= end and spot_id not in self.hidden_spots:
+                result.setdefault(spot_id, slot_id)
+        return result
+
+    def prune(self, before: datetime) -> int:
+        """Удаление слотов, закончившихся до момента before"""
+        limit = to_epoch_minutes(before)
+        expired = [slot_id for slot_id, (_, _, end) in self.slots.items() if end <= limit]
+        for slot_id in expired:
+            self.remove_slot(slot_id)
+        return len(expired)
+
+    def load(self, hidden_spots: List[int], free_slots: List[Tuple[int, int, int, int]]):
+        """Заполнение из строк БД: скрытые места и свободные слоты (id, spot_id, start_min, end_min)"""
+        self.clear()
+        self.hidden_spots.update(hidden_spots)
+        for slot_id, spot_id, start, end in free_slots:
+            self._add(slot_id, spot_id, start, end)
+        self.loaded = True
+        logger.info(f"Индекс доступности загружен: {len(self.slots)} свободных слотов")
+
+    def diff(self, hidden_spots: List[int], free_slots: List[Tuple[int, int, int, int]]) -> List[int]:
+        """ID мест, по которым индекс расходится с БД (свободные слоты или видимость)"""
+        expected = {slot_id: (spot_id, start, end) for slot_id, spot_id, start, end in free_slots}
+        mismatched = {entry[0] for slot_id, entry in expected.items() if self.slots.get(slot_id) != entry}
+        mismatched |= {self.slots[slot_id][0] for slot_id in set(self.slots) - set(expected)}
+        mismatched |= self.hidden_spots ^ set(hidden_spots)
+        return sorted(mismatched)
+
+    def reload_spots(self, spot_ids: List[int], hidden_spots: List[int],
+                     free_slots: List[Tuple[int, int, int, int]]):
+        """Замена слотов и видимости указанных мест строками БД (как в load)"""
+        spots = set(spot_ids)
+        for slot_id in [slot_id for slot_id, entry in self.slots.items() if entry[0] in spots]:
+            self.remove_slot(slot_id)
+        for slot_id, spot_id, start, end in free_slots:
+            if spot_id in spots:
+                self._add(slot_id, spot_id, start, end)
+        hidden = set(hidden_spots)
+        for spot_id in spots:
+            self.set_spot_visible(spot_id, spot_id not in hidden)
+
+
+_engines: Dict[str, AvailabilityEngine] = {}
+
+
+def get_engine(db_path: str) -> AvailabilityEngine:
+    """Общий индекс доступности для файла базы данных"""
+    engine = _engines.get(db_path)
+    if engine is None:
+        engine = AvailabilityEngine()
+        _engines[db_path] = engine
+    return engine
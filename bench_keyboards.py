@@ -0,0 +1,57 @@
+"""
+Микробенчмарк кэша клавиатур: сборка разметки заново против готовой из кэша.
+
+Запуск: python bench_keyboards.py [число повторов]
+"""
+import sys
+import time
+
+import keyboards
+
+# Клавиатуры, которые отдаются почти в каждом ответе, и аргументы вызова
+CASES = [
+    ('get_main_menu', ('customer',)),
+    ('get_main_menu', ('supplier',)),
+    ('get_cancel_button', ()),
+    ('get_phone_keyboard', ()),
+    ('get_banks_keyboard', ()),
+    ('get_role_selection', ()),
+    ('get_partial_allowed_keyboard', ()),
+    ('get_date_selection_keyboard', ()),
+    ('get_admin_menu', ()),
+    ('get_broadcast_confirm_keyboard', ()),
+    ('get_profile_keyboard', ()),
+]
+
+# Типичный апдейт: ответ с главным меню и шаг сценария с кнопкой отмены
+UPDATE_MIX = [('get_main_menu', ('customer',)), ('get_cancel_button', ())]
+
+
+def per_call_us(func, args, number: int) -> float:
+    """Среднее время вызова в микросекундах (CPU процесса)"""
+    start = time.process_time()
+    for _ in range(number):
+        func(*args)
+    return (time.process_time() - start) / number * 1e6
+
+
+def main(number: int = 2000):
+    print(f"{'клавиатура':<34}{'сборка, мкс':>14}{'кэш, мкс':>12}{'выигрыш':>10}")
+    results = {}
+    for name, args in CASES:
+        cached = getattr(keyboards, name)
+        build_us = per_call_us(cached.__wrapped__, args, number)
+        cached_us = per_call_us(cached, args, number * 10)
+        results[(name, args)] = (build_us, cached_us)
+        label = f"{name}({', '.join(map(repr, args))})"
+        print(f"{label:<34}{build_us:>14.1f}{cached_us:>12.2f}{build_us / cached_us:>9.0f}x")
+
+    build_total = sum(results[case][0] for case in UPDATE_MIX)
+    cached_total = sum(results[case][1] for case in UPDATE_MIX)
+    print(f"\nНа типичный апдейт ({len(UPDATE_MIX)} клавиатуры): "
+          f"{build_total:.1f} мкс -> {cached_total:.2f} мкс, "
+          f"экономия {build_total - cached_total:.1f} мкс CPU")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+)
+
+from config import (
+    BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_BATCH_SIZE, BROADCAST_CHAT_INTERVAL,
+    BROADCAST_PROGRESS_INTERVAL, BROADCAST_MAX_RETRIES, BROADCAST_DONE, BROADCAST_CANCELLED
+)
+from database import Database
+from keyboards import get_admin_menu, get_broadcast_progress_keyboard
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Остановка выдачи токенов (после RetryAfter от Telegram)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Лимит Telegram общий на бота, поэтому и ограничитель один: рассылка, уведомления
+# о свободных местах и сообщения фоновых задач вместе не превышают BROADCAST_RATE
+send_bucket = TokenBucket(BROADCAST_RATE)
+
+
+class ChatPacer:
+    """Минимальный интервал между сообщениями в один чат"""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next: Dict[int, float] = {}  # chat_id -> когда можно писать снова
+        self._calls = 0
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        ready = self._next.get(chat_id, 0.0)
+        self._next[chat_id] = max(now, ready) + self.interval
+
+        # При рассылке почти каждый чат встречается один раз — не копим их
+        self._calls += 1
+        if self._calls % self.PRUNE_EVERY == 0:
+            self._next = {cid: t for cid, t in self._next.items() if t > now}
+
+        if ready > now:
+            await asyncio.sleep(ready - now)
+
+
+def format_progress(job: dict, sent: int, failed: int, status: Optional[str] = None) -> str:
+    """Текст сообщения с прогрессом рассылки"""
+    if status == BROADCAST_DONE:
+        title = "✅ Рассылка завершена!"
+    elif status == BROADCAST_CANCELLED:
+        title = "⏹ Рассылка остановлена"
+    else:
+        title = "📤 Идет рассылка..."
+
+    return (
+        f"{title}\n\n"
+        f"Обработано: {sent + failed} из ~{job['total']}\n"
+        f"Успешно: {sent}\n"
+        f"Ошибок: {failed}"
+    )
+
+
+class BroadcastEngine:
+    """
+    Рассылка сообщений всем пользователям.
+    Получатели читаются пачками по курсору users.id, отправка идет параллельно
+    через общий ограничитель частоты. После каждой пачки курсор и счетчики
+    сохраняются в broadcast_jobs, поэтому после перезапуска рассылка продолжается
+    (повторно может уйти не больше одной пачки).
+    """
+
+    def __init__(self, db: Database, bucket: TokenBucket = send_bucket,
+                 concurrency: int = BROADCAST_CONCURRENCY, batch_size: int = BROADCAST_BATCH_SIZE,
+                 chat_interval: float = BROADCAST_CHAT_INTERVAL,
+                 progress_interval: float = BROADCAST_PROGRESS_INTERVAL,
+                 max_retries: int = BROADCAST_MAX_RETRIES):
+        self.db = db
+        self.bucket = bucket
+        self.pacer = ChatPacer(chat_interval)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.max_retries = max_retries
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancelled: Set[int] = set()
+
+    async def start(self, bot: Bot, admin_chat_id: int, text: str) -> Optional[int]:
+        """Создание задания и запуск рассылки в фоне"""
+        job_id = await self.db.create_broadcast_job(admin_chat_id, text)
+        if job_id is not None:
+            self._spawn(bot, job_id)
+        return job_id
+
+    async def resume(self, bot: Bot) -> int:
+        """Продолжение рассылок, прерванных остановкой бота"""
+        jobs = await self.db.get_running_broadcast_jobs()
+        for job in jobs:
+            if job['id'] not in self._tasks:
+                logger.info(f"Продолжаем рассылку #{job['id']} с пользователя {job['last_user_id']}")
+                self._spawn(bot, job['id'])
+        return len(jobs)
+
+    async def cancel(self, job_id: int) -> bool:
+        """Остановка рассылки администратором"""
+        if not await self.db.finish_broadcast_job(job_id, BROADCAST_CANCELLED):
+            return False
+        if job_id in self._tasks:
+            self._cancelled.add(job_id)
+        return True
+
+    async def stop(self):
+        """Прерывание фоновых задач при остановке бота (прогресс уже сохранен)"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def wait(self, job_id: int):
+        """Ожидание завершения рассылки"""
+        task = self._tasks.get(job_id)
+        if task:
+            await asyncio.gather(task, return_exceptions=True)
+
+    def _spawn(self, bot: Bot, job_id: int):
+        task = asyncio.create_task(self._run(bot, job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _run(self, bot: Bot, job_id: int):
+        job = await self.db.get_broadcast_job(job_id)
+        if not job:
+            return
+
+        sent, failed, cursor = job['sent'], job['failed'], job['last_user_id']
+        if job['progress_message_id'] is None:
+            message = await self._send(bot, job['admin_chat_id'], format_progress(job, sent, failed),
+                                       reply_markup=get_broadcast_progress_keyboard(job_id))
+            if message:
+                job['progress_message_id'] = message.message_id
+                await self.db.set_broadcast_message(job_id, message.message_id)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        reported_at = time.monotonic()
+
+        try:
+            while job_id not in self._cancelled:
+                batch = await self.db.get_broadcast_recipients(cursor, self.batch_size)
+                if not batch:
+                    break
+
+                results = await asyncio.gather(*(
+                    self._deliver(bot, semaphore, job_id, telegram_id, job['text'])
+                    for _, telegram_id in batch
+                ))
+                sent += results.count(True)
+                failed += results.count(False)
+                cursor = batch[-1][0]
+                await self.db.save_broadcast_progress(job_id, cursor, sent, failed)
+
+                if time.monotonic() - reported_at >= self.progress_interval:
+                    reported_at = time.monotonic()
+                    await self._edit_progress(bot, job, format_progress(job, sent, failed),
+                                              get_broadcast_progress_keyboard(job_id))
+        except Exception as e:
+            # Задание остается running и продолжится при следующем запуске
+            logger.error(f"Ошибка рассылки #{job_id}: {e}")
+            return
+
+        if job_id not in self._cancelled and await self.db.finish_broadcast_job(job_id, BROADCAST_DONE):
+            status = BROADCAST_DONE
+        else:
+            status = BROADCAST_CANCELLED
+        self._cancelled.discard(job_id)
+
+        logger.info(f"Рассылка #{job_id} ({status}): успешно {sent}, ошибок {failed}")
+        await self._edit_progress(bot, job, format_progress(job, sent, failed, status))
+        await self._send(bot, job['admin_chat_id'], "Админ-панель:", reply_markup=get_admin_menu())
+
+    async def _deliver(self, bot: Bot, semaphore: asyncio.Semaphore, job_id: int,
+                       chat_id: int, text: str) -> Optional[bool]:
+        """Отправка одному получателю: True — доставлено, False — ошибка, None — рассылка остановлена"""
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                if job_id in self._cancelled:
+                    return None
+
+                await self.pacer.wait(chat_id)
+                await self.bucket.acquire()
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+                    return True
+                except TelegramRetryAfter as e:
+                    # Лимит общий для бота — притормаживаем все отправки
+                    logger.warning(f"Flood control, пауза {e.retry_after} с")
+                    self.bucket.pause(e.retry_after)
+                except (TelegramForbiddenError, TelegramBadRequest) as e:
+                    # Бот заблокирован или чат не существует — повтор не поможет
+                    logger.info(f"Сообщение пользователю {chat_id} не доставлено: {e}")
+                    return False
+                except TelegramNetworkError as e:
+                    logger.warning(f"Сетевая ошибка при отправке пользователю {chat_id}: {e}")
+                    await asyncio.sleep(2 ** attempt)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки сообщения пользователю {chat_id}: {e}")
+                    return False
+            return False
+
+    async def _send(self, bot: Bot, chat_id: int, text: str, **kwargs):
+        await self.pacer.wait(chat_id)
+        await self.bucket.acquire()
+        try:
+            return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except Exception as e:
+            logger.error(f"Ошибка отправки сообщения администратору {chat_id}: {e}")
+            return None
+
+    async def _edit_progress(self, bot: Bot, job: dict, text: str, reply_markup=None):
+        if job['progress_message_id'] is None:
+            return
+        await self.pacer.wait(job['admin_chat_id'])
+        await self.bucket.acquire()
+        try:
+            await bot.edit_message_text(text=text, chat_id=job['admin_chat_id'],
+                                        message_id=job['progress_message_id'],
+                                        reply_markup=reply_markup)
+        except Exception as e:
+            # В том числе «message is not modified» — прогресс не критичен
+            logger.debug(f"Не удалось обновить прогресс рассылки #{job['id']}: {e}")
@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, ADMIN_CACHE_SIZE, ADMIN_CACHE_TTL
+
+# Маркер «значения нет», чтобы отличать промах от закэшированного None
+MISSING = object()
+
+
+class TTLCache:
+    """LRU-кэш с ограниченным временем жизни записей и счетчиками попаданий"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Растет при каждом сбросе: запись, прочитанная из БД до сброса, уже устарела
+        self._generation = 0
+
+    def token(self) -> int:
+        """Метка, которую берут перед чтением из БД и передают в set"""
+        return self._generation
+
+    def get(self, key: Hashable) -> Any:
+        """Значение по ключу или MISSING"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None,
+            token: Optional[int] = None):
+        """Запись значения; с token запись пропускается, если после чтения был сброс"""
+        if token is not None and token != self._generation:
+            return
+        self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._generation += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._generation += 1
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+_user_caches: Dict[str, TTLCache] = {}
+
+
+def get_user_cache(db_path: str) -> TTLCache:
+    """Общий кэш пользователей (по telegram_id) для файла базы данных"""
+    cache = _user_caches.get(db_path)
+    if cache is None:
+        cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        _user_caches[db_path] = cache
+    return cache
+
+
+_admin_caches: Dict[str, TTLCache] = {}
+
+
+def get_admin_cache(db_path: str) -> TTLCache:
+    """Общий кэш прав администратора (по telegram_id) для файла базы данных"""
+    cache = _admin_caches.get(db_path)
+    if cache is None:
+        cache = TTLCache(ADMIN_CACHE_SIZE, ADMIN_CACHE_TTL)
+        _admin_caches[db_path] = cache
+    return cache
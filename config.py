@@ -7,16 +7,81 @@ load_dotenv()
 # Токен бота
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Webhook (используется при BOT_MODE=webhook)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес; без него setWebhook не вызывается
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))  # Апдейтов в очереди
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))  # Одновременно обрабатываемых апдейтов
+
+# Хранилище состояний FSM: sqlite (по умолчанию), redis или memory
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')  # Для FSM_STORAGE=redis
+FSM_STATE_TTL = 24 * 3600  # Через сколько секунд брошенный сценарий удаляется
+FSM_FLUSH_INTERVAL = 1.0  # Как часто сбрасывать изменения состояний в БД, секунд
+FSM_FLUSH_BATCH = 200  # Сбросить раньше, если накопилось столько изменений
+FSM_PURGE_INTERVAL = 600  # Как часто удалять истекшие состояния, секунд
+
 # Пароль администратора
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'qwerty123')
 
 # База данных
 DATABASE_PATH = 'parking_bot.db'
+DB_POOL_READERS = int(os.getenv('DB_POOL_READERS', '4'))  # Соединений для чтения в пуле
+MIGRATION_BATCH_SIZE = 1000  # Строк за одну транзакцию при заполнении данных миграцией
 
 # Настройки
 ADMIN_SESSION_HOURS = 24  # Длительность админ-сессии в часах
 NOTIFICATION_REMINDER_HOURS = 1  # За сколько часов напоминать о бронировании
 PAGINATION_SIZE = 10  # Количество элементов на странице
+SLOTS_PAGE_SIZE = 8  # Кнопок слотов на одной странице поиска
+SEARCH_RANGE_MAX_DAYS = 14  # Максимальная длина периода при поиске на несколько дней
+SEARCH_RANGE_SPOTS_PER_DAY = 3  # Мест на каждый день в ответе поиска на период
+MESSAGE_TEXT_LIMIT = 4000  # Символов в одном сообщении со списком (лимит Telegram 4096)
+LIST_FETCH_BATCH = 50  # Строк за одну выборку при наборе страницы списка по размеру сообщения
+USER_CACHE_SIZE = 10000  # Пользователей в кэше
+USER_CACHE_TTL = 300  # Время жизни записи кэша пользователей в секундах
+ADMIN_CACHE_SIZE = 1000  # Записей в кэше прав администратора
+ADMIN_CACHE_TTL = 300  # Время жизни записи кэша прав, секунд (не дольше самой сессии)
+ADMIN_SESSION_GC_INTERVAL = 3600  # Как часто удалять истекшие админ-сессии, секунд
+ADMIN_SESSION_GC_BATCH = 500  # Сессий за одну транзакцию удаления
+ADMIN_SEARCH_LIMIT = 10  # Пользователей и мест в результатах поиска администратора
+
+# Рассылка
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))  # Сообщений в секунду (лимит Telegram ~30)
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))  # Одновременных запросов
+BROADCAST_BATCH_SIZE = 100  # Получателей за одну выборку; прогресс сохраняется после каждой
+BROADCAST_CHAT_INTERVAL = 1.0  # Минимальный интервал между сообщениями в один чат, секунд
+BROADCAST_PROGRESS_INTERVAL = 5  # Как часто обновлять сообщение с прогрессом, секунд
+BROADCAST_MAX_RETRIES = 3  # Повторов отправки после RetryAfter и сетевых ошибок
+
+# Уведомления о свободных местах
+NOTIFICATION_CHECK_INTERVAL = 30  # Как часто проверять новые слоты, секунд
+NOTIFICATION_SLOTS_BATCH = 500  # Новых слотов за одну выборку
+NOTIFICATION_SEND_BATCH = 30  # Сообщений, отправляемых одновременно
+RULE_EXPAND_AHEAD_DAYS = 14  # На сколько дней вперед подбор уведомлений разворачивает правила доступности
+
+# Индекс свободного времени в памяти
+AVAILABILITY_VERIFY_INTERVAL = 600  # Как часто удалять прошедшие слоты и сверять индекс с БД, секунд
+
+# Напоминания о бронированиях (за NOTIFICATION_REMINDER_HOURS до начала)
+REMINDER_HORIZON_HOURS = 6  # На сколько часов вперед загружать напоминания в память
+REMINDER_RELOAD_INTERVAL = 900  # Как часто перечитывать горизонт, секунд
+
+# Автоматическое завершение бронирований
+PENDING_BOOKING_TIMEOUT_HOURS = 12  # Через сколько часов заявка без ответа поставщика истекает
+BOOKING_SWEEP_INTERVAL = 300  # Как часто искать истекшие заявки и закончившиеся бронирования, секунд
+BOOKING_SWEEP_BATCH = 200  # Бронирований за одну транзакцию
+
+# Статистика (счетчики ведутся триггерами, сверка — фоновой задачей)
+STATS_RECONCILE_INTERVAL = 3600  # Как часто сверять счетчики с таблицами, секунд
+ANALYTICS_PERIODS = [7, 30, 90]  # Периоды отчета поставщика, дней (первый — по умолчанию)
+ANALYTICS_PEAK_HOURS = 3  # Сколько самых загруженных часов показывать
 
 # Банки для выбора
 BANKS_LIST = [
@@ -42,3 +107,10 @@ STATUS_PENDING = 'pending'
 STATUS_CONFIRMED = 'confirmed'
 STATUS_CANCELLED = 'cancelled'
 STATUS_COMPLETED = 'completed'
+STATUS_REJECTED = 'rejected'
+STATUS_EXPIRED = 'expired'
+
+# Статусы рассылки
+BROADCAST_RUNNING = 'running'
+BROADCAST_DONE = 'done'
+BROADCAST_CANCELLED = 'cancelled'
@@ -1,189 +1,462 @@
-import aiosqlite
+import json
 import logging
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
-from config import DATABASE_PATH, ROLE_CUSTOMER, STATUS_PENDING
+import re
+from datetime import date, datetime, timedelta
+from typing import Optional, List, Dict, Any, Tuple
+from config import (
+    DATABASE_PATH, ROLE_CUSTOMER, ROLE_ADMIN, STATUS_PENDING, STATUS_CONFIRMED, STATUS_CANCELLED,
+    STATUS_COMPLETED, STATUS_REJECTED, STATUS_EXPIRED, BROADCAST_RUNNING, PAGINATION_SIZE, ANALYTICS_PEAK_HOURS, SLOTS_PAGE_SIZE,
+    ADMIN_SEARCH_LIMIT
+)
+from db_pool import get_pool
+from availability import get_engine, subtract_intervals
+from cache import get_user_cache, get_admin_cache, MISSING
+from migrations import migrate, backfills_pending, run_pending_backfills, STATS_COUNTERS_SQL
+from analytics import COUNTED_STATUSES, MINUTES_PER_DAY, apply_booking_rollup, epoch_day
+from pagination import Page, fetch_page, keyset_sql
+from utils import (
+    split_slot, calculate_hours, calculate_price, to_epoch_minutes, from_epoch_minutes,
+    minutes_of_day, to_datetime
+)
 
 logger = logging.getLogger(__name__)
 
+# Частые запросы, план которых проверяется при запуске
+HOT_QUERIES = {
+    'get_user_by_telegram_id': 'SELECT * FROM users WHERE telegram_id = ?',
+    'get_broadcast_recipients': 'SELECT id, telegram_id FROM users WHERE id > ? ORDER BY id LIMIT ?',
+    'get_spots_by_supplier': 'SELECT * FROM parking_spots WHERE supplier_id = ? ORDER BY created_at DESC',
+    'get_available_slots': '''
+        SELECT sa.*, ps.spot_number, ps.price_per_hour, ps.address,
+               ps.is_partial_allowed, ps.supplier_id
+        FROM spot_availability sa
+        JOIN parking_spots ps ON sa.spot_id = ps.id
+        WHERE ps.is_available = 1
+          AND sa.is_booked = 0
+          AND sa.start_min >= ?
+          AND sa.end_min <= ?
+        ORDER BY ps.spot_number
+    ''',
+    'get_slots_by_ids': '''
+        SELECT sa.*, ps.spot_number, ps.price_per_hour, ps.address,
+               ps.is_partial_allowed, ps.supplier_id
+        FROM spot_availability sa
+        JOIN parking_spots ps ON sa.spot_id = ps.id
+        WHERE sa.id IN (SELECT value FROM json_each(?))
+          AND sa.is_booked = 0
+          AND ps.is_available = 1
+    ''',
+    'get_active_rules': '''
+        SELECT id, spot_id, weekdays, start_minute, end_minute, valid_from, until_day
+        FROM availability_rules
+        WHERE valid_from <= ? AND (until_day IS NULL OR until_day >= ?)
+    ''',
+    'get_rule_expansions': '''
+        SELECT rule_id, day FROM rule_expansions
+        WHERE rule_id IN (SELECT value FROM json_each(?)) AND day BETWEEN ? AND ?
+    ''',
+    'due_pending_bookings': '''
+        SELECT id FROM bookings INDEXED BY idx_bookings_pending_created
+        WHERE status = 'pending' AND created_at <= datetime('now', ?)
+        UNION
+        SELECT id FROM bookings
+        WHERE status = 'pending' AND end_min <= ?
+        LIMIT ?
+    ''',
+    'due_confirmed_bookings': '''
+        SELECT id FROM bookings
+        WHERE status = 'confirmed' AND end_min <= ?
+        LIMIT ?
+    ''',
+    'get_booking_parties': '''
+        SELECT b.id, b.customer_id, b.spot_id, b.start_min, b.end_min, b.total_price, b.status,
+               ps.spot_number, ps.address, ps.supplier_id,
+               cu.telegram_id AS customer_telegram_id, cu.full_name AS customer_name,
+               cu.phone AS customer_phone,
+               su.telegram_id AS supplier_telegram_id, su.bank AS supplier_bank,
+               su.card_number AS supplier_card
+        FROM bookings b
+        JOIN parking_spots ps ON b.spot_id = ps.id
+        JOIN users cu ON b.customer_id = cu.id
+        JOIN users su ON ps.supplier_id = su.id
+        WHERE b.id = ?
+    ''',
+    'adjacent_free_slots': '''
+        SELECT id, start_min, end_min FROM spot_availability
+        WHERE spot_id = ? AND is_booked = 0 AND start_min <= ? AND end_min >= ?
+    ''',
+    'check_slot_availability': '''
+        SELECT COUNT(*) FROM spot_availability sa
+        JOIN parking_spots ps ON ps.id = sa.spot_id AND ps.is_available = 1
+        WHERE sa.spot_id = ? AND sa.is_booked = 0 AND sa.start_min <= ? AND sa.end_min >= ?
+    ''',
+    'booking_overlap': '''
+        SELECT 1 FROM bookings
+        WHERE spot_id = ? AND status IN (?, ?) AND start_min < ? AND end_min > ?
+        LIMIT 1
+    ''',
+    'fetch_free_slots': '''
+        SELECT id, spot_id, start_min, end_min FROM spot_availability
+        WHERE is_booked = 0 AND end_min > ?
+    ''',
+    'get_new_slots': '''
+        SELECT sa.id, sa.spot_id, sa.start_min, sa.end_min, sa.is_booked,
+               ps.is_available, ps.spot_number, ps.address, ps.price_per_hour
+        FROM spot_availability sa
+        JOIN parking_spots ps ON sa.spot_id = ps.id
+        WHERE sa.id > ?
+        ORDER BY sa.id
+        LIMIT ?
+    ''',
+    'match_notifications': '''
+        SELECT n.id, n.user_id, u.telegram_id, n.desired_date, n.desired_start, n.desired_end
+        FROM notifications n
+        JOIN users u ON n.user_id = u.id
+        WHERE n.is_active = 1
+          AND n.desired_date = ?
+          AND n.desired_start >= ?
+          AND n.desired_end <= ?
+          AND (n.spot_id IS NULL OR n.spot_id = ?)
+          AND u.is_active = 1
+    ''',
+    'get_upcoming_reminders': '''
+        SELECT id, start_min FROM bookings
+        WHERE status = 'confirmed' AND reminder_sent_at IS NULL
+          AND start_min > ? AND start_min <= ?
+    ''',
+    'search_users': '''
+        SELECT u.* FROM users_fts
+        JOIN users u ON u.id = users_fts.rowid
+        WHERE users_fts MATCH ?
+        ORDER BY users_fts.rank LIMIT ?
+    ''',
+    'search_spots': '''
+        SELECT ps.* FROM spots_fts
+        JOIN parking_spots ps ON ps.id = spots_fts.rowid
+        WHERE spots_fts MATCH ?
+        ORDER BY spots_fts.rank LIMIT ?
+    ''',
+    'users_count': '''
+        SELECT COALESCE(MAX(value), 0) FROM stats_counters WHERE name = 'users'
+    ''',
+    'get_users_by_ids': '''
+        SELECT * FROM users WHERE id IN (SELECT value FROM json_each(?))
+    ''',
+    'check_admin_session': '''
+        SELECT expires_at FROM admin_sessions WHERE user_id = ?
+    ''',
+    'get_admin_access': '''
+        SELECT u.role, s.expires_at FROM users u
+        LEFT JOIN admin_sessions s ON s.user_id = u.id
+        WHERE u.telegram_id = ?
+    ''',
+    'expired_admin_sessions': '''
+        SELECT id FROM admin_sessions WHERE expires_at <= ? LIMIT ?
+    ''',
+}
+
+
+# Переходы статусов бронирования и сторона, которая их выполняет (None — только система)
+BOOKING_TRANSITIONS = {
+    (STATUS_PENDING, STATUS_CONFIRMED): 'supplier',
+    (STATUS_PENDING, STATUS_REJECTED): 'supplier',
+    (STATUS_PENDING, STATUS_CANCELLED): 'customer',
+    (STATUS_PENDING, STATUS_EXPIRED): None,
+    (STATUS_CONFIRMED, STATUS_CANCELLED): 'customer',
+    (STATUS_CONFIRMED, STATUS_COMPLETED): None,
+}
+
+# Статусы, в которых бронирование держит время места
+HOLDING_STATUSES = (STATUS_PENDING, STATUS_CONFIRMED)
+
+
+# Списки с keyset-пагинацией: (SELECT без WHERE, условия фильтра, префикс таблицы с created_at)
+PAGED_QUERIES = {
+    'users': ('SELECT * FROM users', [], ''),
+    'parking_spots': ('SELECT * FROM parking_spots', [], ''),
+    'user_bookings': ('''
+        SELECT b.*, ps.spot_number, ps.address, ps.supplier_id
+        FROM bookings b
+        JOIN parking_spots ps ON b.spot_id = ps.id
+    ''', ['b.customer_id = ?'], 'b.'),
+    'supplier_bookings': ('''
+        SELECT b.*, ps.spot_number, u.full_name as customer_name, u.phone
+        FROM bookings b
+        JOIN parking_spots ps ON b.spot_id = ps.id
+        JOIN users u ON b.customer_id = u.id
+    ''', ['ps.supplier_id = ?'], 'b.'),
+    'available_slots': ('''
+        SELECT sa.*, ps.spot_number, ps.price_per_hour, ps.address,
+               ps.is_partial_allowed, ps.supplier_id
+        FROM spot_availability sa
+        JOIN parking_spots ps ON sa.spot_id = ps.id
+    ''', ['ps.is_available = 1', 'sa.is_booked = 0', 'sa.start_min >= ?', 'sa.end_min <= ?'], 'sa.'),
+    'all_bookings': ('''
+        SELECT b.*, ps.spot_number,
+               u1.full_name as customer_name,
+               u2.full_name as supplier_name
+        FROM bookings b
+        JOIN parking_spots ps ON b.spot_id = ps.id
+        JOIN users u1 ON b.customer_id = u1.id
+        JOIN users u2 ON ps.supplier_id = u2.id
+    ''', [], 'b.'),
+}
+
+# Порядок страниц, отличный от «новые первыми» по (created_at, id)
+PAGED_ORDER = {
+    'available_slots': {'key': ('start_min', 'id'), 'descending': False},
+}
+
+
+def _with_times(row) -> Dict[str, Any]:
+    """Строка БД в dict; start_min/end_min превращаются в готовые datetime start_time/end_time"""
+    item = dict(row)
+    if 'start_min' in item:
+        item['start_time'] = from_epoch_minutes(item.pop('start_min'))
+    if 'end_min' in item:
+        item['end_time'] = from_epoch_minutes(item.pop('end_min'))
+    return item
+
+
+def fts_prefix_query(text: str, phone_column: Optional[str] = None) -> Optional[str]:
+    """
+    Запрос FTS5 из ввода пользователя: каждое слово — префикс, все слова обязательны.
+    Слова берутся в кавычки, поэтому операторы FTS5 во вводе не действуют.
+    С phone_column ввод из цифр ищется еще и как начало номера в этой колонке
+    """
+    words = re.findall(r'\w+', text.lower())
+    query = ' '.join(f'"{word}"*' for word in words)
+    if not query:
+        return None
+
+    # Номер телефона целиком ищется по колонке из одних цифр (8 и номер без кода — как +7)
+    if phone_column and re.fullmatch(r'[\d\s()+\-]+', text.strip()):
+        digits = re.sub(r'\D', '', text)
+        if digits.startswith('8'):
+            digits = '7' + digits[1:]
+        elif len(digits) == 10:
+            digits = '7' + digits
+        return f'{phone_column} : "{digits}"* OR ({query})'
+    return query
+
 
 class Database:
     def __init__(self, db_path: str = DATABASE_PATH):
         self.db_path = db_path
+        # Пул общий для всех экземпляров Database с одним путем к файлу
+        self.pool = get_pool(db_path)
+        # Индекс свободного времени в памяти, тоже общий
+        self.availability = get_engine(db_path)
+        # Кэш пользователей по telegram_id, сбрасывается при изменении пользователя
+        self.user_cache = get_user_cache(db_path)
+        # Кэш прав администратора по telegram_id; запись живет не дольше сессии
+        self.admin_cache = get_admin_cache(db_path)
+
+    async def connect(self):
+        """Открытие пула соединений"""
+        await self.pool.open()
+
+    async def close(self):
+        """Закрытие пула соединений"""
+        await self.pool.close()
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Статистика пула соединений"""
+        return self.pool.stats()
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Статистика кэша пользователей"""
+        return self.user_cache.stats()
+
+    def admin_cache_stats(self) -> Dict[str, Any]:
+        """Статистика кэша прав администратора"""
+        return self.admin_cache.stats()
 
     async def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Таблица пользователей
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER UNIQUE NOT NULL,
-                    username TEXT,
-                    full_name TEXT NOT NULL,
-                    phone TEXT NOT NULL,
-                    card_number TEXT NOT NULL,
-                    bank TEXT NOT NULL,
-                    role TEXT DEFAULT 'customer',
-                    is_active INTEGER DEFAULT 1,
-                    balance REAL DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+        """Инициализация базы данных: применение недостающих миграций (без заполнения данных)"""
+        await migrate(self.pool)
+        logger.info("База данных инициализирована")
 
-            # Таблица парковочных мест
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS parking_spots (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    supplier_id INTEGER NOT NULL,
-                    spot_number TEXT NOT NULL,
-                    address TEXT,
-                    description TEXT,
-                    price_per_hour REAL NOT NULL,
-                    is_partial_allowed INTEGER DEFAULT 1,
-                    is_available INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (supplier_id) REFERENCES users(id)
-                )
-            ''')
+    async def run_backfills(self) -> List[int]:
+        """Заполнение данных отложенных миграций; версии завершенных миграций"""
+        return await run_pending_backfills(self.pool)
 
-            # Таблица доступности мест
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS spot_availability (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    spot_id INTEGER NOT NULL,
-                    start_time TIMESTAMP NOT NULL,
-                    end_time TIMESTAMP NOT NULL,
-                    is_booked INTEGER DEFAULT 0,
-                    booked_by INTEGER,
-                    booking_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (spot_id) REFERENCES parking_spots(id),
-                    FOREIGN KEY (booked_by) REFERENCES users(id),
-                    FOREIGN KEY (booking_id) REFERENCES bookings(id)
-                )
-            ''')
+    async def backfills_pending(self) -> bool:
+        """Есть ли миграции с незавершенным заполнением данных"""
+        return await backfills_pending(self.pool)
 
-            # Таблица бронирований
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS bookings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_id INTEGER NOT NULL,
-                    spot_id INTEGER NOT NULL,
-                    start_time TIMESTAMP NOT NULL,
-                    end_time TIMESTAMP NOT NULL,
-                    total_price REAL NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    payment_method TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (customer_id) REFERENCES users(id),
-                    FOREIGN KEY (spot_id) REFERENCES parking_spots(id)
-                )
-            ''')
+    async def check_query_plans(self) -> List[str]:
+        """Проверка планов частых запросов: предупреждение о полном сканировании"""
+        problems = []
+        async with self.pool.reader() as db:
+            # EXPLAIN не сверяет версию схемы: настоящее чтение обновит кэш индексов
+            async with db.execute('SELECT COUNT(*) FROM sqlite_master'):
+                pass
 
-            # Таблица уведомлений
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS notifications (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    spot_id INTEGER,
-                    desired_date DATE NOT NULL,
-                    desired_start TIME NOT NULL,
-                    desired_end TIME NOT NULL,
-                    is_active INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                )
-            ''')
+            queries = dict(HOT_QUERIES)
+            for name, (select_sql, conditions, alias) in PAGED_QUERIES.items():
+                queries[f'{name}_page'] = keyset_sql(select_sql, conditions, alias, after_key=True,
+                                                     **PAGED_ORDER.get(name, {}))
 
-            # Таблица админских сессий
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS admin_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    expires_at TIMESTAMP NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                )
-            ''')
+            for name, sql in queries.items():
+                params = (None,) * sql.count('?')
+                async with db.execute(f'EXPLAIN QUERY PLAN {sql}', params) as cursor:
+                    rows = await cursor.fetchall()
 
-            await db.commit()
-            logger.info("База данных инициализирована")
+                for row in rows:
+                    detail = row[3]
+                    # SCAN json_each — обход списка из параметра, а не таблицы
+                    if detail.startswith('SCAN') and 'USING' not in detail and 'VIRTUAL TABLE' not in detail:
+                        problems.append(name)
+                        logger.warning(f"Полное сканирование в запросе {name}: {detail}")
+                        break
+        return problems
 
     # ===== ПОЛЬЗОВАТЕЛИ =====
     async def add_user(self, telegram_id: int, username: str, full_name: str, 
                        phone: str, card_number: str, bank: str) -> Optional[int]:
         """Добавление нового пользователя"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.writer() as db:
                 cursor = await db.execute('''
                     INSERT INTO users (telegram_id, username, full_name, phone, card_number, bank)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (telegram_id, username, full_name, phone, card_number, bank))
-                await db.commit()
-                return cursor.lastrowid
+            self.user_cache.invalidate(telegram_id)
+            return cursor.lastrowid
         except Exception as e:
             logger.error(f"Ошибка добавления пользователя: {e}")
             return None
 
     async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[Dict[str, Any]]:
         """Получение пользователя по Telegram ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        cached = self.user_cache.get(telegram_id)
+        if cached is not MISSING:
+            return dict(cached) if cached else None
+
+        # Метку берем до чтения: если сброс придет во время запроса, устаревшая строка не закэшируется
+        token = self.user_cache.token()
+        async with self.pool.reader() as db:
             async with db.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,)) as cursor:
                 row = await cursor.fetchone()
-                return dict(row) if row else None
+        user = dict(row) if row else None
+        self.user_cache.set(telegram_id, user, token=token)
+        return dict(user) if user else None
 
     async def update_user_role(self, telegram_id: int, role: str) -> bool:
         """Обновление роли пользователя"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.writer() as db:
                 await db.execute('UPDATE users SET role = ? WHERE telegram_id = ?', (role, telegram_id))
-                await db.commit()
-                return True
+            self.user_cache.invalidate(telegram_id)
+            self.admin_cache.invalidate(telegram_id)
+            return True
         except Exception as e:
             logger.error(f"Ошибка обновления роли: {e}")
             return False
 
-    async def get_all_users(self, offset: int = 0, limit: int = 10) -> List[Dict[str, Any]]:
-        """Получение всех пользователей с пагинацией"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                'SELECT * FROM users ORDER BY created_at DESC LIMIT ? OFFSET ?',
-                (limit, offset)
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+    async def _get_telegram_id(self, db, user_id: int) -> Optional[int]:
+        """Telegram ID по внутреннему ID (для сброса кэша)"""
+        async with db.execute('SELECT telegram_id FROM users WHERE id = ?', (user_id,)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+    async def _page(self, name: str, params: tuple, cursor: Optional[str], limit: int,
+                    backward: bool, convert=dict) -> Page:
+        select_sql, conditions, alias = PAGED_QUERIES[name]
+        async with self.pool.reader() as db:
+            return await fetch_page(db, select_sql, conditions, params, cursor, limit,
+                                    backward=backward, alias=alias, convert=convert)
+
+    async def get_all_users(self, cursor: Optional[str] = None, limit: int = PAGINATION_SIZE,
+                            backward: bool = False) -> Page:
+        """Страница пользователей, новые первыми"""
+        return await self._page('users', (), cursor, limit, backward)
+
+    async def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Получение пользователя по внутреннему ID"""
+        async with self.pool.reader() as db:
+            async with db.execute('SELECT * FROM users WHERE id = ?', (user_id,)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def get_users_by_ids(self, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Пользователи по списку внутренних ID одним запросом: {id: пользователь}"""
+        if not user_ids:
+            return {}
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['get_users_by_ids'], (json.dumps(list(user_ids)),)) as cursor:
+                return {row['id']: dict(row) for row in await cursor.fetchall()}
 
     async def get_users_count(self) -> int:
-        """Получение общего количества пользователей"""
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute('SELECT COUNT(*) FROM users') as cursor:
+        """Общее количество пользователей из счетчика stats_counters (ведется триггерами)"""
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['users_count']) as cursor:
                 row = await cursor.fetchone()
-                return row[0] if row else 0
+                return int(row[0]) if row else 0
 
-    async def block_user(self, user_id: int) -> bool:
-        """Блокировка пользователя"""
+    async def _update_users(self, user_ids: List[int], column: str, value) -> List[int]:
+        """
+        Изменение поля у пользователей по внутренним ID в одной транзакции.
+        Возвращает Telegram ID измененных пользователей
+        """
+        if not user_ids:
+            return []
+        ids = json.dumps(list(user_ids))
+        async with self.pool.writer() as db:
+            async with db.execute(
+                'SELECT telegram_id FROM users WHERE id IN (SELECT value FROM json_each(?))', (ids,)
+            ) as cursor:
+                telegram_ids = [row[0] for row in await cursor.fetchall()]
+            await db.execute(
+                f'UPDATE users SET {column} = ? WHERE id IN (SELECT value FROM json_each(?))', (value, ids)
+            )
+        # Сбрасываем кэш после коммита, чтобы его не заполнили старой строкой
+        for telegram_id in telegram_ids:
+            self.user_cache.invalidate(telegram_id)
+            self.admin_cache.invalidate(telegram_id)
+        return telegram_ids
+
+    async def set_users_role(self, user_ids: List[int], role: str) -> Optional[List[int]]:
+        """Назначение роли пользователям по внутренним ID; Telegram ID измененных или None при ошибке"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('UPDATE users SET is_active = 0 WHERE id = ?', (user_id,))
-                await db.commit()
-                return True
+            return await self._update_users(user_ids, 'role', role)
         except Exception as e:
-            logger.error(f"Ошибка блокировки пользователя: {e}")
-            return False
+            logger.error(f"Ошибка обновления роли: {e}")
+            return None
+
+    async def set_users_active(self, user_ids: List[int], is_active: bool) -> Optional[List[int]]:
+        """Блокировка или разблокировка пользователей; Telegram ID измененных или None при ошибке"""
+        try:
+            return await self._update_users(user_ids, 'is_active', int(is_active))
+        except Exception as e:
+            logger.error(f"Ошибка {'разблокировки' if is_active else 'блокировки'} пользователей: {e}")
+            return None
+
+    async def block_user(self, user_id: int) -> bool:
+        """Блокировка пользователя"""
+        return bool(await self.set_users_active([user_id], False))
 
     async def unblock_user(self, user_id: int) -> bool:
         """Разблокировка пользователя"""
+        return bool(await self.set_users_active([user_id], True))
+
+    async def _search(self, name: str, text: str, limit: int,
+                      phone_column: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = fts_prefix_query(text, phone_column)
+        if not query:
+            return []
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('UPDATE users SET is_active = 1 WHERE id = ?', (user_id,))
-                await db.commit()
-                return True
+            async with self.pool.reader() as db:
+                async with db.execute(HOT_QUERIES[name], (query, limit)) as cursor:
+                    return [dict(row) for row in await cursor.fetchall()]
         except Exception as e:
-            logger.error(f"Ошибка разблокировки пользователя: {e}")
-            return False
+            logger.error(f"Ошибка поиска ({name}): {e}")
+            return []
+
+    async def search_users(self, text: str, limit: int = ADMIN_SEARCH_LIMIT) -> List[Dict[str, Any]]:
+        """Поиск пользователей по началу слов в имени, username и телефоне или по номеру целиком (FTS5)"""
+        return await self._search('search_users', text, limit, phone_column='phone_digits')
 
     # ===== ПАРКОВОЧНЫЕ МЕСТА =====
     async def add_parking_spot(self, supplier_id: int, spot_number: str, 
@@ -191,14 +464,13 @@ class Database:
                                description: str = None, is_partial_allowed: bool = True) -> Optional[int]:
         """Добавление парковочного места"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.writer() as db:
                 cursor = await db.execute('''
                     INSERT INTO parking_spots (supplier_id, spot_number, address, description, 
                                                price_per_hour, is_partial_allowed)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (supplier_id, spot_number, address, description, price_per_hour, 
                       1 if is_partial_allowed else 0))
-                await db.commit()
                 return cursor.lastrowid
         except Exception as e:
             logger.error(f"Ошибка добавления парковочного места: {e}")
@@ -206,8 +478,7 @@ class Database:
 
     async def get_spots_by_supplier(self, supplier_id: int) -> List[Dict[str, Any]]:
         """Получение всех мест поставщика"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             async with db.execute(
                 'SELECT * FROM parking_spots WHERE supplier_id = ? ORDER BY created_at DESC',
                 (supplier_id,)
@@ -217,8 +488,7 @@ class Database:
 
     async def get_parking_spot(self, spot_id: int) -> Optional[Dict[str, Any]]:
         """Получение парковочного места по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             async with db.execute('SELECT * FROM parking_spots WHERE id = ?', (spot_id,)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
@@ -226,10 +496,9 @@ class Database:
     async def update_spot_price(self, spot_id: int, price: float) -> bool:
         """Обновление цены парковочного места"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.writer() as db:
                 await db.execute('UPDATE parking_spots SET price_per_hour = ? WHERE id = ?', 
                                (price, spot_id))
-                await db.commit()
                 return True
         except Exception as e:
             logger.error(f"Ошибка обновления цены: {e}")
@@ -238,131 +507,395 @@ class Database:
     async def toggle_spot_visibility(self, spot_id: int) -> bool:
         """Переключение видимости места"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.writer() as db:
                 async with db.execute('SELECT is_available FROM parking_spots WHERE id = ?', 
                                     (spot_id,)) as cursor:
                     row = await cursor.fetchone()
-                    if row:
-                        new_status = 0 if row[0] == 1 else 1
-                        await db.execute('UPDATE parking_spots SET is_available = ? WHERE id = ?', 
-                                       (new_status, spot_id))
-                        await db.commit()
-                        return True
-            return False
+                if not row:
+                    return False
+                new_status = 0 if row[0] == 1 else 1
+                await db.execute('UPDATE parking_spots SET is_available = ? WHERE id = ?', 
+                               (new_status, spot_id))
+            self.availability.set_spot_visible(spot_id, bool(new_status))
+            return True
         except Exception as e:
             logger.error(f"Ошибка переключения видимости: {e}")
             return False
 
-    async def get_all_parking_spots(self) -> List[Dict[str, Any]]:
-        """Получение всех парковочных мест"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('SELECT * FROM parking_spots ORDER BY created_at DESC') as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+    async def search_spots(self, text: str, limit: int = ADMIN_SEARCH_LIMIT) -> List[Dict[str, Any]]:
+        """Поиск мест по началу слов в номере, адресе и описании (FTS5)"""
+        return await self._search('search_spots', text, limit)
+
+    async def get_all_parking_spots(self, cursor: Optional[str] = None, limit: int = PAGINATION_SIZE,
+                                    backward: bool = False) -> Page:
+        """Страница парковочных мест, новые первыми"""
+        return await self._page('parking_spots', (), cursor, limit, backward)
 
     # ===== ДОСТУПНОСТЬ МЕСТ =====
+    async def _fetch_free_slots(self, db, now: Optional[datetime] = None) -> List[tuple]:
+        """Будущие свободные слоты (id, spot_id, start_min, end_min)"""
+        async with db.execute(HOT_QUERIES['fetch_free_slots'],
+                              (to_epoch_minutes(now or datetime.now()),)) as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]
+
+    async def _fetch_hidden_spots(self, db) -> List[int]:
+        async with db.execute('SELECT id FROM parking_spots WHERE is_available = 0') as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def load_availability(self):
+        """Загрузка индекса свободного времени из БД"""
+        async with self.pool.reader() as db:
+            hidden = await self._fetch_hidden_spots(db)
+            free_slots = await self._fetch_free_slots(db)
+        self.availability.load(hidden, free_slots)
+
+    async def verify_availability(self) -> List[int]:
+        """
+        Удаление прошедших слотов из индекса свободного времени и сверка его с БД;
+        места, по которым индекс разошелся (например, после записи другим процессом),
+        перечитываются. Возвращает ID этих мест.
+        """
+        if not self.availability.loaded:
+            await self.load_availability()
+            return []
+
+        now = datetime.now()
+        # Под блокировкой записи: изменения этого процесса не попадут между выборкой и сверкой
+        async with self.pool.writer() as db:
+            hidden = await self._fetch_hidden_spots(db)
+            free_slots = await self._fetch_free_slots(db, now)
+            pruned = self.availability.prune(now)
+            mismatched = self.availability.diff(hidden, free_slots)
+            if mismatched:
+                logger.warning(f"Индекс доступности расходится с БД по местам: {mismatched[:20]}")
+                self.availability.reload_spots(mismatched, hidden, free_slots)
+        if pruned:
+            logger.info(f"Из индекса доступности удалено прошедших слотов: {pruned}")
+        return mismatched
+
+    async def find_free_spots(self, start_time: datetime, end_time: datetime) -> Dict[int, int]:
+        """Места, свободные на весь интервал: spot_id -> id слота"""
+        if not self.availability.loaded:
+            await self.load_availability()
+        await self.expand_availability_rules(start_time, end_time)
+        return self.availability.free_spots(start_time, end_time)
+
+    async def find_free_spots_range(self, date_from: datetime, date_to: datetime,
+                                    time_from: str, time_to: str) -> List[Tuple[datetime, List[Dict[str, Any]]]]:
+        """
+        Свободные места на каждый день периода в ежедневное окно time_from-time_to (ЧЧ:ММ).
+        Один проход по индексу доступности и один запрос деталей слотов: [(день, слоты)],
+        в слотах дня сначала дешевые.
+        """
+        if not self.availability.loaded:
+            await self.load_availability()
+        await self.expand_availability_rules(date_from, date_to)
+        
+        first_day = date_from.replace(hour=0, minute=0, second=0, microsecond=0)
+        days = [first_day + timedelta(days=i) for i in range((date_to.date() - date_from.date()).days + 1)]
+        window_start, window_end = minutes_of_day(time_from), minutes_of_day(time_to)
+        windows = [(day + timedelta(minutes=window_start), day + timedelta(minutes=window_end)) for day in days]
+        
+        now = datetime.now()
+        free_by_day = [free if end > now else {}
+                       for free, (_, end) in zip(self.availability.free_by_window(windows), windows)]
+        slot_ids = sorted({slot_id for free in free_by_day for slot_id in free.values()})
+        
+        slots = {}
+        if slot_ids:
+            async with self.pool.reader() as db:
+                async with db.execute(HOT_QUERIES['get_slots_by_ids'], (json.dumps(slot_ids),)) as cursor:
+                    slots = {row['id']: _with_times(row) for row in await cursor.fetchall()}
+        
+        result = []
+        for day, free in zip(days, free_by_day):
+            day_slots = [slots[slot_id] for slot_id in free.values() if slot_id in slots]
+            day_slots.sort(key=lambda slot: (slot['price_per_hour'], slot['spot_number']))
+            result.append((day, day_slots))
+        return result
+
     async def add_availability(self, spot_id: int, start_time: datetime, 
                               end_time: datetime) -> Optional[int]:
         """Добавление периода доступности"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.writer() as db:
                 cursor = await db.execute('''
                     INSERT INTO spot_availability (spot_id, start_time, end_time)
                     VALUES (?, ?, ?)
                 ''', (spot_id, start_time, end_time))
-                await db.commit()
-                return cursor.lastrowid
+            self.availability.add_slot(cursor.lastrowid, spot_id, start_time, end_time)
+            return cursor.lastrowid
         except Exception as e:
             logger.error(f"Ошибка добавления доступности: {e}")
             return None
 
+    # ===== ПРАВИЛА ДОСТУПНОСТИ =====
+    async def add_availability_rule(self, spot_id: int, weekdays: List[int], start_time: str,
+                                    end_time: str, valid_from: date,
+                                    until: Optional[date] = None) -> Optional[int]:
+        """
+        Добавление повторяющегося правила: дни недели (0 — понедельник), время ЧЧ:ММ
+        и период действия. В spot_availability правило разворачивается только при поиске.
+        """
+        try:
+            mask = sum(1 << weekday for weekday in set(weekdays))
+            async with self.pool.writer() as db:
+                cursor = await db.execute('''
+                    INSERT INTO availability_rules (spot_id, weekdays, start_minute, end_minute,
+                                                    valid_from, until_day)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (spot_id, mask, minutes_of_day(start_time), minutes_of_day(end_time),
+                      epoch_day(valid_from), epoch_day(until) if until else None))
+                return cursor.lastrowid
+        except Exception as e:
+            logger.error(f"Ошибка добавления правила доступности: {e}")
+            return None
+
+    async def get_spot_rules(self, spot_id: int) -> List[Dict[str, Any]]:
+        """Правила доступности места"""
+        async with self.pool.reader() as db:
+            async with db.execute(
+                'SELECT * FROM availability_rules WHERE spot_id = ? ORDER BY id', (spot_id,)
+            ) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def get_availability_rule(self, rule_id: int) -> Optional[Dict[str, Any]]:
+        """Правило доступности по ID"""
+        async with self.pool.reader() as db:
+            async with db.execute('SELECT * FROM availability_rules WHERE id = ?', (rule_id,)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def delete_availability_rule(self, rule_id: int) -> bool:
+        """Удаление правила; уже развернутые дни остаются обычными слотами"""
+        try:
+            async with self.pool.transaction() as db:
+                await db.execute('DELETE FROM rule_expansions WHERE rule_id = ?', (rule_id,))
+                await db.execute('DELETE FROM availability_rules WHERE id = ?', (rule_id,))
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка удаления правила доступности: {e}")
+            return False
+
+    async def expand_availability_rules(self, date_from: datetime, date_to: datetime) -> int:
+        """
+        Ленивое разворачивание правил в свободные слоты на дни [date_from, date_to].
+        Каждый день правила разворачивается один раз (rule_expansions); из окна вычитается
+        время, уже занятое слотами и бронированиями места. Возвращает число новых слотов.
+        """
+        day_from = max(epoch_day(date_from.date()), epoch_day(date.today()))
+        day_to = epoch_day(date_to.date())
+        if day_from > day_to:
+            return 0
+
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['get_active_rules'], (day_to, day_from)) as cursor:
+                rules = [dict(row) for row in await cursor.fetchall()]
+            if not rules:
+                return 0
+            async with db.execute(HOT_QUERIES['get_rule_expansions'], (
+                json.dumps([rule['id'] for rule in rules]), day_from, day_to
+            )) as cursor:
+                expanded = {tuple(row) for row in await cursor.fetchall()}
+
+        now = to_epoch_minutes(datetime.now())
+        pending = []
+        for rule in rules:
+            last_day = day_to if rule['until_day'] is None else min(day_to, rule['until_day'])
+            for day in range(max(day_from, rule['valid_from']), last_day + 1):
+                # День эпохи 0 (01.01.1970) — четверг
+                if rule['weekdays'] >> ((day + 3) % 7) & 1 and (rule['id'], day) not in expanded:
+                    pending.append((rule, day))
+        if not pending:
+            return 0
+
+        created = []
+        try:
+            async with self.pool.transaction() as db:
+                for rule, day in pending:
+                    cursor = await db.execute(
+                        'INSERT OR IGNORE INTO rule_expansions (rule_id, day) VALUES (?, ?)',
+                        (rule['id'], day)
+                    )
+                    if not cursor.rowcount:
+                        continue  # день уже развернут параллельным поиском
+                    start = day * MINUTES_PER_DAY + rule['start_minute']
+                    end = day * MINUTES_PER_DAY + rule['end_minute']
+                    if end <= now:
+                        continue
+                    async with db.execute('''
+                        SELECT start_min, end_min FROM spot_availability
+                        WHERE spot_id = ? AND start_min < ? AND end_min > ?
+                        UNION ALL
+                        SELECT start_min, end_min FROM bookings
+                        WHERE spot_id = ? AND status IN (?, ?) AND start_min < ? AND end_min > ?
+                    ''', (rule['spot_id'], end, start, rule['spot_id'],
+                          STATUS_PENDING, STATUS_CONFIRMED, end, start)) as cursor:
+                        busy = [tuple(row) for row in await cursor.fetchall()]
+                    for free_start, free_end in subtract_intervals(start, end, busy):
+                        start_time, end_time = from_epoch_minutes(free_start), from_epoch_minutes(free_end)
+                        cursor = await db.execute('''
+                            INSERT INTO spot_availability (spot_id, start_time, end_time)
+                            VALUES (?, ?, ?)
+                        ''', (rule['spot_id'], start_time, end_time))
+                        created.append((cursor.lastrowid, rule['spot_id'], start_time, end_time))
+        except Exception as e:
+            logger.error(f"Ошибка разворачивания правил доступности: {e}")
+            return 0
+
+        for slot_id, spot_id, start_time, end_time in created:
+            self.availability.add_slot(slot_id, spot_id, start_time, end_time)
+        return len(created)
+
     async def get_available_slots(self, date: datetime) -> List[Dict[str, Any]]:
         """Получение доступных слотов на дату"""
-        start_of_day = date.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = date.replace(hour=23, minute=59, second=59, microsecond=999999)
+        await self.expand_availability_rules(date, date)
+        start_of_day = to_epoch_minutes(date.replace(hour=0, minute=0, second=0, microsecond=0))
+        # Слот, заканчивающийся ровно в полночь, тоже относится к этому дню
+        end_of_day = start_of_day + 24 * 60
         
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('''
-                SELECT sa.*, ps.spot_number, ps.price_per_hour, ps.address, 
-                       ps.is_partial_allowed, ps.supplier_id
-                FROM spot_availability sa
-                JOIN parking_spots ps ON sa.spot_id = ps.id
-                WHERE ps.is_available = 1
-                  AND sa.is_booked = 0
-                  AND sa.start_time >= ?
-                  AND sa.end_time <= ?
-                ORDER BY ps.spot_number
-            ''', (start_of_day, end_of_day)) as cursor:
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['get_available_slots'],
+                                  (start_of_day, end_of_day)) as cursor:
                 rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                return [_with_times(row) for row in rows]
+
+    async def get_available_slots_page(self, date: datetime, cursor: Optional[str] = None,
+                                       limit: int = SLOTS_PAGE_SIZE, backward: bool = False,
+                                       max_price: Optional[float] = None,
+                                       time_from: Optional[str] = None, time_to: Optional[str] = None,
+                                       address: Optional[str] = None) -> Page:
+        """
+        Страница свободных слотов на дату по курсору (start_min, id), раньше начинающиеся первыми.
+        Фильтры: цена до max_price, слот вмещает интервал time_from-time_to (ЧЧ:ММ),
+        адрес содержит address.
+        """
+        if cursor is None:
+            await self.expand_availability_rules(date, date)
+        start_of_day = to_epoch_minutes(date.replace(hour=0, minute=0, second=0, microsecond=0))
+        select_sql, conditions, alias = PAGED_QUERIES['available_slots']
+        conditions = list(conditions)
+        params = [start_of_day, start_of_day + 24 * 60]
+
+        if max_price is not None:
+            conditions.append('ps.price_per_hour <= ?')
+            params.append(max_price)
+        if time_from and time_to:
+            conditions.append('sa.start_min <= ? AND sa.end_min >= ?')
+            params.extend([start_of_day + minutes_of_day(time_from), start_of_day + minutes_of_day(time_to)])
+        if address:
+            conditions.append("ps.address LIKE ? ESCAPE '\\'")
+            params.append('%' + address.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+
+        async with self.pool.reader() as db:
+            return await fetch_page(db, select_sql, conditions, params, cursor, limit,
+                                    backward=backward, alias=alias, convert=_with_times,
+                                    **PAGED_ORDER['available_slots'])
+
+    async def get_free_slot(self, slot_id: int) -> Optional[Dict[str, Any]]:
+        """Свободный слот видимого места с данными места"""
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['get_slots_by_ids'], (json.dumps([slot_id]),)) as cursor:
+                row = await cursor.fetchone()
+                return _with_times(row) if row else None
 
     async def check_slot_availability(self, spot_id: int, start_time: datetime, 
                                      end_time: datetime) -> bool:
         """Проверка доступности слота"""
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute('''
-                SELECT COUNT(*) FROM spot_availability
-                WHERE spot_id = ?
-                  AND is_booked = 0
-                  AND start_time <= ?
-                  AND end_time >= ?
-            ''', (spot_id, start_time, end_time)) as cursor:
+        await self.expand_availability_rules(start_time, end_time)
+        if self.availability.loaded:
+            return self.availability.is_free(spot_id, start_time, end_time)
+
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['check_slot_availability'], (
+                spot_id, to_epoch_minutes(start_time), to_epoch_minutes(end_time)
+            )) as cursor:
                 row = await cursor.fetchone()
                 return row[0] > 0 if row else False
 
-    async def book_slot(self, availability_id: int, customer_id: int, 
-                       booking_id: int) -> bool:
-        """Бронирование слота"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('''
-                    UPDATE spot_availability 
-                    SET is_booked = 1, booked_by = ?, booking_id = ?
-                    WHERE id = ?
-                ''', (customer_id, booking_id, availability_id))
-                await db.commit()
-                return True
-        except Exception as e:
-            logger.error(f"Ошибка бронирования слота: {e}")
-            return False
-
     # ===== БРОНИРОВАНИЯ =====
-    async def create_booking(self, customer_id: int, spot_id: int, 
-                           start_time: datetime, end_time: datetime, 
-                           total_price: float) -> Optional[int]:
-        """Создание бронирования"""
+    async def reserve_interval(self, spot_id: int, start_time: datetime,
+                               end_time: datetime, customer_id: int) -> Optional[int]:
+        """
+        Атомарное бронирование интервала внутри свободного слота.
+        В одной транзакции: проверка пересечений, создание бронирования и замена
+        слота на забронированный интервал и свободные остатки (split_slot).
+        Пустой, перевернутый или уже закончившийся интервал не бронируется.
+        """
+        if start_time >= end_time or end_time <= datetime.now():
+            return None
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.transaction() as db:
+                async with db.execute(
+                    'SELECT price_per_hour, is_partial_allowed, is_available FROM parking_spots WHERE id = ?',
+                    (spot_id,)
+                ) as cursor:
+                    spot = await cursor.fetchone()
+                if not spot or not spot['is_available']:
+                    return None
+
+                start_min, end_min = to_epoch_minutes(start_time), to_epoch_minutes(end_time)
+                async with db.execute('''
+                    SELECT id, start_min, end_min FROM spot_availability
+                    WHERE spot_id = ? AND is_booked = 0 AND start_min <= ? AND end_min >= ?
+                    ORDER BY start_min DESC
+                    LIMIT 1
+                ''', (spot_id, start_min, end_min)) as cursor:
+                    slot = await cursor.fetchone()
+                if not slot:
+                    return None
+
+                slot_start = from_epoch_minutes(slot['start_min'])
+                slot_end = from_epoch_minutes(slot['end_min'])
+                remainders = split_slot(slot_start, slot_end, start_time, end_time)
+                if remainders and not spot['is_partial_allowed']:
+                    return None
+
+                async with db.execute(HOT_QUERIES['booking_overlap'], (
+                    spot_id, STATUS_PENDING, STATUS_CONFIRMED, end_min, start_min
+                )) as cursor:
+                    if await cursor.fetchone():
+                        return None
+
+                total_price = calculate_price(calculate_hours(start_time, end_time),
+                                              spot['price_per_hour'])
                 cursor = await db.execute('''
                     INSERT INTO bookings (customer_id, spot_id, start_time, end_time, total_price)
                     VALUES (?, ?, ?, ?, ?)
                 ''', (customer_id, spot_id, start_time, end_time, total_price))
-                await db.commit()
-                return cursor.lastrowid
+                booking_id = cursor.lastrowid
+
+                await db.execute('DELETE FROM spot_availability WHERE id = ?', (slot['id'],))
+                await db.execute('''
+                    INSERT INTO spot_availability (spot_id, start_time, end_time, is_booked,
+                                                   booked_by, booking_id)
+                    VALUES (?, ?, ?, 1, ?, ?)
+                ''', (spot_id, start_time, end_time, customer_id, booking_id))
+
+                free_slots = []
+                for free_start, free_end in remainders:
+                    cursor = await db.execute('''
+                        INSERT INTO spot_availability (spot_id, start_time, end_time)
+                        VALUES (?, ?, ?)
+                    ''', (spot_id, free_start, free_end))
+                    free_slots.append((cursor.lastrowid, free_start, free_end))
+
+            self.availability.remove_slot(slot['id'])
+            for free_id, free_start, free_end in free_slots:
+                self.availability.add_slot(free_id, spot_id, free_start, free_end)
+            return booking_id
         except Exception as e:
-            logger.error(f"Ошибка создания бронирования: {e}")
+            logger.error(f"Ошибка бронирования интервала: {e}")
             return None
 
-    async def get_user_bookings(self, user_id: int) -> List[Dict[str, Any]]:
-        """Получение бронирований пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('''
-                SELECT b.*, ps.spot_number, ps.address, ps.supplier_id
-                FROM bookings b
-                JOIN parking_spots ps ON b.spot_id = ps.id
-                WHERE b.customer_id = ?
-                ORDER BY b.created_at DESC
-            ''', (user_id,)) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+    async def get_user_bookings(self, user_id: int, cursor: Optional[str] = None,
+                                limit: int = PAGINATION_SIZE, backward: bool = False) -> Page:
+        """Страница бронирований пользователя"""
+        return await self._page('user_bookings', (user_id,), cursor, limit, backward, _with_times)
 
     async def get_booking(self, booking_id: int) -> Optional[Dict[str, Any]]:
         """Получение бронирования по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             async with db.execute('''
                 SELECT b.*, ps.spot_number, ps.address, ps.supplier_id, ps.price_per_hour
                 FROM bookings b
@@ -370,155 +903,583 @@ class Database:
                 WHERE b.id = ?
             ''', (booking_id,)) as cursor:
                 row = await cursor.fetchone()
-                return dict(row) if row else None
+                return _with_times(row) if row else None
+
+    async def get_booking_parties(self, booking_id: int) -> Optional[Dict[str, Any]]:
+        """Бронирование с данными места, покупателя и поставщика — для уведомлений сторон"""
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['get_booking_parties'], (booking_id,)) as cursor:
+                row = await cursor.fetchone()
+                return _with_times(row) if row else None
 
-    async def update_booking_status(self, booking_id: int, status: str) -> bool:
-        """Обновление статуса бронирования"""
+    async def transition_booking(self, booking_id: int, status: str,
+                                 user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Переход бронирования в новый статус по BOOKING_TRANSITIONS от имени user_id
+        (покупателя или поставщика места; None — система). В одной транзакции: проверка
+        перехода и стороны, смена статуса, сводки аналитики и возврат времени в доступность.
+        Возвращает бронирование с данными сторон или None, если переход недопустим.
+        """
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('UPDATE bookings SET status = ? WHERE id = ?', 
-                               (status, booking_id))
-                await db.commit()
-                return True
+            async with self.pool.transaction() as db:
+                async with db.execute(HOT_QUERIES['get_booking_parties'], (booking_id,)) as cursor:
+                    booking = await cursor.fetchone()
+                if not booking or (booking['status'], status) not in BOOKING_TRANSITIONS:
+                    return None
+                side = BOOKING_TRANSITIONS[(booking['status'], status)]
+                if user_id != (booking[f'{side}_id'] if side else None):
+                    return None
+
+                await db.execute('UPDATE bookings SET status = ? WHERE id = ?', (status, booking_id))
+                released = await self._apply_status(db, booking, status)
+            self._apply_released(released)
+
+            result = _with_times(booking)
+            result['status'] = status
+            return result
         except Exception as e:
-            logger.error(f"Ошибка обновления статуса: {e}")
-            return False
+            logger.error(f"Ошибка смены статуса бронирования: {e}")
+            return None
 
-    async def get_supplier_bookings(self, supplier_id: int) -> List[Dict[str, Any]]:
-        """Получение бронирований поставщика"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('''
-                SELECT b.*, ps.spot_number, u.full_name as customer_name, u.phone
-                FROM bookings b
-                JOIN parking_spots ps ON b.spot_id = ps.id
-                JOIN users u ON b.customer_id = u.id
-                WHERE ps.supplier_id = ?
-                ORDER BY b.created_at DESC
-            ''', (supplier_id,)) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+    async def sweep_bookings(self, pending_timeout: timedelta,
+                             limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Пакет автоматических переходов: заявки без ответа дольше pending_timeout
+        (или уже закончившиеся по времени) истекают, закончившиеся подтвержденные
+        завершаются. Берутся только наступившие строки — по индексам
+        (status, end_min) и (created_at) для ожидающих, не более limit каждого вида.
+        Возвращает (истекшие заявки с данными сторон, число завершенных).
+        """
+        now = to_epoch_minutes(datetime.now())
+        try:
+            async with self.pool.transaction() as db:
+                async with db.execute(HOT_QUERIES['due_confirmed_bookings'], (now, limit)) as cursor:
+                    completed = json.dumps([row[0] for row in await cursor.fetchall()])
+                # Меняется только статус: занятые слоты остаются — аналитика считает их
+                # предложенным временем; сводки не меняются (оба статуса учитываются)
+                cursor = await db.execute(
+                    'UPDATE bookings SET status = ? WHERE id IN (SELECT value FROM json_each(?))',
+                    (STATUS_COMPLETED, completed)
+                )
+                completed_count = cursor.rowcount
 
-    async def get_all_bookings(self) -> List[Dict[str, Any]]:
-        """Получение всех бронирований"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('''
-                SELECT b.*, ps.spot_number, 
-                       u1.full_name as customer_name,
-                       u2.full_name as supplier_name
-                FROM bookings b
-                JOIN parking_spots ps ON b.spot_id = ps.id
-                JOIN users u1 ON b.customer_id = u1.id
-                JOIN users u2 ON ps.supplier_id = u2.id
-                ORDER BY b.created_at DESC
-            ''') as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                async with db.execute(HOT_QUERIES['due_pending_bookings'], (
+                    f'-{int(pending_timeout.total_seconds() // 60)} minutes', now, limit
+                )) as cursor:
+                    pending_ids = [row[0] for row in await cursor.fetchall()]
+                expired = []
+                for booking_id in pending_ids:
+                    async with db.execute(HOT_QUERIES['get_booking_parties'], (booking_id,)) as cursor:
+                        expired.append(await cursor.fetchone())
+                await db.execute(
+                    'UPDATE bookings SET status = ? WHERE id IN (SELECT value FROM json_each(?))',
+                    (STATUS_EXPIRED, json.dumps(pending_ids))
+                )
+                # Будущее время заявки возвращается в доступность со слиянием соседей
+                released = [await self._apply_status(db, booking, STATUS_EXPIRED) for booking in expired]
+
+            for item in released:
+                self._apply_released(item)
+            result = []
+            for booking in expired:
+                booking = _with_times(booking)
+                booking['status'] = STATUS_EXPIRED
+                result.append(booking)
+            return result, completed_count
+        except Exception as e:
+            logger.error(f"Ошибка автоматического завершения бронирований: {e}")
+            return [], 0
+
+    async def _apply_status(self, db, booking, new_status: str) -> tuple:
+        """Последствия смены статуса внутри транзакции: сводки и освобождение времени"""
+        await self._update_rollups(db, booking, booking['status'], new_status)
+        # Завершенное бронирование держит свой слот: время было предложено и занято
+        if (booking['status'] in HOLDING_STATUSES and new_status not in HOLDING_STATUSES
+                and new_status != STATUS_COMPLETED):
+            return await self._release_time(db, booking['id'], booking['spot_id'],
+                                            booking['start_min'], booking['end_min'])
+        return [], None
+
+    async def _release_time(self, db, booking_id: int, spot_id: int,
+                            start_min: int, end_min: int) -> tuple:
+        """
+        Возврат времени бронирования в доступность: занятый слот удаляется, а интервал
+        сливается с соседними свободными слотами в один (прошедшая часть тоже остается
+        предложенным временем). Если интервал уже прошел, слот не удаляется, а становится
+        свободным — как у завершенного бронирования, время не пропадает из аналитики.
+        Возвращает (id удаленных свободных слотов, новый слот или None) для индекса в памяти.
+        """
+        if end_min <= to_epoch_minutes(datetime.now()):
+            await db.execute('''
+                UPDATE spot_availability SET is_booked = 0, booked_by = NULL, booking_id = NULL
+                WHERE booking_id = ?
+            ''', (booking_id,))
+            return [], None
+
+        cursor = await db.execute('DELETE FROM spot_availability WHERE booking_id = ?', (booking_id,))
+        if not cursor.rowcount:
+            return [], None
+
+        async with db.execute(HOT_QUERIES['adjacent_free_slots'],
+                              (spot_id, end_min, start_min)) as cursor:
+            neighbours = await cursor.fetchall()
+        removed = [row['id'] for row in neighbours]
+        start_min = min([start_min] + [row['start_min'] for row in neighbours])
+        end_min = max([end_min] + [row['end_min'] for row in neighbours])
+        if removed:
+            await db.execute(
+                'DELETE FROM spot_availability WHERE id IN (SELECT value FROM json_each(?))',
+                (json.dumps(removed),)
+            )
+
+        start_time, end_time = from_epoch_minutes(start_min), from_epoch_minutes(end_min)
+        cursor = await db.execute('''
+            INSERT INTO spot_availability (spot_id, start_time, end_time)
+            VALUES (?, ?, ?)
+        ''', (spot_id, start_time, end_time))
+        return removed, (cursor.lastrowid, spot_id, start_time, end_time)
+
+    def _apply_released(self, released: tuple):
+        """Перенос освобожденного времени в индекс доступности после коммита"""
+        removed, added = released
+        for slot_id in removed:
+            self.availability.remove_slot(slot_id)
+        if added:
+            self.availability.add_slot(*added)
+
+    async def _update_rollups(self, db, booking, old_status: str, new_status: str):
+        """Учет в сводках аналитики, если бронирование вошло в учитываемые статусы или вышло из них"""
+        was_counted = old_status in COUNTED_STATUSES
+        is_counted = new_status in COUNTED_STATUSES
+        if was_counted != is_counted:
+            await apply_booking_rollup(db, booking['spot_id'], booking['start_min'], booking['end_min'],
+                                       booking['total_price'], 1 if is_counted else -1)
+
+    async def get_upcoming_reminders(self, start_from: datetime,
+                                     start_until: datetime) -> List[tuple]:
+        """Подтвержденные бронирования без напоминания, начинающиеся в (start_from, start_until]"""
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['get_upcoming_reminders'], (
+                to_epoch_minutes(start_from), to_epoch_minutes(start_until)
+            )) as cursor:
+                return [(row[0], from_epoch_minutes(row[1])) for row in await cursor.fetchall()]
+
+    async def claim_reminder(self, booking_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Отметка напоминания как отправленного.
+        Возвращает данные для сообщения, только если отметку поставил этот вызов
+        и бронирование все еще подтверждено — так напоминание уходит ровно один раз.
+        """
+        try:
+            async with self.pool.writer() as db:
+                cursor = await db.execute('''
+                    UPDATE bookings SET reminder_sent_at = ?
+                    WHERE id = ? AND status = ? AND reminder_sent_at IS NULL
+                ''', (datetime.now(), booking_id, STATUS_CONFIRMED))
+                if cursor.rowcount == 0:
+                    return None
+                async with db.execute('''
+                    SELECT b.id, b.start_min, b.end_min, ps.spot_number, ps.address,
+                           u.telegram_id
+                    FROM bookings b
+                    JOIN parking_spots ps ON b.spot_id = ps.id
+                    JOIN users u ON b.customer_id = u.id
+                    WHERE b.id = ?
+                ''', (booking_id,)) as cursor:
+                    row = await cursor.fetchone()
+                    return _with_times(row) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка отметки напоминания: {e}")
+            return None
+
+    async def get_supplier_bookings(self, supplier_id: int, cursor: Optional[str] = None,
+                                    limit: int = PAGINATION_SIZE, backward: bool = False) -> Page:
+        """Страница бронирований на места поставщика"""
+        return await self._page('supplier_bookings', (supplier_id,), cursor, limit, backward,
+                                _with_times)
+
+    async def get_all_bookings(self, cursor: Optional[str] = None, limit: int = PAGINATION_SIZE,
+                               backward: bool = False) -> Page:
+        """Страница всех бронирований"""
+        return await self._page('all_bookings', (), cursor, limit, backward, _with_times)
 
     # ===== УВЕДОМЛЕНИЯ =====
     async def add_notification_request(self, user_id: int, desired_date: str, 
                                       desired_start: str, desired_end: str) -> Optional[int]:
         """Добавление запроса на уведомление"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.writer() as db:
                 cursor = await db.execute('''
                     INSERT INTO notifications (user_id, desired_date, desired_start, desired_end)
                     VALUES (?, ?, ?, ?)
                 ''', (user_id, desired_date, desired_start, desired_end))
-                await db.commit()
                 return cursor.lastrowid
         except Exception as e:
             logger.error(f"Ошибка добавления уведомления: {e}")
             return None
 
-    async def get_active_notifications(self) -> List[Dict[str, Any]]:
-        """Получение активных уведомлений"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+    async def get_user_notifications(self, user_id: int) -> List[Dict[str, Any]]:
+        """Активные запросы на уведомление пользователя"""
+        async with self.pool.reader() as db:
             async with db.execute('''
-                SELECT * FROM notifications WHERE is_active = 1
-            ''') as cursor:
+                SELECT * FROM notifications WHERE user_id = ? AND is_active = 1
+                ORDER BY desired_date, desired_start
+            ''', (user_id,)) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def get_new_slots(self, after_id: int, limit: int) -> List[Dict[str, Any]]:
+        """Слоты доступности, добавленные после after_id (по возрастанию id)"""
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['get_new_slots'], (after_id, limit)) as cursor:
+                rows = await cursor.fetchall()
+                return [_with_times(row) for row in rows]
+
+    async def match_notifications(self, spot_id: int, date: str, start: str,
+                                  end: str) -> List[Dict[str, Any]]:
+        """Активные запросы, окно которых лежит внутри [start, end] даты date (ISO, ЧЧ:ММ)"""
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['match_notifications'],
+                                  (date, start, end, spot_id)) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
     async def deactivate_notification(self, notification_id: int) -> bool:
         """Деактивация уведомления"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('UPDATE notifications SET is_active = 0 WHERE id = ?', 
-                               (notification_id,))
-                await db.commit()
-                return True
+            async with self.pool.writer() as db:
+                cursor = await db.execute(
+                    'UPDATE notifications SET is_active = 0 WHERE id = ? AND is_active = 1',
+                    (notification_id,)
+                )
+                # False, если уведомление уже было деактивировано
+                return cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Ошибка деактивации уведомления: {e}")
             return False
 
+    # ===== ФОНОВЫЕ ЗАДАЧИ =====
+    async def get_worker_state(self, name: str, default: int = 0) -> int:
+        """Сохраненный курсор фоновой задачи"""
+        async with self.pool.reader() as db:
+            async with db.execute('SELECT value FROM worker_state WHERE name = ?', (name,)) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else default
+
+    async def set_worker_state(self, name: str, value: int) -> bool:
+        """Сохранение курсора фоновой задачи"""
+        try:
+            async with self.pool.writer() as db:
+                await db.execute('''
+                    INSERT INTO worker_state (name, value) VALUES (?, ?)
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value,
+                                                    updated_at = CURRENT_TIMESTAMP
+                ''', (name, value))
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояния задачи {name}: {e}")
+            return False
+
+    # ===== СОСТОЯНИЯ FSM =====
+    async def get_fsm_entry(self, key: str, now: int) -> Optional[tuple]:
+        """Состояние и данные (JSON) сценария, если запись не истекла"""
+        async with self.pool.reader() as db:
+            async with db.execute(
+                'SELECT state, data FROM fsm_storage WHERE key = ? AND expires_at > ?', (key, now)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return (row[0], row[1]) if row else None
+
+    async def save_fsm_entries(self, upserts: List[tuple], deletes: List[str]) -> bool:
+        """Пакетная запись состояний FSM одной транзакцией"""
+        try:
+            async with self.pool.writer() as db:
+                if upserts:
+                    await db.executemany('''
+                        INSERT INTO fsm_storage (key, state, data, expires_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                                                       expires_at = excluded.expires_at
+                    ''', upserts)
+                if deletes:
+                    await db.executemany('DELETE FROM fsm_storage WHERE key = ?',
+                                         [(key,) for key in deletes])
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояний FSM: {e}")
+            return False
+
+    async def purge_fsm_entries(self, now: int, batch_size: int = 1000) -> int:
+        """Удаление истекших состояний FSM небольшими транзакциями"""
+        total = 0
+        try:
+            while True:
+                async with self.pool.writer() as db:
+                    cursor = await db.execute('''
+                        DELETE FROM fsm_storage WHERE key IN (
+                            SELECT key FROM fsm_storage WHERE expires_at <= ? LIMIT ?
+                        )
+                    ''', (now, batch_size))
+                    deleted = cursor.rowcount
+                total += deleted
+                if deleted < batch_size:
+                    return total
+        except Exception as e:
+            logger.error(f"Ошибка очистки состояний FSM: {e}")
+            return total
+
+    # ===== РАССЫЛКИ =====
+    async def create_broadcast_job(self, admin_chat_id: int, text: str) -> Optional[int]:
+        """Создание задания рассылки"""
+        try:
+            async with self.pool.writer() as db:
+                cursor = await db.execute(f'''
+                    INSERT INTO broadcast_jobs (admin_chat_id, text, total)
+                    VALUES (?, ?, ({HOT_QUERIES['users_count']}))
+                ''', (admin_chat_id, text))
+                return cursor.lastrowid
+        except Exception as e:
+            logger.error(f"Ошибка создания рассылки: {e}")
+            return None
+
+    async def get_broadcast_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Получение задания рассылки"""
+        async with self.pool.reader() as db:
+            async with db.execute('SELECT * FROM broadcast_jobs WHERE id = ?', (job_id,)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def get_running_broadcast_jobs(self) -> List[Dict[str, Any]]:
+        """Незавершенные рассылки (для продолжения после перезапуска)"""
+        async with self.pool.reader() as db:
+            async with db.execute(
+                'SELECT * FROM broadcast_jobs WHERE status = ? ORDER BY id', (BROADCAST_RUNNING,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def get_broadcast_recipients(self, after_id: int, limit: int) -> List[tuple]:
+        """Следующая пачка получателей (id, telegram_id) после курсора after_id"""
+        async with self.pool.reader() as db:
+            async with db.execute(
+                'SELECT id, telegram_id FROM users WHERE id > ? ORDER BY id LIMIT ?',
+                (after_id, limit)
+            ) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+
+    async def save_broadcast_progress(self, job_id: int, last_user_id: int,
+                                      sent: int, failed: int) -> bool:
+        """Сохранение курсора и счетчиков рассылки"""
+        try:
+            async with self.pool.writer() as db:
+                await db.execute('''
+                    UPDATE broadcast_jobs SET last_user_id = ?, sent = ?, failed = ?
+                    WHERE id = ?
+                ''', (last_user_id, sent, failed, job_id))
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения прогресса рассылки: {e}")
+            return False
+
+    async def set_broadcast_message(self, job_id: int, message_id: int) -> bool:
+        """Запоминание сообщения, в котором показывается прогресс"""
+        try:
+            async with self.pool.writer() as db:
+                await db.execute('UPDATE broadcast_jobs SET progress_message_id = ? WHERE id = ?',
+                                 (message_id, job_id))
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения сообщения рассылки: {e}")
+            return False
+
+    async def finish_broadcast_job(self, job_id: int, status: str) -> bool:
+        """Завершение рассылки (только если она еще выполняется)"""
+        try:
+            async with self.pool.writer() as db:
+                cursor = await db.execute('''
+                    UPDATE broadcast_jobs SET status = ?, finished_at = ?
+                    WHERE id = ? AND status = ?
+                ''', (status, datetime.now(), job_id, BROADCAST_RUNNING))
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка завершения рассылки: {e}")
+            return False
+
     # ===== АДМИНСКИЕ СЕССИИ =====
     async def create_admin_session(self, user_id: int, hours: int = 24) -> bool:
-        """Создание админской сессии"""
+        """Создание админской сессии; повторный вход продлевает существующую"""
         try:
             expires_at = datetime.now() + timedelta(hours=hours)
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.writer() as db:
                 await db.execute('''
                     INSERT INTO admin_sessions (user_id, expires_at)
                     VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET expires_at = excluded.expires_at
                 ''', (user_id, expires_at))
-                await db.commit()
-                return True
+                telegram_id = await self._get_telegram_id(db, user_id)
+            self.admin_cache.invalidate(telegram_id)
+            return True
         except Exception as e:
             logger.error(f"Ошибка создания админской сессии: {e}")
             return False
 
     async def check_admin_session(self, user_id: int) -> bool:
         """Проверка активной админской сессии"""
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute('''
-                SELECT COUNT(*) FROM admin_sessions
-                WHERE user_id = ? AND expires_at > ?
-            ''', (user_id, datetime.now())) as cursor:
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['check_admin_session'], (user_id,)) as cursor:
                 row = await cursor.fetchone()
-                return row[0] > 0 if row else False
+        return bool(row) and to_datetime(row[0]) > datetime.now()
 
     async def is_admin(self, telegram_id: int) -> bool:
-        """Проверка, является ли пользователь администратором"""
-        user = await self.get_user_by_telegram_id(telegram_id)
-        if not user:
-            return False
-        
-        # Проверяем роль или активную сессию
-        if user['role'] == 'admin':
-            return True
-        
-        return await self.check_admin_session(user['id'])
+        """
+        Проверка, является ли пользователь администратором (роль или активная сессия).
+        Ответ кэшируется; при промахе роль и сессия читаются одним запросом
+        """
+        cached = self.admin_cache.get(telegram_id)
+        if cached is not MISSING:
+            return cached
+
+        token = self.admin_cache.token()
+        async with self.pool.reader() as db:
+            async with db.execute(HOT_QUERIES['get_admin_access'], (telegram_id,)) as cursor:
+                row = await cursor.fetchone()
+
+        ttl = None
+        if not row:
+            allowed = False
+        elif row['role'] == ROLE_ADMIN:
+            allowed = True
+        elif row['expires_at'] is None:
+            allowed = False
+        else:
+            # Запись не должна пережить сессию
+            left = (to_datetime(row['expires_at']) - datetime.now()).total_seconds()
+            allowed = left > 0
+            if allowed:
+                ttl = min(left, self.admin_cache.ttl)
+        self.admin_cache.set(telegram_id, allowed, ttl, token=token)
+        return allowed
+
+    async def purge_admin_sessions(self, batch_size: int = 500) -> int:
+        """Удаление истекших админских сессий небольшими транзакциями"""
+        total = 0
+        try:
+            while True:
+                async with self.pool.writer() as db:
+                    cursor = await db.execute(f'''
+                        DELETE FROM admin_sessions WHERE id IN ({HOT_QUERIES['expired_admin_sessions']})
+                    ''', (datetime.now(), batch_size))
+                    deleted = cursor.rowcount
+                total += deleted
+                if deleted < batch_size:
+                    return total
+        except Exception as e:
+            logger.error(f"Ошибка очистки админских сессий: {e}")
+            return total
 
     # ===== СТАТИСТИКА =====
     async def get_statistics(self) -> Dict[str, Any]:
-        """Получение общей статистики"""
-        async with aiosqlite.connect(self.db_path) as db:
-            stats = {}
-            
-            # Количество пользователей
-            async with db.execute('SELECT COUNT(*) FROM users') as cursor:
-                row = await cursor.fetchone()
-                stats['total_users'] = row[0] if row else 0
-            
-            # Количество мест
-            async with db.execute('SELECT COUNT(*) FROM parking_spots') as cursor:
-                row = await cursor.fetchone()
-                stats['total_spots'] = row[0] if row else 0
-            
-            # Количество бронирований
-            async with db.execute('SELECT COUNT(*) FROM bookings') as cursor:
-                row = await cursor.fetchone()
-                stats['total_bookings'] = row[0] if row else 0
-            
-            # Активные бронирования
-            async with db.execute('''
-                SELECT COUNT(*) FROM bookings 
-                WHERE status = 'confirmed' OR status = 'pending'
-            ''') as cursor:
-                row = await cursor.fetchone()
-                stats['active_bookings'] = row[0] if row else 0
-            
-            return stats
+        """
+        Общая статистика из таблицы stats_counters (ведется триггерами) — одно чтение
+        вместо полного подсчета таблиц
+        """
+        async with self.pool.reader() as db:
+            async with db.execute('SELECT name, value FROM stats_counters') as cursor:
+                counters = {row[0]: row[1] for row in await cursor.fetchall()}
+
+        by_status = {
+            name[len('bookings_'):]: value
+            for name, value in counters.items() if name.startswith('bookings_') and value
+        }
+        return {
+            'total_users': counters.get('users', 0),
+            'total_spots': counters.get('spots', 0),
+            'total_bookings': counters.get('bookings', 0),
+            'active_bookings': by_status.get(STATUS_PENDING, 0) + by_status.get(STATUS_CONFIRMED, 0),
+            'bookings_by_status': by_status,
+            'revenue': counters.get('revenue', 0),
+        }
+
+    async def reconcile_statistics(self) -> Dict[str, tuple]:
+        """
+        Пересчет счетчиков статистики одним агрегирующим запросом.
+        Возвращает расхождения {счетчик: (было, стало)} и исправляет их.
+        """
+        try:
+            # BEGIN IMMEDIATE: триггеры не изменят счетчики между подсчетом и записью
+            async with self.pool.transaction() as db:
+                async with db.execute(STATS_COUNTERS_SQL) as cursor:
+                    actual = {row[0]: row[1] for row in await cursor.fetchall()}
+                async with db.execute('SELECT name, value FROM stats_counters') as cursor:
+                    stored = {row[0]: row[1] for row in await cursor.fetchall()}
+
+                drift = {}
+                for name in stored.keys() | actual.keys():
+                    old, new = stored.get(name, 0), actual.get(name, 0)
+                    # Выручка — сумма REAL, сравниваем с точностью до копейки
+                    if abs(old - new) >= 0.01:
+                        drift[name] = (old, new)
+
+                if drift:
+                    await db.executemany(
+                        'INSERT OR REPLACE INTO stats_counters (name, value) VALUES (?, ?)',
+                        [(name, new) for name, (_, new) in drift.items()]
+                    )
+            return drift
+        except Exception as e:
+            logger.error(f"Ошибка пересчета статистики: {e}")
+            return {}
+
+    # ===== АНАЛИТИКА МЕСТ =====
+    async def _analytics(self, spots_sql: str, param: int, date_from: date,
+                         date_to: date) -> Dict[str, Any]:
+        """Аналитика по дневным сводкам для мест из spots_sql за дни [date_from, date_to]"""
+        day_from, day_to = epoch_day(date_from), epoch_day(date_to)
+        range_start, range_end = day_from * MINUTES_PER_DAY, (day_to + 1) * MINUTES_PER_DAY
+
+        async with self.pool.reader() as db:
+            async with db.execute(f'''
+                SELECT COALESCE(SUM(bookings), 0), COALESCE(SUM(length_minutes), 0),
+                       COALESCE(SUM(booked_minutes), 0), COALESCE(SUM(revenue), 0)
+                FROM spot_daily_stats
+                WHERE spot_id IN ({spots_sql}) AND day BETWEEN ? AND ?
+            ''', (param, day_from, day_to)) as cursor:
+                bookings, length_minutes, booked_minutes, revenue = await cursor.fetchone()
+
+            async with db.execute(f'''
+                SELECT hour, SUM(booked_minutes) AS minutes
+                FROM spot_hourly_stats
+                WHERE spot_id IN ({spots_sql}) AND day BETWEEN ? AND ?
+                GROUP BY hour
+                HAVING minutes > 0
+                ORDER BY minutes DESC, hour
+                LIMIT ?
+            ''', (param, day_from, day_to, ANALYTICS_PEAK_HOURS)) as cursor:
+                peak_hours = [(row[0], row[1]) for row in await cursor.fetchall()]
+
+            # Предложенное время — все слоты периода (свободные и занятые), обрезанные по его границам
+            async with db.execute(f'''
+                SELECT COALESCE(SUM(MIN(end_min, ?) - MAX(start_min, ?)), 0)
+                FROM spot_availability
+                WHERE spot_id IN ({spots_sql}) AND start_min < ? AND end_min > ?
+            ''', (range_end, range_start, param, range_end, range_start)) as cursor:
+                offered_minutes = (await cursor.fetchone())[0]
+
+        return {
+            'bookings': bookings,
+            'revenue': revenue,
+            'booked_minutes': booked_minutes,
+            'offered_minutes': offered_minutes,
+            'occupancy': booked_minutes * 100 / offered_minutes if offered_minutes else None,
+            'avg_minutes': length_minutes / bookings if bookings else None,
+            'peak_hours': peak_hours,
+        }
+
+    async def get_spot_analytics(self, spot_id: int, date_from: date, date_to: date) -> Dict[str, Any]:
+        """Занятость, выручка, средняя длительность и пиковые часы места за период"""
+        return await self._analytics('?', spot_id, date_from, date_to)
+
+    async def get_supplier_analytics(self, supplier_id: int, date_from: date,
+                                     date_to: date) -> Dict[str, Any]:
+        """То же по всем местам поставщика"""
+        return await self._analytics('SELECT id FROM parking_spots WHERE supplier_id = ?',
+                                     supplier_id, date_from, date_to)
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Any
+
+import aiosqlite
+
+from config import DB_POOL_READERS
+
+logger = logging.getLogger(__name__)
+
+# Настройки каждого соединения
+PRAGMAS = [
+    'PRAGMA synchronous = NORMAL',    # в режиме WAL безопасно и без fsync на каждый коммит
+    'PRAGMA cache_size = -16000',     # 16 МБ страничного кэша
+    'PRAGMA mmap_size = 268435456',   # 256 МБ memory-mapped I/O
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+]
+
+
+class ConnectionPool:
+    """
+    Пул долгоживущих соединений SQLite.
+    Ограниченное число соединений для чтения и одно выделенное соединение
+    для записи, доступ к которому сериализуется блокировкой.
+    """
+
+    def __init__(self, db_path: str, readers: int = DB_POOL_READERS):
+        self.db_path = db_path
+        self.readers_count = max(1, readers)
+        self._readers: Optional[asyncio.Queue] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock: Optional[asyncio.Lock] = None
+        self._open_lock = asyncio.Lock()
+
+        # Счетчики для мониторинга
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.readers_in_use = 0
+        self.writer_in_use = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_path)
+        conn.row_factory = aiosqlite.Row
+        for pragma in PRAGMAS:
+            # Курсор закрывается сразу: незавершенный PRAGMA держит снимок чтения
+            async with conn.execute(pragma):
+                pass
+        return conn
+
+    async def open(self):
+        """Открытие соединений пула"""
+        async with self._open_lock:
+            if self.is_open:
+                return
+
+            self._readers = asyncio.Queue()
+            self._writer_lock = asyncio.Lock()
+            self._writer = await self._connect()
+            for _ in range(self.readers_count):
+                conn = await self._connect()
+                self._reader_conns.append(conn)
+                self._readers.put_nowait(conn)
+
+            logger.info(f"Пул соединений открыт: {self.readers_count} читателей + 1 писатель")
+
+    async def close(self):
+        """Закрытие всех соединений пула"""
+        async with self._open_lock:
+            if not self.is_open:
+                return
+
+            for conn in self._reader_conns:
+                await conn.close()
+            await self._writer.close()
+
+            self._reader_conns = []
+            self._readers = None
+            self._writer = None
+            self._writer_lock = None
+            logger.info("Пул соединений закрыт")
+
+    def _record_wait(self, waited: float):
+        self.checkouts += 1
+        self.wait_time += waited
+        if waited > 0.001:
+            self.waits += 1
+        if waited > self.max_wait:
+            self.max_wait = waited
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Соединение для чтения из пула"""
+        if not self.is_open:
+            await self.open()
+
+        started = time.perf_counter()
+        conn = await self._readers.get()
+        self._record_wait(time.perf_counter() - started)
+        self.readers_in_use += 1
+        try:
+            yield conn
+        finally:
+            self.readers_in_use -= 1
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Эксклюзивное соединение для записи.
+        Изменения фиксируются при выходе из блока и откатываются при ошибке.
+        """
+        if not self.is_open:
+            await self.open()
+
+        started = time.perf_counter()
+        async with self._writer_lock:
+            self._record_wait(time.perf_counter() - started)
+            self.writer_in_use = True
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            finally:
+                self.writer_in_use = False
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Транзакция BEGIN IMMEDIATE на соединении записи.
+        Блокировка записи берется до первого чтения, поэтому проверка и изменение
+        атомарны и относительно других процессов.
+        """
+        async with self.writer() as db:
+            await db.execute('BEGIN IMMEDIATE')
+            yield db
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики пула: ожидание и занятые соединения"""
+        return {
+            'readers': self.readers_count,
+            'readers_in_use': self.readers_in_use,
+            'writer_in_use': self.writer_in_use,
+            'checked_out': self.readers_in_use + (1 if self.writer_in_use else 0),
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+            'wait_time_ms': round(self.wait_time * 1000, 3),
+            'max_wait_ms': round(self.max_wait * 1000, 3),
+            'avg_wait_ms': round(self.wait_time * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+        }
+
+
+_pools: Dict[str, ConnectionPool] = {}
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """Общий пул для файла базы данных (один на процесс)"""
+    pool = _pools.get(db_path)
+    if pool is None:
+        pool = ConnectionPool(db_path)
+        _pools[db_path] = pool
+    return pool
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import (
+    FSM_STORAGE, REDIS_URL, FSM_STATE_TTL, FSM_FLUSH_INTERVAL, FSM_FLUSH_BATCH, FSM_PURGE_INTERVAL
+)
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Запись в буфере: (состояние, данные)
+Entry = Tuple[Optional[str], Dict[str, Any]]
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_storage основной базы.
+    Изменения копятся в буфере и сбрасываются одной транзакцией раз в FSM_FLUSH_INTERVAL
+    секунд (или сразу при FSM_FLUSH_BATCH изменениях). Чтение сначала смотрит в буфер,
+    затем в БД, поэтому в памяти лежат только еще не записанные изменения,
+    а несколько процессов бота видят общие состояния (с задержкой до одного сброса).
+    Брошенные сценарии удаляются через FSM_STATE_TTL секунд после последнего изменения.
+    """
+
+    def __init__(self, db: Database, ttl: int = FSM_STATE_TTL,
+                 flush_interval: float = FSM_FLUSH_INTERVAL, flush_batch: int = FSM_FLUSH_BATCH,
+                 purge_interval: float = FSM_PURGE_INTERVAL):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.purge_interval = purge_interval
+        self._pending: Dict[str, Entry] = {}
+        self._flushing: Dict[str, Entry] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_now = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._purge_at = 0.0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        parts = [str(key.bot_id), str(key.chat_id)]
+        if key.thread_id:
+            parts.append(str(key.thread_id))
+        parts.extend([str(key.user_id), key.destiny])
+        return ':'.join(parts)
+
+    async def _load(self, key: str) -> Entry:
+        entry = self._pending.get(key) or self._flushing.get(key)
+        if entry is not None:
+            return entry
+
+        row = await self.db.get_fsm_entry(key, int(time.time()))
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _put(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        self._pending[key] = (state, data)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if len(self._pending) >= self.flush_batch:
+            self._flush_now.set()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self._key(key)
+        _, data = await self._load(k)
+        self._put(k, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = self._key(key)
+        state, _ = await self._load(k)
+        self._put(k, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self._key(key))
+        return data.copy()
+
+    async def flush(self):
+        """Запись накопленных изменений в БД"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, {}
+
+            expires_at = int(time.time()) + self.ttl
+            upserts, deletes = [], []
+            for key, (state, data) in self._flushing.items():
+                if state is None and not data:
+                    # Сценарий завершен (state.clear()) — запись не нужна
+                    deletes.append(key)
+                else:
+                    upserts.append((key, state, json.dumps(data, ensure_ascii=False), expires_at))
+
+            if not await self.db.save_fsm_entries(upserts, deletes):
+                # Вернем в буфер то, что не успели перезаписать новыми изменениями
+                for key, entry in self._flushing.items():
+                    self._pending.setdefault(key, entry)
+            self._flushing = {}
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+
+            try:
+                await self.flush()
+                if time.monotonic() >= self._purge_at:
+                    self._purge_at = time.monotonic() + self.purge_interval
+                    purged = await self.db.purge_fsm_entries(int(time.time()))
+                    if purged:
+                        logger.info(f"Удалено брошенных сценариев FSM: {purged}")
+            except Exception as e:
+                logger.error(f"Ошибка сброса состояний FSM: {e}")
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+
+def create_storage(kind: str = FSM_STORAGE, db: Optional[Database] = None,
+                   redis: Any = None) -> BaseStorage:
+    """
+    Хранилище FSM по настройке FSM_STORAGE.
+    redis — готовый клиент (например, fakeredis для проверки); по умолчанию подключение по REDIS_URL.
+    """
+    if kind == 'memory':
+        return MemoryStorage()
+
+    if kind == 'redis':
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            logger.error("Для FSM_STORAGE=redis установите пакет redis; используется SQLite")
+        else:
+            if redis is not None:
+                return RedisStorage(redis, state_ttl=FSM_STATE_TTL, data_ttl=FSM_STATE_TTL)
+            return RedisStorage.from_url(REDIS_URL, state_ttl=FSM_STATE_TTL, data_ttl=FSM_STATE_TTL)
+
+    return SQLiteStorage(db or Database())
@@ -1,10 +1,50 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
-from typing import List
+from datetime import date
+from functools import wraps
+from typing import Callable, Hashable, List, Optional
 from config import BANKS_LIST
+from pagination import Page
+from utils import to_datetime, get_status_emoji, WEEKDAYS, format_availability_rule
+
+
+# ===== КЭШ РАЗМЕТКИ =====
+# Одна и та же клавиатура отдается всем обработчикам и всем чатам, не собираясь заново
+# на каждый апдейт. Разметка aiogram изменяема (frozen=False), поэтому вызывающий код
+# никогда не меняет полученную разметку и ее кнопки: правка видна во всех чатах.
+# Для измененной версии соберите свою через get_xxx.__wrapped__(...)
+# или возьмите копию markup.model_copy(deep=True).
+def prebuilt(build: Callable[[], object]):
+    """Клавиатура без параметров: собирается один раз при импорте"""
+    markup = build()
+
+    @wraps(build)
+    def get():
+        return markup
+    return get
+
+
+def cached_markup(key: Callable[..., Hashable], maxsize: int = 8):
+    """Клавиатура с параметрами: кэш по key(*args); при переполнении кэш сбрасывается"""
+    def decorator(build):
+        cache = {}
+
+        @wraps(build)
+        def get(*args, **kwargs):
+            k = key(*args, **kwargs)
+            markup = cache.get(k)
+            if markup is None:
+                if len(cache) >= maxsize:
+                    cache.clear()
+                markup = cache[k] = build(*args, **kwargs)
+            return markup
+        get.cache = cache
+        return get
+    return decorator
 
 
 # ===== ГЛАВНОЕ МЕНЮ =====
+@cached_markup(key=lambda role='customer': role)
 def get_main_menu(role: str = 'customer') -> ReplyKeyboardMarkup:
     """Главное меню в зависимости от роли"""
     builder = ReplyKeyboardBuilder()
@@ -18,6 +58,7 @@ def get_main_menu(role: str = 'customer') -> ReplyKeyboardMarkup:
             KeyboardButton(text="📋 Мои бронирования"),
             KeyboardButton(text="🔔 Уведомления")
         )
+        builder.row(KeyboardButton(text="📆 Поиск на период"))
     elif role == 'supplier':
         builder.row(
             KeyboardButton(text="➕ Добавить место"),
@@ -25,7 +66,7 @@ def get_main_menu(role: str = 'customer') -> ReplyKeyboardMarkup:
         )
         builder.row(
             KeyboardButton(text="📋 Заявки на бронирование"),
-            KeyboardButton(text="📊 Статистика")
+            KeyboardButton(text="📈 Аналитика")
         )
     elif role == 'admin':
         builder.row(
@@ -42,6 +83,7 @@ def get_main_menu(role: str = 'customer') -> ReplyKeyboardMarkup:
     return builder.as_markup(resize_keyboard=True)
 
 
+@prebuilt
 def get_cancel_button() -> ReplyKeyboardMarkup:
     """Кнопка отмены"""
     builder = ReplyKeyboardBuilder()
@@ -50,6 +92,7 @@ def get_cancel_button() -> ReplyKeyboardMarkup:
 
 
 # ===== РЕГИСТРАЦИЯ =====
+@prebuilt
 def get_phone_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура для отправки номера телефона"""
     builder = ReplyKeyboardBuilder()
@@ -58,6 +101,7 @@ def get_phone_keyboard() -> ReplyKeyboardMarkup:
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
 
 
+@prebuilt
 def get_banks_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура выбора банка"""
     builder = InlineKeyboardBuilder()
@@ -67,6 +111,7 @@ def get_banks_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@prebuilt
 def get_role_selection() -> InlineKeyboardMarkup:
     """Выбор роли после регистрации"""
     builder = InlineKeyboardBuilder()
@@ -79,6 +124,7 @@ def get_role_selection() -> InlineKeyboardMarkup:
 
 
 # ===== ПОСТАВЩИК =====
+@prebuilt
 def get_partial_allowed_keyboard() -> InlineKeyboardMarkup:
     """Разрешить частичную аренду"""
     builder = InlineKeyboardBuilder()
@@ -90,6 +136,8 @@ def get_partial_allowed_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+# Подписи «Сегодня»/«Завтра» и даты меняются раз в сутки — ключ кэша по текущей дате
+@cached_markup(key=lambda: date.today(), maxsize=2)
 def get_date_selection_keyboard() -> InlineKeyboardMarkup:
     """Быстрый выбор даты (6 дней)"""
     from datetime import datetime, timedelta
@@ -111,6 +159,21 @@ def get_date_selection_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def get_range_days_keyboard(days: List[tuple]) -> InlineKeyboardMarkup:
+    """Дни периода, на которые нашлись места: (день, слоты)"""
+    builder = InlineKeyboardBuilder()
+    
+    for day, slots in days:
+        if slots:
+            builder.add(InlineKeyboardButton(
+                text=f"{day.strftime('%d.%m')} — {len(slots)} мест",
+                callback_data=f"range_day_{day.strftime('%d.%m.%Y')}"
+            ))
+    
+    builder.adjust(2)
+    return builder.as_markup()
+
+
 def get_spots_keyboard(spots: List[dict]) -> InlineKeyboardMarkup:
     """Клавиатура со списком мест поставщика"""
     builder = InlineKeyboardBuilder()
@@ -135,6 +198,7 @@ def get_spot_management_keyboard(spot_id: int, is_available: bool) -> InlineKeyb
         InlineKeyboardButton(text="💰 Изменить цену", callback_data=f"edit_price_{spot_id}"),
         InlineKeyboardButton(text=visibility_text, callback_data=f"toggle_vis_{spot_id}"),
         InlineKeyboardButton(text="📅 Добавить период", callback_data=f"add_period_{spot_id}"),
+        InlineKeyboardButton(text="🔁 Расписание", callback_data=f"rules_{spot_id}"),
         InlineKeyboardButton(text="📊 Статистика", callback_data=f"spot_stats_{spot_id}"),
         InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_spots")
     )
@@ -142,15 +206,60 @@ def get_spot_management_keyboard(spot_id: int, is_available: bool) -> InlineKeyb
     return builder.as_markup()
 
 
+def get_spot_rules_keyboard(spot_id: int, rules: List[dict]) -> InlineKeyboardMarkup:
+    """Правила доступности места: удаление и добавление"""
+    builder = InlineKeyboardBuilder()
+    
+    for rule in rules:
+        builder.row(InlineKeyboardButton(
+            text=f"🗑 {format_availability_rule(rule)}",
+            callback_data=f"rule_del_{rule['id']}"
+        ))
+    
+    builder.row(InlineKeyboardButton(text="➕ Добавить правило", callback_data=f"rule_add_{spot_id}"))
+    builder.row(InlineKeyboardButton(text="🔙 Назад", callback_data=f"spot_{spot_id}"))
+    return builder.as_markup()
+
+
+def get_weekdays_keyboard(selected: List[int]) -> InlineKeyboardMarkup:
+    """Выбор дней недели для правила доступности"""
+    builder = InlineKeyboardBuilder()
+    
+    for i, name in enumerate(WEEKDAYS):
+        mark = "✅ " if i in selected else ""
+        builder.add(InlineKeyboardButton(text=f"{mark}{name}", callback_data=f"rule_day_{i}"))
+    builder.adjust(7)
+    
+    builder.row(
+        InlineKeyboardButton(text="Будни", callback_data="rule_day_work"),
+        InlineKeyboardButton(text="Все дни", callback_data="rule_day_all")
+    )
+    builder.row(InlineKeyboardButton(text="➡️ Далее", callback_data="rule_days_done"))
+    return builder.as_markup()
+
+
+def get_analytics_period_keyboard(prefix: str, days: int, periods: List[int],
+                                  back_callback: Optional[str] = None) -> InlineKeyboardMarkup:
+    """Выбор периода отчета: {prefix}_{дней}"""
+    builder = InlineKeyboardBuilder()
+    for period in periods:
+        text = f"• {period} дн. •" if period == days else f"{period} дн."
+        builder.add(InlineKeyboardButton(text=text, callback_data=f"{prefix}_{period}"))
+    builder.adjust(len(periods))
+    if back_callback:
+        builder.row(InlineKeyboardButton(text="🔙 Назад", callback_data=back_callback))
+    return builder.as_markup()
+
+
 # ===== ПОКУПАТЕЛЬ =====
-def get_available_slots_keyboard(slots: List[dict]) -> InlineKeyboardMarkup:
-    """Клавиатура доступных слотов"""
+def get_available_slots_keyboard(slots: List[dict], page: Optional[Page] = None,
+                                 filtered: bool = False) -> InlineKeyboardMarkup:
+    """Клавиатура доступных слотов; с page — страница поиска с фильтрами и листанием"""
     builder = InlineKeyboardBuilder()
     
     for slot in slots:
-        from datetime import datetime
-        start = datetime.fromisoformat(slot['start_time'])
-        end = datetime.fromisoformat(slot['end_time'])
+        start = to_datetime(slot['start_time'])
+        end = to_datetime(slot['end_time'])
         
         builder.add(InlineKeyboardButton(
             text=f"Место {slot['spot_number']} | {start.strftime('%H:%M')}-{end.strftime('%H:%M')} | {slot['price_per_hour']}₽/ч",
@@ -158,38 +267,53 @@ def get_available_slots_keyboard(slots: List[dict]) -> InlineKeyboardMarkup:
         ))
     
     builder.adjust(1)
+    if page is not None:
+        add_pagination_row(builder, page, "slots")
+        builder.row(
+            InlineKeyboardButton(text="💰 Цена", callback_data="slots_filter_price"),
+            InlineKeyboardButton(text="🕐 Время", callback_data="slots_filter_time"),
+            InlineKeyboardButton(text="📍 Адрес", callback_data="slots_filter_address")
+        )
+        if filtered:
+            builder.row(InlineKeyboardButton(text="♻️ Сбросить фильтры", callback_data="slots_filter_reset"))
     return builder.as_markup()
 
 
-def get_bookings_keyboard(bookings: List[dict]) -> InlineKeyboardMarkup:
+def get_bookings_keyboard(bookings: List[dict], page: Optional[Page] = None,
+                          prefix: str = "my_bookings") -> InlineKeyboardMarkup:
     """Клавиатура бронирований"""
     builder = InlineKeyboardBuilder()
     
     for booking in bookings:
-        from datetime import datetime
-        start = datetime.fromisoformat(booking['start_time'])
-        
-        status_emoji = {
-            'pending': '⏳',
-            'confirmed': '✅',
-            'cancelled': '❌',
-            'completed': '✔️'
-        }.get(booking['status'], '❓')
+        start = to_datetime(booking['start_time'])
         
         builder.add(InlineKeyboardButton(
-            text=f"{status_emoji} Место {booking['spot_number']} | {start.strftime('%d.%m %H:%M')}",
+            text=f"{get_status_emoji(booking['status'])} Место {booking['spot_number']} | {start.strftime('%d.%m %H:%M')}",
             callback_data=f"booking_{booking['id']}"
         ))
     
     builder.adjust(1)
+    if page:
+        add_pagination_row(builder, page, prefix)
     return builder.as_markup()
 
 
-def get_booking_actions_keyboard(booking_id: int, status: str) -> InlineKeyboardMarkup:
-    """Действия с бронированием"""
+def get_booking_actions_keyboard(booking_id: int, status: str,
+                                 as_supplier: bool = False) -> InlineKeyboardMarkup:
+    """Действия с бронированием: покупатель может отменить, поставщик — ответить на заявку"""
     builder = InlineKeyboardBuilder()
     
-    if status == 'pending':
+    if as_supplier:
+        if status == 'pending':
+            builder.add(
+                InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"confirm_book_{booking_id}"),
+                InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_book_{booking_id}")
+            )
+        builder.adjust(2)
+        builder.row(InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_requests"))
+        return builder.as_markup()
+    
+    if status in ('pending', 'confirmed'):
         builder.add(InlineKeyboardButton(
             text="❌ Отменить бронирование",
             callback_data=f"cancel_booking_{booking_id}"
@@ -200,6 +324,16 @@ def get_booking_actions_keyboard(booking_id: int, status: str) -> InlineKeyboard
     return builder.as_markup()
 
 
+def get_book_slot_keyboard(slot_id: int, partial_allowed: bool) -> InlineKeyboardMarkup:
+    """Бронирование выбранного слота: целиком или часть по времени"""
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="✅ Забронировать целиком", callback_data=f"book_whole_{slot_id}"))
+    if partial_allowed:
+        builder.add(InlineKeyboardButton(text="🕐 Выбрать время", callback_data=f"book_part_{slot_id}"))
+    builder.adjust(1)
+    return builder.as_markup()
+
+
 def get_confirm_booking_keyboard(booking_id: int) -> InlineKeyboardMarkup:
     """Подтверждение бронирования поставщиком"""
     builder = InlineKeyboardBuilder()
@@ -212,6 +346,7 @@ def get_confirm_booking_keyboard(booking_id: int) -> InlineKeyboardMarkup:
 
 
 # ===== АДМИН-ПАНЕЛЬ =====
+@prebuilt
 def get_admin_menu() -> ReplyKeyboardMarkup:
     """Меню администратора"""
     builder = ReplyKeyboardBuilder()
@@ -220,49 +355,68 @@ def get_admin_menu() -> ReplyKeyboardMarkup:
         KeyboardButton(text="🏠 Парковочные места")
     )
     builder.row(
-        KeyboardButton(text="📊 Статистика"),
-        KeyboardButton(text="📢 Рассылка")
+        KeyboardButton(text="🔍 Поиск"),
+        KeyboardButton(text="📊 Статистика")
     )
     builder.row(
-        KeyboardButton(text="⚙️ Настройки"),
-        KeyboardButton(text="🔙 Выйти из админки")
+        KeyboardButton(text="📢 Рассылка"),
+        KeyboardButton(text="⚙️ Настройки")
     )
+    builder.row(KeyboardButton(text="🔙 Выйти из админки"))
     return builder.as_markup(resize_keyboard=True)
 
 
-def get_pagination_keyboard(page: int, total_pages: int, prefix: str) -> InlineKeyboardMarkup:
-    """Клавиатура пагинации"""
-    builder = InlineKeyboardBuilder()
-    
+def add_pagination_row(builder: InlineKeyboardBuilder, page: Page, prefix: str):
+    """Кнопки «Назад»/«Вперёд» с курсорами страниц: {prefix}_prev_/{prefix}_next_"""
     buttons = []
-    if page > 0:
-        buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"{prefix}_page_{page-1}"))
-    
-    buttons.append(InlineKeyboardButton(text=f"{page + 1}/{total_pages}", callback_data="page_info"))
+    if page.prev_cursor:
+        buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"{prefix}_prev_{page.prev_cursor}"))
+    if page.next_cursor:
+        buttons.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"{prefix}_next_{page.next_cursor}"))
+    if buttons:
+        builder.row(*buttons)
+
+
+def get_pagination_keyboard(page: Page, prefix: str) -> Optional[InlineKeyboardMarkup]:
+    """Клавиатура пагинации (None, если страница одна)"""
+    builder = InlineKeyboardBuilder()
+    add_pagination_row(builder, page, prefix)
+    return builder.as_markup() if page.prev_cursor or page.next_cursor else None
+
+
+def get_users_keyboard(users: List[dict], page: Optional[Page] = None) -> InlineKeyboardMarkup:
+    """Пользователи списка или результатов поиска администратора"""
+    builder = InlineKeyboardBuilder()
     
-    if page < total_pages - 1:
-        buttons.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"{prefix}_page_{page+1}"))
+    for user in users:
+        status = "✅" if user['is_active'] else "❌"
+        builder.add(InlineKeyboardButton(
+            text=f"{status} {user['full_name']}",
+            callback_data=f"admin_user_{user['id']}"
+        ))
     
-    builder.row(*buttons)
+    builder.adjust(1)
+    if page:
+        add_pagination_row(builder, page, "users")
     return builder.as_markup()
 
 
-def get_user_actions_keyboard(user_id: int, is_active: bool) -> InlineKeyboardMarkup:
+def get_user_actions_keyboard(user_id: int, is_active: bool, is_admin: bool = False) -> InlineKeyboardMarkup:
     """Действия с пользователем"""
     builder = InlineKeyboardBuilder()
     
     status_text = "🔓 Разблокировать" if not is_active else "🔒 Заблокировать"
     status_action = f"unblock_user_{user_id}" if not is_active else f"block_user_{user_id}"
     
-    builder.add(
-        InlineKeyboardButton(text=status_text, callback_data=status_action),
-        InlineKeyboardButton(text="👑 Сделать админом", callback_data=f"make_admin_{user_id}"),
-        InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_users")
-    )
+    builder.add(InlineKeyboardButton(text=status_text, callback_data=status_action))
+    if not is_admin:
+        builder.add(InlineKeyboardButton(text="👑 Сделать админом", callback_data=f"make_admin_{user_id}"))
+    builder.add(InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_users"))
     builder.adjust(1)
     return builder.as_markup()
 
 
+@prebuilt
 def get_broadcast_confirm_keyboard() -> InlineKeyboardMarkup:
     """Подтверждение рассылки"""
     builder = InlineKeyboardBuilder()
@@ -274,7 +428,17 @@ def get_broadcast_confirm_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def get_broadcast_progress_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    """Остановка идущей рассылки"""
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        InlineKeyboardButton(text="⏹ Остановить", callback_data=f"stop_broadcast_{job_id}")
+    )
+    return builder.as_markup()
+
+
 # ===== ПРОФИЛЬ =====
+@prebuilt
 def get_profile_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура профиля"""
     builder = InlineKeyboardBuilder()
@@ -5,8 +5,15 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.types import BotCommand
 
-from config import BOT_TOKEN
+from config import BOT_TOKEN, BOT_MODE
 from database import Database
+from middlewares import UserMiddleware
+from fsm_storage import create_storage
+from webhook import WebhookServer
+from scheduler import (
+    scheduler, NotificationMatcher, ReminderScheduler, StatsReconciler, BookingSweeper, AdminSessionCleaner,
+    BackfillRunner, AvailabilityVerifier
+)
 import user_handlers
 import admin_handlers
 
@@ -31,18 +38,46 @@ async def on_startup(bot: Bot):
     """Действия при запуске бота"""
     logger.info("Инициализация базы данных...")
     db = Database()
+    await db.connect()
     await db.init_db()
+    await db.check_query_plans()
+    await db.load_availability()
     logger.info("База данных инициализирована")
     
+    resumed = await admin_handlers.broadcaster.resume(bot)
+    if resumed:
+        logger.info(f"Продолжено рассылок: {resumed}")
+    
+    scheduler.add(NotificationMatcher(db, bot))
+    scheduler.add(ReminderScheduler(db, bot))
+    scheduler.add(StatsReconciler(db))
+    scheduler.add(BookingSweeper(db, bot))
+    scheduler.add(AdminSessionCleaner(db))
+    scheduler.add(BackfillRunner(db))
+    scheduler.add(AvailabilityVerifier(db))
+    scheduler.start()
+    
     logger.info("Установка команд бота...")
-    await set_bot_commands(bot)
-    logger.info("Команды установлены")
+    try:
+        await set_bot_commands(bot)
+        logger.info("Команды установлены")
+    except Exception as e:
+        # Не мешаем запуску без связи с Telegram (локальная проверка webhook)
+        logger.error(f"Не удалось установить команды: {e}")
     
     logger.info("Бот запущен и готов к работе!")
 
 
-async def on_shutdown(bot: Bot):
+async def on_shutdown(bot: Bot, dispatcher: Dispatcher):
     """Действия при остановке бота"""
+    await scheduler.stop()
+    await admin_handlers.broadcaster.stop()
+    # Несохраненные состояния FSM пишутся в БД до закрытия пула
+    await dispatcher.storage.close()
+    db = Database()
+    logger.info(f"Статистика пула соединений: {db.pool_stats()}")
+    logger.info(f"Статистика кэша пользователей: {db.cache_stats()}")
+    await db.close()
     logger.info("Бот остановлен")
 
 
@@ -60,7 +95,11 @@ async def main():
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     
-    dp = Dispatcher()
+    # Состояния сценариев переживают перезапуск (FSM_STORAGE в config.py)
+    dp = Dispatcher(storage=create_storage())
+    
+    # Пользователь загружается один раз на апдейт и передается в обработчики
+    dp.update.middleware(UserMiddleware(Database()))
     
     # Регистрация роутеров
     dp.include_router(user_handlers.router)
@@ -70,10 +109,12 @@ async def main():
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
     
-    # Запуск polling
     try:
         logger.info("Запуск бота...")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if BOT_MODE == 'webhook':
+            await WebhookServer(dp, bot).run()
+        else:
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}")
     finally:
@@ -0,0 +1,26 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from database import Database
+
+
+class UserMiddleware(BaseMiddleware):
+    """
+    Загружает пользователя один раз на апдейт (через кэш Database)
+    и передает его обработчикам в аргументе user.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = data.get('event_from_user')
+        data['user'] = await self.db.get_user_by_telegram_id(from_user.id) if from_user else None
+        return await handler(event, data)
@@ -0,0 +1,575 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Union
+
+import aiosqlite
+
+from analytics import apply_booking_rollup
+from config import MIGRATION_BATCH_SIZE
+from db_pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Шаг миграции: SQL-выражение или функция, получающая соединение
+Step = Union[str, Callable[[aiosqlite.Connection], Awaitable[None]]]
+
+
+@dataclass
+class Backfill:
+    """
+    Пакетное заполнение данных после изменения схемы.
+    Таблица обходится по rowid: каждый пакет — диапазон после предыдущего и отдельная
+    короткая транзакция, поэтому весь проход линейный, а база не блокируется надолго.
+    """
+    table: str
+    set_sql: str
+    where_sql: str
+    batch_size: int = MIGRATION_BATCH_SIZE
+
+    async def run(self, pool: ConnectionPool) -> int:
+        total = 0
+        last_rowid = 0
+        while True:
+            async with pool.writer() as db:
+                async with db.execute(f'''
+                    SELECT MAX(rowid), COUNT(*) FROM (
+                        SELECT rowid FROM {self.table} WHERE rowid > ? ORDER BY rowid LIMIT ?
+                    )
+                ''', (last_rowid, self.batch_size)) as cursor:
+                    batch_end, batch_rows = await cursor.fetchone()
+                if not batch_rows:
+                    return total
+                cursor = await db.execute(f'''
+                    UPDATE {self.table} SET {self.set_sql}
+                    WHERE rowid > ? AND rowid <= ? AND ({self.where_sql})
+                ''', (last_rowid, batch_end))
+                total += cursor.rowcount
+            if batch_rows < self.batch_size:
+                return total
+            last_rowid = batch_end
+            # Отдаем управление другим задачам между пакетами
+            await asyncio.sleep(0)
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    steps: List[Step]
+    backfills: List[Backfill] = field(default_factory=list)
+
+
+def _epoch_minutes(column: str) -> str:
+    """SQL-выражение: минуты эпохи из времени, сохраненного текстом ISO"""
+    return f"CAST(strftime('%s', substr({column}, 1, 19)) AS INTEGER) / 60"
+
+
+def _digits(column: str) -> str:
+    """SQL-выражение: только цифры из телефона в формате +7 (900) 123-45-67"""
+    expr = column
+    for char in '+ ()-':
+        expr = f"replace({expr}, '{char}', '')"
+    return expr
+
+
+# Фактические значения счетчиков статистики одним агрегирующим запросом: (name, value).
+# Выручка — сумма подтвержденных и завершенных бронирований
+STATS_COUNTERS_SQL = '''
+    SELECT 'users', COUNT(*) FROM users
+    UNION ALL SELECT 'spots', COUNT(*) FROM parking_spots
+    UNION ALL SELECT 'bookings', COUNT(*) FROM bookings
+    UNION ALL SELECT 'bookings_' || status, COUNT(*) FROM bookings GROUP BY status
+    UNION ALL SELECT 'revenue', COALESCE(SUM(total_price), 0) FROM bookings
+        WHERE status IN ('confirmed', 'completed')
+'''
+
+
+def _bump(name_sql: str, delta_sql: str) -> str:
+    """Изменение счетчика внутри триггера (строка счетчика создается при первом изменении)"""
+    return (
+        f'INSERT INTO stats_counters (name, value) VALUES ({name_sql}, {delta_sql}) '
+        f'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;'
+    )
+
+
+def _revenue(row: str) -> str:
+    return f"CASE WHEN {row}.status IN ('confirmed', 'completed') THEN {row}.total_price ELSE 0 END"
+
+
+def _fts_steps(table: str, fts: str, columns: List[str]) -> List[str]:
+    """
+    Полнотекстовый индекс FTS5 над колонками таблицы (external content — текст не дублируется)
+    и триггеры, которые держат его в актуальном состоянии
+    """
+    cols = ', '.join(columns)
+    new = ', '.join(f'NEW.{c}' for c in columns)
+    old = ', '.join(f'OLD.{c}' for c in columns)
+    return [
+        f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            {cols}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {table}
+        BEGIN INSERT INTO {fts} (rowid, {cols}) VALUES (NEW.id, {new}); END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {table}
+        BEGIN INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', OLD.id, {old}); END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {cols} ON {table}
+        BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', OLD.id, {old});
+            INSERT INTO {fts} (rowid, {cols}) VALUES (NEW.id, {new});
+        END
+        ''',
+        # Индекс по уже существующим строкам — в той же транзакции, что и триггеры
+        f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')",
+    ]
+
+
+async def _fill_spot_stats(db: aiosqlite.Connection):
+    """Начальное заполнение сводок аналитики из уже подтвержденных бронирований"""
+    async with db.execute('''
+        SELECT spot_id, start_min, end_min, total_price FROM bookings
+        WHERE status IN ('confirmed', 'completed')
+    ''') as cursor:
+        bookings = await cursor.fetchall()
+    for spot_id, start_min, end_min, total_price in bookings:
+        await apply_booking_rollup(db, spot_id, start_min, end_min, total_price)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'Базовые таблицы', [
+        # Таблица пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            full_name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            card_number TEXT NOT NULL,
+            bank TEXT NOT NULL,
+            role TEXT DEFAULT 'customer',
+            is_active INTEGER DEFAULT 1,
+            balance REAL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Таблица парковочных мест
+        '''
+        CREATE TABLE IF NOT EXISTS parking_spots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            supplier_id INTEGER NOT NULL,
+            spot_number TEXT NOT NULL,
+            address TEXT,
+            description TEXT,
+            price_per_hour REAL NOT NULL,
+            is_partial_allowed INTEGER DEFAULT 1,
+            is_available INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (supplier_id) REFERENCES users(id)
+        )
+        ''',
+        # Таблица доступности мест
+        '''
+        CREATE TABLE IF NOT EXISTS spot_availability (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            spot_id INTEGER NOT NULL,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP NOT NULL,
+            is_booked INTEGER DEFAULT 0,
+            booked_by INTEGER,
+            booking_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (spot_id) REFERENCES parking_spots(id),
+            FOREIGN KEY (booked_by) REFERENCES users(id),
+            FOREIGN KEY (booking_id) REFERENCES bookings(id)
+        )
+        ''',
+        # Таблица бронирований
+        '''
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER NOT NULL,
+            spot_id INTEGER NOT NULL,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP NOT NULL,
+            total_price REAL NOT NULL,
+            status TEXT DEFAULT 'pending',
+            payment_method TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (customer_id) REFERENCES users(id),
+            FOREIGN KEY (spot_id) REFERENCES parking_spots(id)
+        )
+        ''',
+        # Таблица уведомлений
+        '''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            spot_id INTEGER,
+            desired_date DATE NOT NULL,
+            desired_start TIME NOT NULL,
+            desired_end TIME NOT NULL,
+            is_active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        ''',
+        # Таблица админских сессий
+        '''
+        CREATE TABLE IF NOT EXISTS admin_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        ''',
+    ]),
+
+    Migration(2, 'Вторичные индексы', [
+        'CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_spots_supplier ON parking_spots(supplier_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_spots_created ON parking_spots(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_availability_spot ON spot_availability(spot_id, start_time)',
+        'CREATE INDEX IF NOT EXISTS idx_availability_free ON spot_availability(start_time, end_time) '
+        'WHERE is_booked = 0',
+        'CREATE INDEX IF NOT EXISTS idx_bookings_customer ON bookings(customer_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_bookings_spot ON bookings(spot_id, start_time)',
+        'CREATE INDEX IF NOT EXISTS idx_bookings_created ON bookings(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings(status)',
+        'CREATE INDEX IF NOT EXISTS idx_notifications_active ON notifications(is_active)',
+        'CREATE INDEX IF NOT EXISTS idx_admin_sessions_user ON admin_sessions(user_id, expires_at)',
+    ]),
+
+    Migration(3, 'Задания рассылки', [
+        # Прогресс рассылки: last_user_id — курсор по users.id,
+        # до которого включительно все сообщения уже отправлены
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_chat_id INTEGER NOT NULL,
+            progress_message_id INTEGER,
+            text TEXT NOT NULL,
+            status TEXT DEFAULT 'running',
+            last_user_id INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+    ]),
+
+    Migration(4, 'Подбор уведомлений', [
+        # Поиск подписок по новому слоту: дата на равенство, время — диапазоном
+        'CREATE INDEX IF NOT EXISTS idx_notifications_match '
+        'ON notifications(desired_date, desired_start, desired_end) WHERE is_active = 1',
+        'CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id, is_active)',
+        # Курсоры фоновых задач (например, последний обработанный слот)
+        '''
+        CREATE TABLE IF NOT EXISTS worker_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ], backfills=[
+        # Даты в формате ДД.ММ.ГГГГ переводим в ISO, чтобы они сравнивались как строки
+        Backfill(
+            'notifications',
+            "desired_date = substr(desired_date, 7, 4) || '-' || substr(desired_date, 4, 2) "
+            "|| '-' || substr(desired_date, 1, 2)",
+            "desired_date LIKE '__.__.____'"
+        ),
+    ]),
+
+    Migration(5, 'Напоминания о бронированиях', [
+        # Отметка об отправленном напоминании: переживает перезапуск бота
+        'ALTER TABLE bookings ADD COLUMN reminder_sent_at TIMESTAMP',
+        # Только бронирования, по которым напоминание еще не ушло
+        'CREATE INDEX IF NOT EXISTS idx_bookings_reminder ON bookings(status, start_time) '
+        'WHERE reminder_sent_at IS NULL',
+    ]),
+
+    Migration(6, 'Хранилище FSM', [
+        # Состояние и данные сценария; expires_at — время в секундах эпохи
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            expires_at INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fsm_storage_expires ON fsm_storage(expires_at)',
+    ]),
+
+    Migration(7, 'Время в минутах эпохи', [
+        # Вычисляемые (VIRTUAL) столбцы: не требуют заполнения и не расходятся с start_time/end_time.
+        # Доли секунды отбрасываем, иначе strftime('%s') округлит их вверх
+        f'ALTER TABLE spot_availability ADD COLUMN start_min INTEGER AS ({_epoch_minutes("start_time")}) VIRTUAL',
+        f'ALTER TABLE spot_availability ADD COLUMN end_min INTEGER AS ({_epoch_minutes("end_time")}) VIRTUAL',
+        f'ALTER TABLE bookings ADD COLUMN start_min INTEGER AS ({_epoch_minutes("start_time")}) VIRTUAL',
+        f'ALTER TABLE bookings ADD COLUMN end_min INTEGER AS ({_epoch_minutes("end_time")}) VIRTUAL',
+        # Индексы по тексту заменяем покрывающими индексами по минутам
+        'DROP INDEX IF EXISTS idx_availability_spot',
+        'DROP INDEX IF EXISTS idx_availability_free',
+        'DROP INDEX IF EXISTS idx_bookings_spot',
+        'DROP INDEX IF EXISTS idx_bookings_reminder',
+        'CREATE INDEX IF NOT EXISTS idx_availability_spot_min '
+        'ON spot_availability(spot_id, start_min, end_min, is_booked)',
+        'CREATE INDEX IF NOT EXISTS idx_availability_free_min '
+        'ON spot_availability(start_min, end_min, spot_id) WHERE is_booked = 0',
+        'CREATE INDEX IF NOT EXISTS idx_bookings_spot_min ON bookings(spot_id, start_min, end_min, status)',
+        'CREATE INDEX IF NOT EXISTS idx_bookings_reminder ON bookings(status, start_min) '
+        'WHERE reminder_sent_at IS NULL',
+    ]),
+    Migration(8, 'Счетчики статистики', [
+        '''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value NUMERIC NOT NULL DEFAULT 0
+        )
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_users_count_insert AFTER INSERT ON users
+        BEGIN {_bump("'users'", '1')} END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_users_count_delete AFTER DELETE ON users
+        BEGIN {_bump("'users'", '-1')} END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_spots_count_insert AFTER INSERT ON parking_spots
+        BEGIN {_bump("'spots'", '1')} END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_spots_count_delete AFTER DELETE ON parking_spots
+        BEGIN {_bump("'spots'", '-1')} END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_count_insert AFTER INSERT ON bookings
+        BEGIN
+            {_bump("'bookings'", '1')}
+            {_bump("'bookings_' || NEW.status", '1')}
+            {_bump("'revenue'", _revenue('NEW'))}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_count_update
+        AFTER UPDATE OF status, total_price ON bookings
+        BEGIN
+            {_bump("'bookings_' || OLD.status", '-1')}
+            {_bump("'bookings_' || NEW.status", '1')}
+            {_bump("'revenue'", f"{_revenue('NEW')} - {_revenue('OLD')}")}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_count_delete AFTER DELETE ON bookings
+        BEGIN
+            {_bump("'bookings'", '-1')}
+            {_bump("'bookings_' || OLD.status", '-1')}
+            {_bump("'revenue'", f"-({_revenue('OLD')})")}
+        END
+        ''',
+        # Начальные значения — в той же транзакции, что и триггеры
+        f'INSERT OR REPLACE INTO stats_counters (name, value) {STATS_COUNTERS_SQL}',
+    ]),
+    Migration(9, 'Сводки аналитики мест', [
+        # day — номер дня от эпохи (минуты эпохи // 1440)
+        '''
+        CREATE TABLE IF NOT EXISTS spot_daily_stats (
+            spot_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            length_minutes INTEGER NOT NULL DEFAULT 0,
+            booked_minutes INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (spot_id, day)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS spot_hourly_stats (
+            spot_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            booked_minutes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (spot_id, day, hour)
+        ) WITHOUT ROWID
+        ''',
+        _fill_spot_stats,
+    ]),
+    Migration(10, 'Повторяющиеся правила доступности', [
+        # weekdays — битовая маска дней недели (бит 0 — понедельник),
+        # start_minute/end_minute — минуты от начала суток, valid_from/until_day — номера дней от эпохи
+        '''
+        CREATE TABLE IF NOT EXISTS availability_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            spot_id INTEGER NOT NULL,
+            weekdays INTEGER NOT NULL,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            valid_from INTEGER NOT NULL,
+            until_day INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (spot_id) REFERENCES parking_spots(id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_availability_rules_spot ON availability_rules(spot_id)',
+        'CREATE INDEX IF NOT EXISTS idx_availability_rules_from ON availability_rules(valid_from)',
+        # Дни, на которые правило уже развернуто в spot_availability
+        '''
+        CREATE TABLE IF NOT EXISTS rule_expansions (
+            rule_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            PRIMARY KEY (rule_id, day)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    Migration(11, 'Индексы автоматического завершения бронирований', [
+        # Закончившиеся подтвержденные и заявки, у которых прошло время, — по (status, end_min)
+        'CREATE INDEX IF NOT EXISTS idx_bookings_status_end ON bookings(status, end_min)',
+        # Заявки без ответа — по времени создания, индекс только по ожидающим
+        "CREATE INDEX IF NOT EXISTS idx_bookings_pending_created ON bookings(created_at) "
+        "WHERE status = 'pending'",
+    ]),
+    Migration(12, 'Одна админ-сессия на пользователя', [
+        # Оставляем у каждого пользователя только самую долгую сессию
+        '''
+        DELETE FROM admin_sessions WHERE EXISTS (
+            SELECT 1 FROM admin_sessions newer
+            WHERE newer.user_id = admin_sessions.user_id
+              AND (newer.expires_at > admin_sessions.expires_at
+                   OR (newer.expires_at = admin_sessions.expires_at AND newer.id > admin_sessions.id))
+        )
+        ''',
+        'DROP INDEX IF EXISTS idx_admin_sessions_user',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_admin_sessions_user_unique ON admin_sessions(user_id)',
+        # Для удаления истекших сессий
+        'CREATE INDEX IF NOT EXISTS idx_admin_sessions_expires ON admin_sessions(expires_at)',
+    ]),
+    Migration(13, 'Полнотекстовый поиск пользователей и мест',
+              _fts_steps('users', 'users_fts', ['full_name', 'username', 'phone'])
+              + _fts_steps('parking_spots', 'spots_fts', ['spot_number', 'address', 'description'])),
+    # Телефон хранится отформатированным, и токенизатор режет его на части:
+    # для поиска по полному номеру индексируется копия из одних цифр
+    Migration(14, 'Поиск пользователей по полному номеру телефона', [
+        f'ALTER TABLE users ADD COLUMN phone_digits TEXT AS ({_digits("phone")}) VIRTUAL',
+        'DROP TRIGGER IF EXISTS trg_users_fts_insert',
+        'DROP TRIGGER IF EXISTS trg_users_fts_delete',
+        'DROP TRIGGER IF EXISTS trg_users_fts_update',
+        'DROP TABLE IF EXISTS users_fts',
+    ] + _fts_steps('users', 'users_fts', ['full_name', 'username', 'phone', 'phone_digits'])),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def _current_version(db: aiosqlite.Connection) -> int:
+    """Версия схемы из заголовка файла (PRAGMA user_version) — O(1)"""
+    async with db.execute('PRAGMA user_version') as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+
+
+async def _pending_backfills(db: aiosqlite.Connection) -> List[int]:
+    """Версии, у которых DDL применен, но заполнение данных не завершено"""
+    async with db.execute(
+        'SELECT version FROM schema_version WHERE completed_at IS NULL ORDER BY version'
+    ) as cursor:
+        return [row[0] for row in await cursor.fetchall()]
+
+
+async def migrate(pool: ConnectionPool) -> int:
+    """
+    Применение недостающих миграций — только изменения схемы, они быстрые.
+    Заполнение данных (backfills) выполняет run_pending_backfills уже после запуска бота,
+    поэтому изменения схемы следующих миграций не должны от него зависеть.
+    Возвращает итоговую версию схемы.
+    """
+    async with pool.writer() as db:
+        if await _current_version(db) >= LATEST_VERSION:
+            return LATEST_VERSION
+
+        # WAL нельзя включить внутри транзакции
+        async with db.execute('PRAGMA journal_mode = WAL'):
+            pass
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                completed_at TIMESTAMP
+            )
+        ''')
+        async with db.execute('SELECT MAX(version) FROM schema_version') as cursor:
+            row = await cursor.fetchone()
+            applied = row[0] or 0
+
+    for migration in MIGRATIONS:
+        if migration.version <= applied:
+            continue
+
+        logger.info(f"Миграция {migration.version}: {migration.description}")
+        async with pool.transaction() as db:
+            for step in migration.steps:
+                if isinstance(step, str):
+                    await db.execute(step)
+                else:
+                    await step(db)
+            # Если таблицы пусты (например, новая база), заполнять нечего — миграция сразу завершена
+            done = True
+            for backfill in migration.backfills:
+                async with db.execute(f'SELECT EXISTS (SELECT 1 FROM {backfill.table})') as cursor:
+                    done = done and not (await cursor.fetchone())[0]
+            await db.execute(
+                'INSERT INTO schema_version (version, description, completed_at) '
+                'VALUES (?, ?, CASE WHEN ? THEN CURRENT_TIMESTAMP END)',
+                (migration.version, migration.description, done)
+            )
+
+    async with pool.writer() as db:
+        await db.execute(f'PRAGMA user_version = {LATEST_VERSION}')
+
+    logger.info(f"Схема базы данных обновлена до версии {LATEST_VERSION}")
+    return LATEST_VERSION
+
+
+async def backfills_pending(pool: ConnectionPool) -> bool:
+    """Есть ли миграции с незавершенным заполнением данных"""
+    async with pool.reader() as db:
+        return bool(await _pending_backfills(db))
+
+
+async def run_pending_backfills(pool: ConnectionPool) -> List[int]:
+    """
+    Заполнение данных для миграций, у которых оно не завершено (в том числе прерванное
+    прошлым запуском). Возвращает версии завершенных миграций.
+    """
+    async with pool.reader() as db:
+        unfinished = await _pending_backfills(db)
+
+    by_version = {m.version: m for m in MIGRATIONS}
+    for version in unfinished:
+        await _run_backfills(pool, by_version[version])
+    return unfinished
+
+
+async def _run_backfills(pool: ConnectionPool, migration: Migration):
+    for backfill in migration.backfills:
+        updated = await backfill.run(pool)
+        logger.info(f"Миграция {migration.version}: заполнено {updated} строк в {backfill.table}")
+
+    async with pool.writer() as db:
+        await db.execute(
+            'UPDATE schema_version SET completed_at = CURRENT_TIMESTAMP WHERE version = ?',
+            (migration.version,)
+        )
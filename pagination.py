@@ -0,0 +1,145 @@
+import base64
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+
+@dataclass
+class Page:
+    """Страница списка и непрозрачные курсоры соседних страниц (None — страницы нет)"""
+    items: List[Dict[str, Any]] = field(default_factory=list)
+    next_cursor: Optional[str] = None  # более старые записи
+    prev_cursor: Optional[str] = None  # более новые записи
+
+
+# Ключ сортировки по умолчанию: время создания и id для однозначного порядка
+DEFAULT_KEY = ('created_at', 'id')
+
+
+def encode_cursor(value: Any, row_id: int) -> str:
+    """Курсор из ключа сортировки (значение, id) — короткая строка для callback_data"""
+    raw = f"{value}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[str, int]]:
+    """Ключ (значение, id) из курсора; None, если курсор поврежден"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        value, row_id = raw.rsplit('|', 1)
+        return value, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_sql(select_sql: str, conditions: Sequence[str], alias: str = '',
+               after_key: bool = False, backward: bool = False,
+               key: Tuple[str, str] = DEFAULT_KEY, descending: bool = True) -> str:
+    """
+    Запрос страницы с сортировкой по key (по умолчанию новые записи первыми),
+    LIMIT — последний параметр.
+    after_key — добавить условие по ключу курсора (два параметра перед LIMIT).
+    alias — префикс таблицы в запросе с JOIN, например 'b.'.
+    """
+    conditions = list(conditions)
+    # Движение назад — та же сортировка в обратную сторону
+    reverse = descending != backward
+    if after_key:
+        conditions.append(f"({alias}{key[0]}, {alias}{key[1]}) {'<' if reverse else '>'} (?, ?)")
+
+    order = 'DESC' if reverse else 'ASC'
+    sql = select_sql
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return sql + f' ORDER BY {alias}{key[0]} {order}, {alias}{key[1]} {order} LIMIT ?'
+
+
+async def fetch_page(db: aiosqlite.Connection, select_sql: str, conditions: Sequence[str],
+                     params: Sequence[Any], cursor: Optional[str], limit: int,
+                     backward: bool = False, alias: str = '',
+                     convert: Callable[[Any], Dict[str, Any]] = dict,
+                     key: Tuple[str, str] = DEFAULT_KEY, descending: bool = True) -> Page:
+    """
+    Keyset-пагинация по паре столбцов key (значение, уникальный id).
+    Стоимость страницы не зависит от ее номера: вместо OFFSET — условие
+    по ключу курсора, которое идет по индексу на столбцах key.
+    backward=True — страница перед курсором (кнопка «Назад»).
+    """
+    cursor_key = decode_cursor(cursor) if cursor else None
+    sql = keyset_sql(select_sql, conditions, alias, after_key=cursor_key is not None,
+                     backward=backward, key=key, descending=descending)
+    params = [*params, *(cursor_key or ()), limit + 1]
+
+    async with db.execute(sql, params) as db_cursor:
+        rows = list(await db_cursor.fetchall())
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    if not rows:
+        return Page()
+
+    first = encode_cursor(rows[0][key[0]], rows[0][key[1]])
+    last = encode_cursor(rows[-1][key[0]], rows[-1][key[1]])
+    page = Page(items=[convert(row) for row in rows])
+    if backward:
+        page.next_cursor = last
+        page.prev_cursor = first if has_more else None
+    else:
+        page.next_cursor = last if has_more else None
+        page.prev_cursor = first if cursor_key else None
+    return page
+
+
+# Выборка страницы: (курсор, backward) -> Page
+PageFetcher = Callable[[Optional[str], bool], Awaitable[Page]]
+
+
+async def pack_page(fetch: PageFetcher, render: Callable[[Dict[str, Any]], str],
+                    budget: int, cursor: Optional[str] = None, backward: bool = False,
+                    key: Tuple[str, str] = DEFAULT_KEY) -> Tuple[Page, List[str]]:
+    """
+    Страница списка, ограниченная размером текста, а не числом записей.
+    Записи читаются выборками fetch от курсора, каждая форматируется render один раз,
+    и в страницу попадают целые записи, пока их суммарная длина не превышает budget.
+    Возвращает страницу с курсорами соседних страниц и готовые тексты записей.
+    """
+    start_cursor = cursor
+    items, entries = [], []
+    used = 0
+    full = more = False
+    while not full:
+        page = await fetch(cursor, backward)
+        # При движении назад ближе к курсору последние записи страницы
+        for item in (reversed(page.items) if backward else page.items):
+            entry = render(item)
+            if items and used + len(entry) > budget:
+                full = True
+                break
+            items.append(item)
+            entries.append(entry)
+            used += len(entry)
+
+        cursor = page.prev_cursor if backward else page.next_cursor
+        more = full or cursor is not None
+        if not cursor:
+            break
+
+    if not items:
+        return Page(), []
+    if backward:
+        items.reverse()
+        entries.reverse()
+
+    result = Page(items=items)
+    first = encode_cursor(items[0][key[0]], items[0][key[1]])
+    last = encode_cursor(items[-1][key[0]], items[-1][key[1]])
+    if backward:
+        result.next_cursor = last
+        result.prev_cursor = first if more else None
+    else:
+        result.next_cursor = last if more else None
+        result.prev_cursor = first if start_cursor and decode_cursor(start_cursor) else None
+    return result, entries
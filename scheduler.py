@@ -0,0 +1,409 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+
+from broadcast import TokenBucket, send_bucket
+from config import (
+    NOTIFICATION_CHECK_INTERVAL, NOTIFICATION_SLOTS_BATCH, NOTIFICATION_SEND_BATCH,
+    NOTIFICATION_REMINDER_HOURS, RULE_EXPAND_AHEAD_DAYS, REMINDER_HORIZON_HOURS, REMINDER_RELOAD_INTERVAL,
+    STATS_RECONCILE_INTERVAL, PENDING_BOOKING_TIMEOUT_HOURS, BOOKING_SWEEP_INTERVAL, BOOKING_SWEEP_BATCH,
+    ADMIN_SESSION_GC_INTERVAL, ADMIN_SESSION_GC_BATCH, AVAILABILITY_VERIFY_INTERVAL
+)
+from database import Database
+from utils import escape_html, format_datetime, format_time
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWorker:
+    """
+    Периодическая фоновая задача.
+    run_once() вызывается через next_delay() секунд (по умолчанию interval)
+    или сразу после wake().
+    """
+
+    name = 'worker'
+    interval: float = 60
+
+    def __init__(self):
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self):
+        raise NotImplementedError
+
+    def next_delay(self) -> float:
+        """Пауза до следующего запуска"""
+        return self.interval
+
+    def wake(self):
+        """Запустить проверку, не дожидаясь интервала"""
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой задачи {self.name}: {e}")
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(self.next_delay(), 0))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+
+class Scheduler:
+    """Набор фоновых задач бота"""
+
+    def __init__(self):
+        self.workers: Dict[str, BackgroundWorker] = {}
+
+    def add(self, worker: BackgroundWorker):
+        self.workers[worker.name] = worker
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start()
+        logger.info(f"Фоновые задачи запущены: {', '.join(self.workers)}")
+
+    async def stop(self):
+        await asyncio.gather(*(worker.stop() for worker in self.workers.values()))
+
+    def wake(self, name: str):
+        worker = self.workers.get(name)
+        if worker:
+            worker.wake()
+
+
+def day_windows(start_time: datetime, end_time: datetime) -> List[tuple]:
+    """Разбиение интервала по дням: (дата ISO, ЧЧ:ММ начала, ЧЧ:ММ конца; полночь конца — 24:00)"""
+    windows = []
+    day = start_time.date()
+    while day <= end_time.date():
+        day_start = start_time.strftime('%H:%M') if day == start_time.date() else '00:00'
+        day_end = end_time.strftime('%H:%M') if day == end_time.date() else '24:00'
+        if day_start < day_end:
+            windows.append((day.isoformat(), day_start, day_end))
+        day += timedelta(days=1)
+    return windows
+
+
+class NotificationMatcher(BackgroundWorker):
+    """
+    Рассылка уведомлений о появившихся свободных местах.
+    Обрабатывает только слоты, добавленные после сохраненного курсора (id в spot_availability),
+    и для каждого ищет подписки по индексу (desired_date, desired_start, desired_end),
+    поэтому стоимость зависит от числа новых слотов, а не от числа подписчиков.
+    Перед проверкой разворачивает правила доступности на RULE_EXPAND_AHEAD_DAYS дней,
+    чтобы слоты из правил попадали под курсор без поиска на эту дату.
+    """
+
+    name = 'notifications'
+    interval = NOTIFICATION_CHECK_INTERVAL
+
+    def __init__(self, db: Database, bot: Bot, batch_size: int = NOTIFICATION_SLOTS_BATCH,
+                 send_batch: int = NOTIFICATION_SEND_BATCH, bucket: TokenBucket = send_bucket):
+        super().__init__()
+        self.db = db
+        self.bot = bot
+        self.batch_size = batch_size
+        self.send_batch = send_batch
+        self.bucket = bucket
+        self.sent = 0
+        self.ready = False
+
+    async def run_once(self):
+        # Подбор сравнивает даты подписок в ISO — ждем заполнения старых строк миграцией
+        if not self.ready:
+            if await self.db.backfills_pending():
+                return
+            self.ready = True
+        now = datetime.now()
+        await self.db.expand_availability_rules(now, now + timedelta(days=RULE_EXPAND_AHEAD_DAYS))
+        last_id = await self.db.get_worker_state(self.name)
+        while True:
+            slots = await self.db.get_new_slots(last_id, self.batch_size)
+            if not slots:
+                return
+
+            matches = await self._match(slots)
+            if matches:
+                await self._deliver(matches)
+
+            last_id = slots[-1]['id']
+            await self.db.set_worker_state(self.name, last_id)
+            if len(slots) < self.batch_size:
+                return
+
+    async def _match(self, slots: List[dict]) -> List[tuple]:
+        """Подписки, подходящие под новые свободные слоты: (уведомление, слот)"""
+        now = datetime.now()
+        matched = {}
+        for slot in slots:
+            if slot['is_booked'] or not slot['is_available']:
+                continue
+            start_time = max(slot['start_time'], now)
+            end_time = slot['end_time']
+
+            for date, day_start, day_end in day_windows(start_time, end_time):
+                for notification in await self.db.match_notifications(
+                        slot['spot_id'], date, day_start, day_end):
+                    # Одна подписка — одно сообщение, даже если подошло несколько слотов
+                    matched.setdefault(notification['id'], (notification, slot))
+        return list(matched.values())
+
+    async def _deliver(self, matches: List[tuple]):
+        for i in range(0, len(matches), self.send_batch):
+            batch = []
+            for notification, slot in matches[i:i + self.send_batch]:
+                # Деактивация до отправки: подписка срабатывает один раз
+                if await self.db.deactivate_notification(notification['id']):
+                    batch.append((notification, slot))
+
+            results = await asyncio.gather(*(self._send(n, s) for n, s in batch))
+            self.sent += sum(results)
+
+        logger.info(f"Уведомления о свободных местах: подобрано {len(matches)}")
+
+    async def _send(self, notification: dict, slot: dict) -> bool:
+        date = datetime.fromisoformat(notification['desired_date']).strftime('%d.%m.%Y')
+        text = (
+            f"🔔 <b>Появилось свободное место!</b>\n\n"
+            f"📅 {date}, {notification['desired_start']} - {notification['desired_end']}\n"
+            f"🅿️ Место №{escape_html(slot['spot_number'])}\n"
+        )
+        if slot['address']:
+            text += f"📍 {escape_html(slot['address'])}\n"
+        text += (
+            f"💰 {slot['price_per_hour']} ₽/час\n\n"
+            "Забронировать можно через «📅 Выбрать дату»."
+        )
+
+        await self.bucket.acquire()
+        try:
+            await self.bot.send_message(chat_id=notification['telegram_id'], text=text, parse_mode="HTML")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления {notification['id']}: {e}")
+            return False
+
+
+class ReminderScheduler(BackgroundWorker):
+    """
+    Напоминания о подтвержденных бронированиях за NOTIFICATION_REMINDER_HOURS до начала.
+    В памяти — куча (время напоминания, id) только на ближайшие REMINDER_HORIZON_HOURS;
+    горизонт перечитывается раз в REMINDER_RELOAD_INTERVAL секунд или после wake().
+    Между перечитываниями задача спит ровно до ближайшего напоминания.
+    Отметка reminder_sent_at в bookings ставится до отправки, поэтому после
+    перезапуска напоминание не повторяется.
+    """
+
+    name = 'reminders'
+    interval = REMINDER_RELOAD_INTERVAL
+
+    def __init__(self, db: Database, bot: Bot, lead_hours: float = NOTIFICATION_REMINDER_HOURS,
+                 horizon_hours: float = REMINDER_HORIZON_HOURS, bucket: TokenBucket = send_bucket):
+        super().__init__()
+        self.db = db
+        self.bot = bot
+        self.bucket = bucket
+        self.lead = timedelta(hours=lead_hours)
+        self.horizon = timedelta(hours=horizon_hours)
+        self.heap: List[tuple] = []  # (remind_at, booking_id)
+        self.scheduled = set()
+        self._reload_at = 0.0  # time.monotonic(), когда перечитывать горизонт
+        self.sent = 0
+
+    def wake(self):
+        """Перечитать горизонт (например, после подтверждения бронирования)"""
+        self._reload_at = 0.0
+        super().wake()
+
+    def next_delay(self) -> float:
+        delay = self._reload_at - time.monotonic()
+        if self.heap:
+            delay = min(delay, (self.heap[0][0] - datetime.now()).total_seconds())
+        return delay
+
+    async def reload(self):
+        """Загрузка напоминаний, которые наступят до конца горизонта"""
+        now = datetime.now()
+        upcoming = await self.db.get_upcoming_reminders(now, now + self.lead + self.horizon)
+        for booking_id, start_time in upcoming:
+            if booking_id not in self.scheduled:
+                self.scheduled.add(booking_id)
+                heapq.heappush(self.heap, (start_time - self.lead, booking_id))
+        self._reload_at = time.monotonic() + self.interval
+
+    async def run_once(self):
+        if time.monotonic() >= self._reload_at:
+            await self.reload()
+
+        now = datetime.now()
+        while self.heap and self.heap[0][0] <= now:
+            _, booking_id = heapq.heappop(self.heap)
+            self.scheduled.discard(booking_id)
+            booking = await self.db.claim_reminder(booking_id)
+            if booking and await self._send(booking):
+                self.sent += 1
+
+    async def _send(self, booking: dict) -> bool:
+        text = (
+            f"⏰ <b>Напоминание о бронировании</b>\n\n"
+            f"🅿️ Место №{escape_html(booking['spot_number'])}\n"
+        )
+        if booking['address']:
+            text += f"📍 {escape_html(booking['address'])}\n"
+        text += f"📅 {format_datetime(booking['start_time'])} - {format_time(booking['end_time'])}"
+
+        await self.bucket.acquire()
+        try:
+            await self.bot.send_message(chat_id=booking['telegram_id'], text=text, parse_mode="HTML")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка отправки напоминания по бронированию {booking['id']}: {e}")
+            return False
+
+
+class StatsReconciler(BackgroundWorker):
+    """
+    Сверка счетчиков stats_counters с таблицами.
+    Триггеры держат счетчики точными; расхождение означает правку данных в обход
+    триггеров (например, вручную) и исправляется с предупреждением в логе.
+    """
+
+    name = 'stats'
+    interval = STATS_RECONCILE_INTERVAL
+
+    def __init__(self, db: Database):
+        super().__init__()
+        self.db = db
+
+    async def run_once(self):
+        drift = await self.db.reconcile_statistics()
+        for name, (stored, actual) in drift.items():
+            logger.warning(f"Счетчик статистики {name} разошелся: {stored} вместо {actual}, исправлено")
+
+
+class BookingSweeper(BackgroundWorker):
+    """
+    Автоматическое завершение бронирований пакетами по BOOKING_SWEEP_BATCH:
+    заявки без ответа дольше PENDING_BOOKING_TIMEOUT_HOURS истекают (время возвращается
+    в доступность, покупатель получает сообщение), закончившиеся подтвержденные завершаются.
+    """
+
+    name = 'sweeper'
+    interval = BOOKING_SWEEP_INTERVAL
+
+    def __init__(self, db: Database, bot: Bot, timeout_hours: float = PENDING_BOOKING_TIMEOUT_HOURS,
+                 batch_size: int = BOOKING_SWEEP_BATCH, bucket: TokenBucket = send_bucket):
+        super().__init__()
+        self.db = db
+        self.bot = bot
+        self.timeout = timedelta(hours=timeout_hours)
+        self.batch_size = batch_size
+        self.bucket = bucket
+
+    async def run_once(self):
+        while True:
+            expired, completed = await self.db.sweep_bookings(self.timeout, self.batch_size)
+            if expired or completed:
+                logger.info(f"Бронирования: истекло заявок {len(expired)}, завершено {completed}")
+            if expired:
+                # Освободившееся время может подойти подписчикам
+                scheduler.wake(NotificationMatcher.name)
+                await asyncio.gather(*(self._send(booking) for booking in expired))
+            if len(expired) < self.batch_size and completed < self.batch_size:
+                return
+
+    async def _send(self, booking: dict) -> bool:
+        text = (
+            f"⌛ <b>Заявка на бронирование истекла</b>\n\n"
+            f"🅿️ Место №{escape_html(booking['spot_number'])}\n"
+            f"📅 {format_datetime(booking['start_time'])} - {format_time(booking['end_time'])}\n\n"
+            "Поставщик не ответил вовремя. Попробуйте выбрать другое место."
+        )
+
+        await self.bucket.acquire()
+        try:
+            await self.bot.send_message(chat_id=booking['customer_telegram_id'], text=text, parse_mode="HTML")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка уведомления об истекшей заявке {booking['id']}: {e}")
+            return False
+
+
+class AdminSessionCleaner(BackgroundWorker):
+    """Удаление истекших админских сессий пакетами по ADMIN_SESSION_GC_BATCH"""
+
+    name = 'sessions'
+    interval = ADMIN_SESSION_GC_INTERVAL
+
+    def __init__(self, db: Database, batch_size: int = ADMIN_SESSION_GC_BATCH):
+        super().__init__()
+        self.db = db
+        self.batch_size = batch_size
+
+    async def run_once(self):
+        deleted = await self.db.purge_admin_sessions(self.batch_size)
+        if deleted:
+            logger.info(f"Удалено истекших админ-сессий: {deleted}")
+
+
+class AvailabilityVerifier(BackgroundWorker):
+    """
+    Обслуживание индекса свободного времени: удаление прошедших слотов, чтобы индекс
+    не рос, пока работает процесс, и сверка с spot_availability — расхождения
+    (например, после записи другим процессом бота) исправляются перечитыванием мест.
+    Первый проход — сразу при запуске.
+    """
+
+    name = 'availability'
+    interval = AVAILABILITY_VERIFY_INTERVAL
+
+    def __init__(self, db: Database):
+        super().__init__()
+        self.db = db
+
+    async def run_once(self):
+        await self.db.verify_availability()
+
+
+class BackfillRunner(BackgroundWorker):
+    """
+    Заполнение данных миграций после запуска бота: схема уже обновлена в init_db,
+    а долгий проход по большим таблицам не задерживает прием апдейтов.
+    Код, которому нужны заполненные данные, проверяет db.backfills_pending().
+    """
+
+    name = 'backfills'
+    interval = 3600  # Повтор на случай ошибки; без незавершенных миграций — один запрос
+
+    def __init__(self, db: Database):
+        super().__init__()
+        self.db = db
+
+    async def run_once(self):
+        if await self.db.run_backfills():
+            scheduler.wake(NotificationMatcher.name)
+
+
+scheduler = Scheduler()
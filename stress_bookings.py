@@ -0,0 +1,145 @@
+"""
+Нагрузочная проверка бронирования: параллельные reserve_interval и отмены одних и тех же
+мест из нескольких процессов. После гонки проверяется, что активные бронирования
+не пересекаются, а слоты каждого места покрывают исходное время без дыр и наложений.
+
+Запуск: python stress_bookings.py [процессов] [попыток на процесс]
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from database import Database
+from utils import to_epoch_minutes
+
+SPOTS = 3
+CUSTOMERS = 20
+CONCURRENCY = 20  # Одновременных попыток в процессе
+CANCEL_SHARE = 0.3  # Доля успешных бронирований, которые тут же отменяются
+WINDOW_HOURS = (8, 20)  # Свободное время каждого места завтра
+
+
+def window() -> tuple:
+    day = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    return day.replace(hour=WINDOW_HOURS[0]), day.replace(hour=WINDOW_HOURS[1])
+
+
+async def setup(db_path: str) -> tuple:
+    """Поставщик, покупатели и места с одним свободным слотом на окно"""
+    db = Database(db_path)
+    await db.connect()
+    await db.init_db()
+    supplier_id = await db.add_user(1, 'supplier', 'Поставщик', '+70000000000', '0000', 'Банк')
+    customers = [await db.add_user(100 + i, f'c{i}', f'Покупатель {i}', '+70000000000', '0000', 'Банк')
+                 for i in range(CUSTOMERS)]
+    start, end = window()
+    spots = []
+    for number in range(SPOTS):
+        spot_id = await db.add_parking_spot(supplier_id, f'S-{number}', 100)
+        await db.add_availability(spot_id, start, end)
+        spots.append(spot_id)
+    await db.close()
+    return spots, customers
+
+
+async def race(db_path: str, spots: list, customers: list, attempts: int, seed: int) -> tuple:
+    """attempts попыток бронирования, не больше CONCURRENCY одновременно"""
+    db = Database(db_path)
+    await db.connect()
+    rnd = random.Random(seed)
+    start, end = window()
+    steps = int((end - start).total_seconds() // 1800)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    booked = cancelled = 0
+
+    async def attempt():
+        nonlocal booked, cancelled
+        begin = start + timedelta(minutes=30 * rnd.randrange(steps))
+        finish = min(end, begin + timedelta(minutes=30 * rnd.randint(1, 6)))
+        customer_id = rnd.choice(customers)
+        async with semaphore:
+            booking_id = await db.reserve_interval(rnd.choice(spots), begin, finish, customer_id)
+            if booking_id is None:
+                return
+            booked += 1
+            if rnd.random() < CANCEL_SHARE:
+                if await db.transition_booking(booking_id, 'cancelled', customer_id):
+                    cancelled += 1
+
+    await asyncio.gather(*(attempt() for _ in range(attempts)))
+    await db.close()
+    return booked, cancelled
+
+
+def run_worker(db_path: str, spots: list, customers: list, attempts: int, seed: int) -> tuple:
+    return asyncio.run(race(db_path, spots, customers, attempts, seed))
+
+
+def check(db_path: str, spots: list) -> list:
+    """Нарушения инвариантов: пересечения бронирований, дыры и наложения слотов"""
+    start, end = (to_epoch_minutes(moment) for moment in window())
+    problems = []
+    conn = sqlite3.connect(db_path)
+    for spot_id in spots:
+        bookings = conn.execute('''
+            SELECT id, start_min, end_min FROM bookings
+            WHERE spot_id = ? AND status IN ('pending', 'confirmed') ORDER BY start_min
+        ''', (spot_id,)).fetchall()
+        for (prev_id, _, prev_end), (booking_id, booking_start, _) in zip(bookings, bookings[1:]):
+            if booking_start < prev_end:
+                problems.append(f"место {spot_id}: бронирования {prev_id} и {booking_id} пересекаются")
+
+        slots = conn.execute('''
+            SELECT start_min, end_min, is_booked, booking_id FROM spot_availability
+            WHERE spot_id = ? ORDER BY start_min
+        ''', (spot_id,)).fetchall()
+        covered = start
+        for slot_start, slot_end, _, _ in slots:
+            if slot_start != covered:
+                kind = 'наложение' if slot_start < covered else 'дыра'
+                problems.append(f"место {spot_id}: {kind} слотов на минуте {min(slot_start, covered)}")
+            covered = max(covered, slot_end)
+        if covered != end:
+            problems.append(f"место {spot_id}: слоты покрывают время до {covered} вместо {end}")
+
+        booked_slots = {row[3]: (row[0], row[1]) for row in slots if row[2]}
+        if len(booked_slots) != sum(1 for row in slots if row[2]):
+            problems.append(f"место {spot_id}: несколько занятых слотов у одного бронирования")
+        expected = {booking_id: (booking_start, booking_end) for booking_id, booking_start, booking_end in bookings}
+        if booked_slots != expected:
+            problems.append(f"место {spot_id}: занятые слоты не совпадают с активными бронированиями")
+    conn.close()
+    return problems
+
+
+def main(processes: int = 4, attempts: int = 300):
+    db_path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    spots, customers = asyncio.run(setup(db_path))
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(processes) as executor:
+        results = list(executor.map(run_worker, [db_path] * processes, [spots] * processes,
+                                    [customers] * processes, [attempts] * processes, range(processes)))
+    elapsed = time.perf_counter() - started
+
+    booked = sum(result[0] for result in results)
+    cancelled = sum(result[1] for result in results)
+    print(f"{processes} процесса x {attempts} попыток за {elapsed:.1f} с: "
+          f"забронировано {booked}, отменено {cancelled}, отказов {processes * attempts - booked}")
+
+    problems = check(db_path, spots)
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        sys.exit(1)
+    print("✅ Двойных бронирований нет, слоты покрывают исходное время без дыр и наложений")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
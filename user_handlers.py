@@ -4,12 +4,20 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message, CallbackQuery
 from datetime import datetime, timedelta
+from typing import List, Optional
+import asyncio
 import logging
 
 from database import Database
+from scheduler import scheduler, NotificationMatcher, ReminderScheduler
+from analytics import format_analytics
 from keyboards import *
 from utils import *
-from config import ROLE_CUSTOMER, ROLE_SUPPLIER, STATUS_PENDING, STATUS_CONFIRMED
+from config import (
+    ROLE_CUSTOMER, ROLE_SUPPLIER, STATUS_PENDING, STATUS_CONFIRMED, STATUS_CANCELLED, STATUS_REJECTED,
+    PAGINATION_SIZE, ANALYTICS_PERIODS,
+    SEARCH_RANGE_MAX_DAYS, SEARCH_RANGE_SPOTS_PER_DAY
+)
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -35,9 +43,24 @@ class AddSpot(StatesGroup):
     end_time = State()
 
 
+class BookSlot(StatesGroup):
+    time = State()
+
+
+class AvailabilityRule(StatesGroup):
+    weekdays = State()
+    time = State()
+    until = State()
+
+
 class SearchSpot(StatesGroup):
     date = State()
     viewing_slots = State()
+    filter_price = State()
+    filter_time = State()
+    filter_address = State()
+    range_dates = State()
+    range_time = State()
 
 
 class BookingProcess(StatesGroup):
@@ -53,10 +76,8 @@ class NotificationRequest(StatesGroup):
 
 # ===== РЕГИСТРАЦИЯ =====
 @router.message(Command("start"))
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, user: Optional[dict]):
     """Обработка команды /start"""
-    user = await db.get_user_by_telegram_id(message.from_user.id)
-    
     if user:
         # Пользователь уже зарегистрирован
         await message.answer(
@@ -190,10 +211,8 @@ async def process_role_selection(callback: CallbackQuery, state: FSMContext):
 
 # ===== ПОСТАВЩИК - ДОБАВЛЕНИЕ МЕСТА =====
 @router.message(F.text == "➕ Добавить место")
-async def start_add_spot(message: Message, state: FSMContext):
+async def start_add_spot(message: Message, state: FSMContext, user: Optional[dict]):
     """Начало добавления парковочного места"""
-    user = await db.get_user_by_telegram_id(message.from_user.id)
-    
     if not user or user['role'] != ROLE_SUPPLIER:
         await message.answer("❌ Эта функция доступна только поставщикам.")
         return
@@ -275,13 +294,11 @@ async def process_spot_description(message: Message, state: FSMContext):
 
 
 @router.callback_query(AddSpot.partial_allowed, F.data.startswith("partial_"))
-async def process_partial_allowed(callback: CallbackQuery, state: FSMContext):
+async def process_partial_allowed(callback: CallbackQuery, state: FSMContext, user: Optional[dict]):
     """Обработка выбора частичной аренды"""
     is_partial = callback.data == "partial_yes"
     data = await state.get_data()
     
-    user = await db.get_user_by_telegram_id(callback.from_user.id)
-    
     # Создаем парковочное место
     spot_id = await db.add_parking_spot(
         supplier_id=user['id'],
@@ -383,6 +400,8 @@ async def process_end_time(message: Message, state: FSMContext):
     )
     
     if availability_id:
+        # Новый слот может подойти ожидающим подписчикам
+        scheduler.wake(NotificationMatcher.name)
         await message.answer(
             f"✅ Период доступности добавлен!\n\n"
             f"📅 {data['date']}\n"
@@ -398,10 +417,8 @@ async def process_end_time(message: Message, state: FSMContext):
 
 # ===== ПОСТАВЩИК - МОИ МЕСТА =====
 @router.message(F.text == "🏠 Мои места")
-async def show_my_spots(message: Message):
+async def show_my_spots(message: Message, user: Optional[dict]):
     """Показать все места поставщика"""
-    user = await db.get_user_by_telegram_id(message.from_user.id)
-    
     if not user or user['role'] != ROLE_SUPPLIER:
         await message.answer("❌ Эта функция доступна только поставщикам.")
         return
@@ -422,6 +439,80 @@ async def show_my_spots(message: Message):
     )
 
 
+def is_supplier(_, user: Optional[dict] = None) -> bool:
+    """Фильтр: пользователь — поставщик (общие кнопки меню уходят админке для остальных)"""
+    return bool(user) and user['role'] == ROLE_SUPPLIER
+
+
+async def is_supplier_analytics(message: Message, user: Optional[dict] = None) -> bool:
+    """
+    Фильтр кнопки отчета поставщика. «📊 Статистика» со старой клавиатуры поставщика
+    тоже открывает отчет, но не у вошедшего в админку — ему нужна статистика системы
+    """
+    if not is_supplier(message, user):
+        return False
+    if message.text == "📈 Аналитика":
+        return True
+    return message.text == "📊 Статистика" and not await db.is_admin(message.from_user.id)
+
+
+def analytics_period(days: str) -> int:
+    """Период отчета из callback_data (по умолчанию — первый из ANALYTICS_PERIODS)"""
+    return int(days) if days.isdigit() and int(days) in ANALYTICS_PERIODS else ANALYTICS_PERIODS[0]
+
+
+@router.callback_query(F.data.startswith("spot_stats_"))
+async def show_spot_stats(callback: CallbackQuery, user: Optional[dict]):
+    """Аналитика места за период — из дневных сводок, без чтения истории бронирований"""
+    spot_id_str, _, days_str = callback.data.replace("spot_stats_", "").partition("_")
+    spot = await db.get_parking_spot(int(spot_id_str))
+    
+    if not spot or not user or spot['supplier_id'] != user['id']:
+        await callback.answer("❌ Место не найдено")
+        return
+    
+    days = analytics_period(days_str)
+    date_to = datetime.now().date()
+    date_from = date_to - timedelta(days=days - 1)
+    stats = await db.get_spot_analytics(spot['id'], date_from, date_to)
+    
+    await callback.message.edit_text(
+        format_analytics(f"Статистика места {escape_html(spot['spot_number'])}", stats, date_from, date_to),
+        reply_markup=get_analytics_period_keyboard(f"spot_stats_{spot['id']}", days, ANALYTICS_PERIODS,
+                                                   back_callback=f"spot_{spot['id']}"),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+
+@router.message(is_supplier_analytics)
+async def show_supplier_stats(message: Message, user: Optional[dict]):
+    """Аналитика по всем местам поставщика"""
+    await send_supplier_stats(message, user, ANALYTICS_PERIODS[0])
+
+
+@router.callback_query(F.data.startswith("supplier_stats_"), is_supplier)
+async def change_supplier_stats_period(callback: CallbackQuery, user: Optional[dict]):
+    """Смена периода отчета поставщика"""
+    await send_supplier_stats(callback.message, user, analytics_period(callback.data.replace("supplier_stats_", "")),
+                              edit=True)
+    await callback.answer()
+
+
+async def send_supplier_stats(message: Message, user: dict, days: int, edit: bool = False):
+    """Отчет поставщика за последние days дней"""
+    date_to = datetime.now().date()
+    date_from = date_to - timedelta(days=days - 1)
+    stats = await db.get_supplier_analytics(user['id'], date_from, date_to)
+    
+    text = format_analytics("Статистика по всем местам", stats, date_from, date_to)
+    keyboard = get_analytics_period_keyboard("supplier_stats", days, ANALYTICS_PERIODS)
+    if edit:
+        await message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    else:
+        await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+
 @router.callback_query(F.data.startswith("spot_"))
 async def show_spot_details(callback: CallbackQuery):
     """Показать детали парковочного места"""
@@ -464,31 +555,235 @@ async def toggle_spot_visibility(callback: CallbackQuery):
         await callback.answer("❌ Ошибка")
 
 
-# ===== ПОКУПАТЕЛЬ - ПОИСК МЕСТ =====
-@router.message(F.text == "🏠 Свободные места")
-async def show_available_spots(message: Message):
-    """Показать свободные места на сегодня"""
-    user = await db.get_user_by_telegram_id(message.from_user.id)
+# ===== ПОСТАВЩИК - РАСПИСАНИЕ =====
+async def send_spot_rules(message: Message, spot: dict, edit: bool = True):
+    """Список правил доступности места"""
+    rules = await db.get_spot_rules(spot['id'])
+    text = f"🔁 <b>Расписание места {escape_html(spot['spot_number'])}</b>\n\n"
+    if rules:
+        text += "\n".join(f"• {format_availability_rule(rule)}" for rule in rules)
+        text += "\n\nНажмите на правило, чтобы удалить его."
+    else:
+        text += ("Правил пока нет. Правило открывает место по выбранным дням недели "
+                 "в одно и то же время — не нужно добавлять каждый день отдельно.")
     
-    if not user:
-        await message.answer("❌ Вы не зарегистрированы. Используйте /start")
+    keyboard = get_spot_rules_keyboard(spot['id'], rules)
+    if edit:
+        await message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    else:
+        await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("rules_"))
+async def show_spot_rules(callback: CallbackQuery, user: Optional[dict]):
+    """Правила доступности места"""
+    spot = await db.get_parking_spot(int(callback.data.replace("rules_", "")))
+    if not spot or not user or spot['supplier_id'] != user['id']:
+        await callback.answer("❌ Место не найдено")
+        return
+    
+    await send_spot_rules(callback.message, spot)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("rule_add_"))
+async def start_add_rule(callback: CallbackQuery, state: FSMContext, user: Optional[dict]):
+    """Начало добавления правила доступности"""
+    spot = await db.get_parking_spot(int(callback.data.replace("rule_add_", "")))
+    if not spot or not user or spot['supplier_id'] != user['id']:
+        await callback.answer("❌ Место не найдено")
         return
     
-    today = datetime.now()
-    slots = await db.get_available_slots(today)
+    await state.set_state(AvailabilityRule.weekdays)
+    await state.set_data({'spot_id': spot['id'], 'weekdays': []})
+    await callback.message.edit_text(
+        "📅 Выберите дни недели, в которые место свободно:",
+        reply_markup=get_weekdays_keyboard([])
+    )
+    await callback.answer()
+
+
+@router.callback_query(AvailabilityRule.weekdays, F.data.startswith("rule_day_"))
+async def toggle_rule_weekday(callback: CallbackQuery, state: FSMContext):
+    """Выбор дней недели"""
+    value = callback.data.replace("rule_day_", "")
+    selected = set((await state.get_data())['weekdays'])
+    
+    if value == "work":
+        selected = set(range(5))
+    elif value == "all":
+        selected = set(range(7))
+    else:
+        selected ^= {int(value)}
     
-    if not slots:
-        await message.answer(
-            "К сожалению, на сегодня нет доступных мест. 😔\n\n"
-            "Попробуйте выбрать другую дату или настройте уведомления."
-        )
+    await state.update_data(weekdays=sorted(selected))
+    await callback.message.edit_reply_markup(reply_markup=get_weekdays_keyboard(sorted(selected)))
+    await callback.answer()
+
+
+@router.callback_query(AvailabilityRule.weekdays, F.data == "rule_days_done")
+async def finish_rule_weekdays(callback: CallbackQuery, state: FSMContext):
+    """Дни выбраны — запрос времени"""
+    if not (await state.get_data())['weekdays']:
+        await callback.answer("Выберите хотя бы один день", show_alert=True)
         return
     
+    await state.set_state(AvailabilityRule.time)
+    await callback.message.answer(
+        "🕐 Введите время в формате ЧЧ:ММ-ЧЧ:ММ (например: 09:00-18:00):",
+        reply_markup=get_cancel_button()
+    )
+    await callback.answer()
+
+
+@router.message(AvailabilityRule.time)
+async def process_rule_time(message: Message, state: FSMContext):
+    """Обработка времени правила"""
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=get_main_menu(ROLE_SUPPLIER))
+        return
+    
+    start_str, _, end_str = (message.text or "").replace(" ", "").partition("-")
+    start, end = validate_time(start_str), validate_time(end_str)
+    if not start or not end or end <= start:
+        await message.answer("❌ Неверный интервал. Используйте ЧЧ:ММ-ЧЧ:ММ:")
+        return
+    
+    await state.update_data(start_time=format_time(start), end_time=format_time(end))
+    await state.set_state(AvailabilityRule.until)
+    await message.answer("📅 До какой даты действует правило? Введите ДД.ММ.ГГГГ\n"
+                         "или «-», если без срока:")
+
+
+@router.message(AvailabilityRule.until)
+async def process_rule_until(message: Message, state: FSMContext):
+    """Обработка срока действия и сохранение правила"""
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=get_main_menu(ROLE_SUPPLIER))
+        return
+    
+    until = None
+    if message.text != "-":
+        until = validate_date(message.text or "")
+        if not until:
+            await message.answer("❌ Неверная дата. Введите ДД.ММ.ГГГГ (не в прошлом) или «-»:")
+            return
+    
+    data = await state.get_data()
+    await state.clear()
+    rule_id = await db.add_availability_rule(
+        data['spot_id'], data['weekdays'], data['start_time'], data['end_time'],
+        valid_from=datetime.now().date(), until=until.date() if until else None
+    )
+    if not rule_id:
+        await message.answer("❌ Ошибка при добавлении правила.", reply_markup=get_main_menu(ROLE_SUPPLIER))
+        return
+    # Подбор уведомлений развернет правило на ближайшие дни
+    scheduler.wake(NotificationMatcher.name)
+    
     await message.answer(
-        f"🏠 Доступные места на сегодня ({len(slots)}):\n\n"
-        "Выберите подходящий слот:",
-        reply_markup=get_available_slots_keyboard(slots)
+        f"✅ Правило добавлено: {format_availability_rule(await db.get_availability_rule(rule_id))}\n\n"
+        "Место будет доступно для бронирования в эти дни.",
+        reply_markup=get_main_menu(ROLE_SUPPLIER)
+    )
+    await send_spot_rules(message, await db.get_parking_spot(data['spot_id']), edit=False)
+
+
+@router.callback_query(F.data.startswith("rule_del_"))
+async def delete_spot_rule(callback: CallbackQuery, user: Optional[dict]):
+    """Удаление правила доступности"""
+    rule = await db.get_availability_rule(int(callback.data.replace("rule_del_", "")))
+    spot = await db.get_parking_spot(rule['spot_id']) if rule else None
+    if not spot or not user or spot['supplier_id'] != user['id']:
+        await callback.answer("❌ Правило не найдено")
+        return
+    
+    if not await db.delete_availability_rule(rule['id']):
+        await callback.answer("❌ Ошибка")
+        return
+    
+    await send_spot_rules(callback.message, spot)
+    await callback.answer("✅ Правило удалено. Уже открытые дни остаются в доступности.", show_alert=True)
+
+
+# ===== ПОКУПАТЕЛЬ - ПОИСК МЕСТ =====
+def format_slot_filters(search: dict) -> str:
+    """Строка с активными фильтрами поиска"""
+    filters = []
+    if search.get('max_price') is not None:
+        filters.append(f"до {search['max_price']} ₽/ч")
+    if search.get('time_from'):
+        filters.append(f"{search['time_from']}-{search['time_to']}")
+    if search.get('address'):
+        filters.append(f"адрес «{escape_html(search['address'])}»")
+    return " · ".join(filters)
+
+
+async def send_slots_page(message: Message, state: FSMContext, edit: bool = False,
+                          cursor: Optional[str] = None, backward: bool = False) -> bool:
+    """
+    Страница поиска свободных слотов по параметрам из состояния (дата и фильтры).
+    Каждая страница читается из БД по курсору. False — на дату без фильтров мест нет.
+    """
+    search = (await state.get_data()).get('search', {})
+    date = datetime.fromisoformat(search['date'])
+    filters = format_slot_filters(search)
+    
+    page = await db.get_available_slots_page(
+        date, cursor=cursor, backward=backward,
+        max_price=search.get('max_price'), time_from=search.get('time_from'),
+        time_to=search.get('time_to'), address=search.get('address')
     )
+    if not page.items and cursor:
+        # Слоты со страницы уже заняты — начинаем сначала
+        page = await db.get_available_slots_page(
+            date, max_price=search.get('max_price'), time_from=search.get('time_from'),
+            time_to=search.get('time_to'), address=search.get('address')
+        )
+    if not page.items and not filters:
+        return False
+    
+    text = f"🏠 Доступные места на {format_date(date)}\n"
+    if filters:
+        text += f"🔎 Фильтры: {filters}\n"
+    text += "\nВыберите подходящий слот:" if page.items else "\nПо этим фильтрам мест нет."
+    
+    keyboard = get_available_slots_keyboard(page.items, page, filtered=bool(filters))
+    if edit:
+        await message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    else:
+        await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+    return True
+
+
+async def start_slot_search(message: Message, state: FSMContext, date: datetime, edit: bool = False,
+                            **filters):
+    """Новый поиск на дату: фильтры сбрасываются (или задаются через filters)"""
+    await state.set_state(SearchSpot.viewing_slots)
+    await state.set_data({'search': {'date': date.date().isoformat(), **filters}})
+    
+    if not await send_slots_page(message, state, edit=edit):
+        await state.clear()
+        text = (
+            f"К сожалению, на {format_date(date)} нет доступных мест. 😔\n\n"
+            "Попробуйте другую дату или настройте уведомления."
+        )
+        if edit:
+            await message.edit_text(text)
+        else:
+            await message.answer(text)
+
+
+@router.message(F.text == "🏠 Свободные места")
+async def show_available_spots(message: Message, state: FSMContext, user: Optional[dict]):
+    """Показать свободные места на сегодня"""
+    if not user:
+        await message.answer("❌ Вы не зарегистрированы. Используйте /start")
+        return
+    
+    await start_slot_search(message, state, datetime.now())
 
 
 @router.message(F.text == "📅 Выбрать дату")
@@ -517,37 +812,444 @@ async def process_search_date(callback: CallbackQuery, state: FSMContext):
         await callback.answer("❌ Неверная дата")
         return
     
-    slots = await db.get_available_slots(date)
+    await start_slot_search(callback.message, state, date, edit=True)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("slots_next_") | F.data.startswith("slots_prev_"))
+async def paginate_slots(callback: CallbackQuery, state: FSMContext):
+    """Листание результатов поиска по курсору"""
+    if 'search' not in await state.get_data():
+        await callback.answer("Поиск устарел — выберите дату заново", show_alert=True)
+        return
     
-    if not slots:
-        await callback.message.edit_text(
-            f"К сожалению, на {date_str} нет доступных мест. 😔\n\n"
-            "Попробуйте другую дату или настройте уведомления."
-        )
+    backward = callback.data.startswith("slots_prev_")
+    await send_slots_page(callback.message, state, edit=True,
+                          cursor=callback.data[len("slots_prev_"):], backward=backward)
+    await callback.answer()
+
+
+SLOT_FILTER_PROMPTS = {
+    'price': (SearchSpot.filter_price, "💰 Введите максимальную цену за час (или «-», чтобы убрать фильтр):"),
+    'time': (SearchSpot.filter_time,
+             "🕐 Введите время, на которое нужно место, в формате ЧЧ:ММ-ЧЧ:ММ (например: 09:00-12:00)\n"
+             "или «-», чтобы убрать фильтр:"),
+    'address': (SearchSpot.filter_address, "📍 Введите часть адреса (или «-», чтобы убрать фильтр):"),
+}
+
+
+@router.callback_query(F.data.startswith("slots_filter_"))
+async def choose_slot_filter(callback: CallbackQuery, state: FSMContext):
+    """Выбор фильтра поиска"""
+    data = await state.get_data()
+    if 'search' not in data:
+        await callback.answer("Поиск устарел — выберите дату заново", show_alert=True)
+        return
+    
+    kind = callback.data.replace("slots_filter_", "")
+    if kind == "reset":
+        await state.set_state(SearchSpot.viewing_slots)
+        await state.update_data(search={'date': data['search']['date']})
+        await send_slots_page(callback.message, state, edit=True)
+        await callback.answer("Фильтры сброшены")
+        return
+    
+    if kind not in SLOT_FILTER_PROMPTS:
+        await callback.answer()
+        return
+    
+    filter_state, prompt = SLOT_FILTER_PROMPTS[kind]
+    await state.set_state(filter_state)
+    await callback.message.answer(prompt)
+    await callback.answer()
+
+
+async def apply_slot_filter(message: Message, state: FSMContext, **changes):
+    """Сохранение фильтра и показ первой страницы результатов"""
+    search = (await state.get_data())['search']
+    search.update(changes)
+    await state.update_data(search=search)
+    await state.set_state(SearchSpot.viewing_slots)
+    await send_slots_page(message, state)
+
+
+@router.message(SearchSpot.filter_price)
+async def process_filter_price(message: Message, state: FSMContext):
+    """Фильтр по цене"""
+    if message.text == "-":
+        await apply_slot_filter(message, state, max_price=None)
+        return
+    
+    price = validate_price((message.text or "").replace(",", "."))
+    if not price:
+        await message.answer("❌ Неверная цена. Введите число, например 150, или «-»:")
+        return
+    
+    await apply_slot_filter(message, state, max_price=price)
+
+
+@router.message(SearchSpot.filter_time)
+async def process_filter_time(message: Message, state: FSMContext):
+    """Фильтр по времени"""
+    if message.text == "-":
+        await apply_slot_filter(message, state, time_from=None, time_to=None)
+        return
+    
+    start_str, _, end_str = (message.text or "").replace(" ", "").partition("-")
+    start, end = validate_time(start_str), validate_time(end_str)
+    if not start or not end or end <= start:
+        await message.answer("❌ Неверный интервал. Используйте ЧЧ:ММ-ЧЧ:ММ или «-»:")
+        return
+    
+    await apply_slot_filter(message, state, time_from=format_time(start), time_to=format_time(end))
+
+
+@router.message(SearchSpot.filter_address)
+async def process_filter_address(message: Message, state: FSMContext):
+    """Фильтр по адресу"""
+    text = (message.text or "").strip()
+    if not text:
+        await message.answer("❌ Введите часть адреса или «-»:")
+        return
+    
+    await apply_slot_filter(message, state, address=None if text == "-" else text[:50])
+
+
+def format_range_results(days: list, time_from: str, time_to: str) -> str:
+    """Текст результатов поиска на период, сгруппированный по дням"""
+    total = sum(1 for _, slots in days if slots)
+    text = (
+        f"📆 <b>Свободные места {format_date(days[0][0])} - {format_date(days[-1][0])}</b>\n"
+        f"🕐 Ежедневно {time_from}-{time_to}\n"
+        f"Дней с местами: {total} из {len(days)}\n"
+    )
+    
+    for day, slots in days:
+        text += f"\n<b>{format_date(day)} ({WEEKDAYS[day.weekday()]})</b>"
+        if not slots:
+            text += " — нет мест\n"
+            continue
+        text += f" — {len(slots)}:\n"
+        for slot in slots[:SEARCH_RANGE_SPOTS_PER_DAY]:
+            address = f", {escape_html(truncate_text(slot['address'], 30))}" if slot.get('address') else ""
+            text += f"   • {escape_html(slot['spot_number'])} — {slot['price_per_hour']} ₽/ч{address}\n"
+        if len(slots) > SEARCH_RANGE_SPOTS_PER_DAY:
+            text += f"   … и еще {len(slots) - SEARCH_RANGE_SPOTS_PER_DAY}\n"
+    return text
+
+
+@router.message(F.text == "📆 Поиск на период")
+async def start_range_search(message: Message, state: FSMContext, user: Optional[dict]):
+    """Поиск свободных мест сразу на несколько дней"""
+    if not user:
+        await message.answer("❌ Вы не зарегистрированы. Используйте /start")
+        return
+    
+    await state.set_state(SearchSpot.range_dates)
+    await message.answer(
+        "📆 Введите период в формате ДД.ММ.ГГГГ-ДД.ММ.ГГГГ\n"
+        f"или число дней начиная с сегодня (до {SEARCH_RANGE_MAX_DAYS}), например: 7",
+        reply_markup=get_cancel_button()
+    )
+
+
+@router.message(SearchSpot.range_dates)
+async def process_range_dates(message: Message, state: FSMContext, user: Optional[dict]):
+    """Обработка периода поиска"""
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Поиск отменен", reply_markup=get_main_menu(user['role'] if user else 'customer'))
+        return
+    
+    text = (message.text or "").replace(" ", "")
+    if text.isdigit():
+        days = int(text)
+        date_from = validate_date(format_date(datetime.now()))
+        date_to = date_from + timedelta(days=days - 1) if days > 0 else None
+    else:
+        from_str, _, to_str = text.partition("-")
+        date_from, date_to = validate_date(from_str), validate_date(to_str)
+    
+    if not date_from or not date_to or date_to < date_from:
+        await message.answer("❌ Неверный период. Используйте ДД.ММ.ГГГГ-ДД.ММ.ГГГГ или число дней:")
+        return
+    if (date_to - date_from).days >= SEARCH_RANGE_MAX_DAYS:
+        await message.answer(f"❌ Период не может быть длиннее {SEARCH_RANGE_MAX_DAYS} дней:")
+        return
+    
+    await state.update_data(range_from=date_from.isoformat(), range_to=date_to.isoformat())
+    await state.set_state(SearchSpot.range_time)
+    await message.answer("🕐 Введите время, на которое нужно место каждый день, в формате ЧЧ:ММ-ЧЧ:ММ\n"
+                         "(например: 09:00-18:00):")
+
+
+@router.message(SearchSpot.range_time)
+async def process_range_time(message: Message, state: FSMContext, user: Optional[dict]):
+    """Обработка ежедневного окна и вывод мест по дням"""
+    if message.text == "❌ Отмена":
         await state.clear()
+        await message.answer("Поиск отменен", reply_markup=get_main_menu(user['role'] if user else 'customer'))
         return
     
+    start_str, _, end_str = (message.text or "").replace(" ", "").partition("-")
+    start, end = validate_time(start_str), validate_time(end_str)
+    if not start or not end or end <= start:
+        await message.answer("❌ Неверный интервал. Используйте ЧЧ:ММ-ЧЧ:ММ:")
+        return
+    
+    data = await state.get_data()
+    time_from, time_to = format_time(start), format_time(end)
+    days = await db.find_free_spots_range(
+        datetime.fromisoformat(data['range_from']), datetime.fromisoformat(data['range_to']),
+        time_from, time_to
+    )
+    await state.clear()
+    await state.update_data(range_time_from=time_from, range_time_to=time_to)
+    
+    await message.answer("🔍 Поиск выполнен", reply_markup=get_main_menu(user['role'] if user else 'customer'))
+    if not any(slots for _, slots in days):
+        await message.answer(
+            "К сожалению, в этот период нет мест на все время. 😔\n\n"
+            "Попробуйте другое время или настройте уведомления."
+        )
+        return
+    
+    await message.answer(
+        format_range_results(days, time_from, time_to) + "\nВыберите день, чтобы забронировать:",
+        reply_markup=get_range_days_keyboard(days),
+        parse_mode="HTML"
+    )
+
+
+@router.callback_query(F.data.startswith("range_day_"))
+async def open_range_day(callback: CallbackQuery, state: FSMContext):
+    """Переход от результатов поиска на период к слотам выбранного дня"""
+    date = validate_date(callback.data.replace("range_day_", ""))
+    if not date:
+        await callback.answer("❌ Эта дата уже прошла", show_alert=True)
+        return
+    
+    data = await state.get_data()
+    filters = {}
+    if data.get('range_time_from'):
+        filters = {'time_from': data['range_time_from'], 'time_to': data['range_time_to']}
+    
+    await start_slot_search(callback.message, state, date, edit=True, **filters)
+    await callback.answer()
+
+
+# ===== БРОНИРОВАНИЕ =====
+async def send_notices(bot, notices: List[tuple], edit: Optional[tuple] = None):
+    """
+    Сообщения сторонам бронирования одной пачкой: notices — (chat_id, текст, клавиатура),
+    edit — (сообщение, текст, клавиатура) для правки ответа тому, кто нажал кнопку
+    """
+    calls = [
+        bot.send_message(chat_id=chat_id, text=text, reply_markup=markup, parse_mode="HTML")
+        for chat_id, text, markup in notices
+    ]
+    if edit:
+        message, text, markup = edit
+        calls.append(bot.edit_message_text(text=text, chat_id=message.chat.id, message_id=message.message_id,
+                                           reply_markup=markup, parse_mode="HTML"))
+    
+    for result in await asyncio.gather(*calls, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка уведомления по бронированию: {result}")
+
+
+def format_payment_details(booking: dict) -> str:
+    """Реквизиты поставщика для оплаты"""
+    return (
+        f"\n💳 <b>Реквизиты для оплаты:</b>\n"
+        f"Банк: {escape_html(booking['supplier_bank'])}\n"
+        f"Карта: {mask_card_number(booking['supplier_card'])}\n"
+    )
+
+
+@router.callback_query(F.data.startswith("book_slot_"))
+async def show_slot_booking(callback: CallbackQuery, user: Optional[dict]):
+    """Выбор слота: бронирование целиком или части по времени"""
+    if not user:
+        await callback.answer("❌ Вы не зарегистрированы. Используйте /start")
+        return
+    
+    slot = await db.get_free_slot(int(callback.data.replace("book_slot_", "")))
+    if not slot:
+        await callback.answer("❌ Слот уже занят — обновите поиск", show_alert=True)
+        return
+    
+    hours = calculate_hours(slot['start_time'], slot['end_time'])
+    text = (
+        f"🏠 <b>Место {escape_html(slot['spot_number'])}</b>\n"
+        f"📅 {format_datetime(slot['start_time'])} - {format_time(slot['end_time'])}\n"
+    )
+    if slot['address']:
+        text += f"📍 {escape_html(slot['address'])}\n"
+    text += (
+        f"💰 {slot['price_per_hour']} ₽/час, целиком — "
+        f"{calculate_price(hours, slot['price_per_hour'])} ₽\n"
+    )
+    if slot['is_partial_allowed']:
+        text += "\n🔀 Можно забронировать часть времени."
+    
     await callback.message.edit_text(
-        f"🏠 Доступные места на {date_str} ({len(slots)}):\n\n"
-        "Выберите подходящий слот:",
-        reply_markup=get_available_slots_keyboard(slots)
+        text,
+        reply_markup=get_book_slot_keyboard(slot['id'], slot['is_partial_allowed']),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+
+async def place_booking(message: Message, user: dict, slot: dict, start: datetime, end: datetime,
+                        edit: bool = False) -> bool:
+    """Бронирование интервала слота (одна транзакция) и уведомление сторон"""
+    booking_id = await db.reserve_interval(slot['spot_id'], start, end, user['id'])
+    booking = await db.get_booking_parties(booking_id) if booking_id else None
+    if not booking:
+        return False
+    
+    info = format_booking_info(booking)
+    customer_text = f"✅ Заявка отправлена поставщику!\n\n{info}\nМы сообщим, когда он ответит."
+    supplier_text = (
+        f"📥 <b>Новая заявка на бронирование</b>\n\n{info}\n"
+        f"👤 {escape_html(booking['customer_name'])}, {escape_html(booking['customer_phone'])}"
+    )
+    notices = [(booking['supplier_telegram_id'], supplier_text, get_confirm_booking_keyboard(booking_id))]
+    if edit:
+        await send_notices(message.bot, notices, edit=(message, customer_text, None))
+    else:
+        notices.append((message.chat.id, customer_text, get_main_menu(user['role'])))
+        await send_notices(message.bot, notices)
+    return True
+
+
+@router.callback_query(F.data.startswith("book_whole_"))
+async def book_whole_slot(callback: CallbackQuery, user: Optional[dict]):
+    """Бронирование слота целиком"""
+    slot = await db.get_free_slot(int(callback.data.replace("book_whole_", "")))
+    if not user or not slot:
+        await callback.answer("❌ Слот уже занят — обновите поиск", show_alert=True)
+        return
+    
+    start = max(slot['start_time'], datetime.now().replace(second=0, microsecond=0))
+    if start != slot['start_time'] and not slot['is_partial_allowed']:
+        await callback.answer("❌ Этот слот уже начался", show_alert=True)
+        return
+    
+    if not await place_booking(callback.message, user, slot, start, slot['end_time'], edit=True):
+        await callback.answer("❌ Не удалось забронировать — слот уже занят", show_alert=True)
+        return
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("book_part_"))
+async def start_partial_booking(callback: CallbackQuery, state: FSMContext):
+    """Бронирование части слота: запрос времени"""
+    slot = await db.get_free_slot(int(callback.data.replace("book_part_", "")))
+    if not slot or not slot['is_partial_allowed']:
+        await callback.answer("❌ Слот уже занят — обновите поиск", show_alert=True)
+        return
+    
+    await state.set_state(BookSlot.time)
+    await state.set_data({'slot_id': slot['id']})
+    await callback.message.answer(
+        f"🕐 Введите время в формате ЧЧ:ММ-ЧЧ:ММ в пределах "
+        f"{format_time(slot['start_time'])}-{format_time(slot['end_time'])} "
+        f"({format_date(slot['start_time'])}):",
+        reply_markup=get_cancel_button()
     )
+    await callback.answer()
+
+
+@router.message(BookSlot.time)
+async def process_booking_time(message: Message, state: FSMContext, user: Optional[dict]):
+    """Обработка времени частичного бронирования"""
+    role = user['role'] if user else ROLE_CUSTOMER
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=get_main_menu(role))
+        return
+    
+    slot = await db.get_free_slot((await state.get_data())['slot_id'])
+    if not user or not slot:
+        await state.clear()
+        await message.answer("❌ Слот уже занят — обновите поиск", reply_markup=get_main_menu(role))
+        return
+    
+    day = format_date(slot['start_time'])
+    start_str, _, end_str = (message.text or "").replace(" ", "").partition("-")
+    start, end = parse_datetime(day, start_str), parse_datetime(day, end_str)
+    if not start or not end or end <= start:
+        await message.answer("❌ Неверный интервал. Используйте ЧЧ:ММ-ЧЧ:ММ:")
+        return
+    if start < slot['start_time'] or end > slot['end_time'] or is_past_datetime(start):
+        await message.answer("❌ Время должно быть в пределах слота и не в прошлом:")
+        return
+    
     await state.clear()
+    if not await place_booking(message, user, slot, start, end):
+        await message.answer("❌ Не удалось забронировать — время уже занято.",
+                             reply_markup=get_main_menu(role))
+
+
+@router.callback_query(F.data.startswith("confirm_book_") | F.data.startswith("reject_book_"))
+async def answer_booking_request(callback: CallbackQuery, user: Optional[dict]):
+    """Ответ поставщика на заявку: подтверждение или отклонение"""
+    confirm = callback.data.startswith("confirm_book_")
+    booking_id = int(callback.data.split("_")[-1])
+    booking = await db.transition_booking(
+        booking_id, STATUS_CONFIRMED if confirm else STATUS_REJECTED, user['id'] if user else None
+    )
+    if not booking:
+        await callback.answer("Заявка уже обработана или недоступна", show_alert=True)
+        return
+    
+    info = format_booking_info(booking)
+    if confirm:
+        # Новое подтвержденное бронирование — в горизонт напоминаний
+        scheduler.wake(ReminderScheduler.name)
+        customer_text = f"✅ <b>Бронирование подтверждено!</b>\n\n{info}" + format_payment_details(booking)
+    else:
+        # Время вернулось в доступность — может подойти подписчикам
+        scheduler.wake(NotificationMatcher.name)
+        customer_text = f"🚫 <b>Поставщик отклонил заявку</b>\n\n{info}\nПопробуйте выбрать другое место."
+    
+    await send_notices(callback.bot, [(booking['customer_telegram_id'], customer_text, None)],
+                       edit=(callback.message, info, None))
+    await callback.answer("✅ Подтверждено" if confirm else "Заявка отклонена")
+
+
+@router.callback_query(F.data.startswith("cancel_booking_"))
+async def cancel_booking(callback: CallbackQuery, user: Optional[dict]):
+    """Отмена бронирования покупателем"""
+    booking_id = int(callback.data.replace("cancel_booking_", ""))
+    booking = await db.transition_booking(booking_id, STATUS_CANCELLED, user['id'] if user else None)
+    if not booking:
+        await callback.answer("❌ Бронирование нельзя отменить", show_alert=True)
+        return
+    
+    scheduler.wake(NotificationMatcher.name)
+    info = format_booking_info(booking)
+    await send_notices(
+        callback.bot,
+        [(booking['supplier_telegram_id'], f"❌ <b>Покупатель отменил бронирование</b>\n\n{info}", None)],
+        edit=(callback.message, info, get_booking_actions_keyboard(booking_id, booking['status']))
+    )
+    await callback.answer("Бронирование отменено")
 
 
 # ===== ПОКУПАТЕЛЬ - БРОНИРОВАНИЯ =====
 @router.message(F.text == "📋 Мои бронирования")
-async def show_my_bookings(message: Message):
+async def show_my_bookings(message: Message, user: Optional[dict]):
     """Показать бронирования пользователя"""
-    user = await db.get_user_by_telegram_id(message.from_user.id)
-    
     if not user:
         await message.answer("❌ Вы не зарегистрированы.")
         return
     
-    bookings = await db.get_user_bookings(user['id'])
+    page = await db.get_user_bookings(user['id'], limit=PAGINATION_SIZE)
     
-    if not bookings:
+    if not page.items:
         await message.answer(
             "У вас пока нет бронирований.\n\n"
             "Используйте '🏠 Свободные места' для поиска парковки."
@@ -555,44 +1257,256 @@ async def show_my_bookings(message: Message):
         return
     
     await message.answer(
-        f"📋 Ваши бронирования ({len(bookings)}):\n\n"
+        "📋 Ваши бронирования:\n\n"
         "Выберите бронирование для просмотра:",
-        reply_markup=get_bookings_keyboard(bookings)
+        reply_markup=get_bookings_keyboard(page.items, page)
     )
 
 
+@router.callback_query(F.data.startswith("my_bookings_") | (F.data == "back_to_bookings"))
+async def paginate_my_bookings(callback: CallbackQuery, user: Optional[dict]):
+    """Пагинация бронирований пользователя по курсору; «Назад» из деталей — первая страница"""
+    if not user:
+        await callback.answer("❌ Вы не зарегистрированы.")
+        return
+    
+    cursor, backward = None, False
+    if callback.data.startswith("my_bookings_"):
+        backward = callback.data.startswith("my_bookings_prev_")
+        cursor = callback.data[len("my_bookings_prev_"):]
+    
+    page = await db.get_user_bookings(user['id'], cursor=cursor, limit=PAGINATION_SIZE,
+                                      backward=backward)
+    if not page.items and cursor:
+        page = await db.get_user_bookings(user['id'], limit=PAGINATION_SIZE)
+    
+    if not page.items:
+        await callback.message.edit_text("У вас пока нет бронирований.")
+    else:
+        await callback.message.edit_text(
+            "📋 Ваши бронирования:\n\n"
+            "Выберите бронирование для просмотра:",
+            reply_markup=get_bookings_keyboard(page.items, page)
+        )
+    await callback.answer()
+
+
 @router.callback_query(F.data.startswith("booking_"))
-async def show_booking_details(callback: CallbackQuery):
-    """Показать детали бронирования"""
+async def show_booking_details(callback: CallbackQuery, user: Optional[dict]):
+    """Показать детали бронирования покупателю или поставщику места"""
     booking_id = int(callback.data.replace("booking_", ""))
-    booking = await db.get_booking(booking_id)
+    booking = await db.get_booking_parties(booking_id)
     
-    if not booking:
+    as_supplier = bool(user and booking and booking['supplier_id'] == user['id'])
+    if not booking or not user or (booking['customer_id'] != user['id'] and not as_supplier):
         await callback.answer("❌ Бронирование не найдено")
         return
     
-    info = format_booking_info(booking, 'customer')
-    
-    # Получаем информацию о поставщике для реквизитов
-    supplier = await db.get_user_by_telegram_id(booking['supplier_id'])
-    if supplier and booking['status'] in [STATUS_CONFIRMED, STATUS_PENDING]:
-        info += f"\n💳 <b>Реквизиты для оплаты:</b>\n"
-        info += f"Банк: {supplier['bank']}\n"
-        info += f"Карта: {mask_card_number(supplier['card_number'])}\n"
+    info = format_booking_info(booking, 'supplier' if as_supplier else 'customer')
+    if as_supplier:
+        info += f"\n👤 {escape_html(booking['customer_name'])}, {escape_html(booking['customer_phone'])}\n"
+    elif booking['status'] in [STATUS_CONFIRMED, STATUS_PENDING]:
+        info += format_payment_details(booking)
     
     await callback.message.edit_text(
         info,
-        reply_markup=get_booking_actions_keyboard(booking_id, booking['status']),
+        reply_markup=get_booking_actions_keyboard(booking_id, booking['status'], as_supplier),
         parse_mode="HTML"
     )
 
 
+# ===== ПОСТАВЩИК - ЗАЯВКИ =====
+@router.message(F.text == "📋 Заявки на бронирование")
+async def show_booking_requests(message: Message, user: Optional[dict]):
+    """Бронирования мест поставщика"""
+    if not user or user['role'] != ROLE_SUPPLIER:
+        await message.answer("❌ Раздел доступен только поставщикам.")
+        return
+    
+    page = await db.get_supplier_bookings(user['id'], limit=PAGINATION_SIZE)
+    if not page.items:
+        await message.answer("На ваши места пока нет бронирований.")
+        return
+    
+    await message.answer(
+        "📋 Бронирования ваших мест:\n\n"
+        "Выберите бронирование, чтобы ответить на заявку:",
+        reply_markup=get_bookings_keyboard(page.items, page, prefix="requests")
+    )
+
+
+@router.callback_query(F.data.startswith("requests_") | (F.data == "back_to_requests"))
+async def paginate_booking_requests(callback: CallbackQuery, user: Optional[dict]):
+    """Пагинация бронирований поставщика по курсору"""
+    if not user:
+        await callback.answer("❌ Вы не зарегистрированы.")
+        return
+    
+    cursor, backward = None, False
+    if callback.data.startswith("requests_"):
+        backward = callback.data.startswith("requests_prev_")
+        cursor = callback.data[len("requests_prev_"):]
+    
+    page = await db.get_supplier_bookings(user['id'], cursor=cursor, limit=PAGINATION_SIZE,
+                                          backward=backward)
+    if not page.items and cursor:
+        page = await db.get_supplier_bookings(user['id'], limit=PAGINATION_SIZE)
+    
+    if not page.items:
+        await callback.message.edit_text("На ваши места пока нет бронирований.")
+    else:
+        await callback.message.edit_text(
+            "📋 Бронирования ваших мест:\n\n"
+            "Выберите бронирование, чтобы ответить на заявку:",
+            reply_markup=get_bookings_keyboard(page.items, page, prefix="requests")
+        )
+    await callback.answer()
+
+
+# ===== ПОКУПАТЕЛЬ - УВЕДОМЛЕНИЯ =====
+@router.message(F.text == "🔔 Уведомления")
+async def start_notification_request(message: Message, state: FSMContext, user: Optional[dict]):
+    """Подписка на появление свободного места"""
+    if not user:
+        await message.answer("❌ Вы не зарегистрированы.")
+        return
+    
+    notifications = await db.get_user_notifications(user['id'])
+    
+    text = "🔔 <b>Уведомления о свободных местах</b>\n\n"
+    if notifications:
+        text += "Вы ждете места на:\n"
+        for n in notifications:
+            try:
+                date = format_date(datetime.fromisoformat(n['desired_date']))
+            except ValueError:
+                # ДД.ММ.ГГГГ — строка, которую миграция еще не перевела в ISO
+                date = n['desired_date']
+            text += f"• {date}, {n['desired_start']} - {n['desired_end']}\n"
+        text += "\n"
+    text += "Выберите дату, на которую нужно место:"
+    
+    await message.answer(text, reply_markup=get_date_selection_keyboard(), parse_mode="HTML")
+    await state.set_state(NotificationRequest.date)
+
+
+@router.callback_query(NotificationRequest.date, F.data.startswith("date_"))
+async def process_notification_date(callback: CallbackQuery, state: FSMContext):
+    """Обработка выбора даты уведомления"""
+    if callback.data == "date_manual":
+        await callback.message.edit_text(
+            "✍️ Введите дату в формате ДД.ММ.ГГГГ:"
+        )
+        return
+    
+    date = validate_date(callback.data.replace("date_", ""))
+    if not date:
+        await callback.answer("❌ Неверная дата")
+        return
+    
+    await state.update_data(date=date.date().isoformat())
+    await callback.message.edit_text(
+        f"📅 Дата: {format_date(date)}\n\n"
+        "🕐 С какого времени нужно место? Формат ЧЧ:ММ (например: 09:00):"
+    )
+    await state.set_state(NotificationRequest.start_time)
+
+
+@router.message(NotificationRequest.date)
+async def process_notification_date_text(message: Message, state: FSMContext, user: Optional[dict]):
+    """Ввод даты уведомления вручную"""
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=get_main_menu(user['role'] if user else ROLE_CUSTOMER))
+        return
+    
+    date = validate_date(message.text or "")
+    if not date:
+        await message.answer("❌ Неверная дата. Используйте ДД.ММ.ГГГГ (не в прошлом):")
+        return
+    
+    await state.update_data(date=date.date().isoformat())
+    await message.answer(
+        "🕐 С какого времени нужно место? Формат ЧЧ:ММ (например: 09:00):",
+        reply_markup=get_cancel_button()
+    )
+    await state.set_state(NotificationRequest.start_time)
+
+
+@router.message(NotificationRequest.start_time)
+async def process_notification_start(message: Message, state: FSMContext, user: Optional[dict]):
+    """Обработка времени начала для уведомления"""
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=get_main_menu(user['role'] if user else ROLE_CUSTOMER))
+        return
+    
+    time_obj = validate_time(message.text or "")
+    if not time_obj:
+        await message.answer("❌ Неверный формат времени. Используйте ЧЧ:ММ:")
+        return
+    
+    # Храним время как ЧЧ:ММ с ведущим нулем — так оно сравнивается строкой
+    await state.update_data(start_time=format_time(time_obj))
+    await message.answer("🕐 До какого времени? Формат ЧЧ:ММ (например: 18:00):")
+    await state.set_state(NotificationRequest.end_time)
+
+
+@router.message(NotificationRequest.end_time)
+async def process_notification_end(message: Message, state: FSMContext, user: Optional[dict]):
+    """Сохранение запроса на уведомление"""
+    role = user['role'] if user else ROLE_CUSTOMER
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=get_main_menu(role))
+        return
+    
+    time_obj = validate_time(message.text or "")
+    if not time_obj:
+        await message.answer("❌ Неверный формат времени. Используйте ЧЧ:ММ:")
+        return
+    
+    data = await state.get_data()
+    end_str = format_time(time_obj)
+    if end_str <= data['start_time']:
+        await message.answer("❌ Время окончания должно быть позже времени начала.")
+        return
+    
+    date = datetime.fromisoformat(data['date'])
+    start_dt = datetime.combine(date.date(), datetime.strptime(data['start_time'], "%H:%M").time())
+    end_dt = datetime.combine(date.date(), time_obj.time())
+    await state.clear()
+    
+    # Если место уже есть — подписка не нужна
+    if not is_past_datetime(start_dt) and await db.find_free_spots(start_dt, end_dt):
+        await message.answer(
+            f"✅ На {format_date(date)} с {data['start_time']} до {end_str} уже есть свободные места!\n\n"
+            "Забронировать можно через «📅 Выбрать дату».",
+            reply_markup=get_main_menu(role)
+        )
+        return
+    
+    notification_id = await db.add_notification_request(
+        user_id=user['id'],
+        desired_date=data['date'],
+        desired_start=data['start_time'],
+        desired_end=end_str
+    )
+    
+    if notification_id:
+        await message.answer(
+            f"🔔 Готово! Сообщим, когда появится место на {format_date(date)} "
+            f"с {data['start_time']} до {end_str}.",
+            reply_markup=get_main_menu(role)
+        )
+    else:
+        await message.answer("❌ Ошибка при сохранении уведомления.", reply_markup=get_main_menu(role))
+
+
 # ===== ПРОФИЛЬ =====
 @router.message(F.text == "👤 Мой профиль")
-async def show_profile(message: Message):
+async def show_profile(message: Message, user: Optional[dict]):
     """Показать профиль пользователя"""
-    user = await db.get_user_by_telegram_id(message.from_user.id)
-    
     if not user:
         await message.answer("❌ Вы не зарегистрированы.")
         return
@@ -607,10 +1521,8 @@ async def show_profile(message: Message):
 
 
 @router.callback_query(F.data == "main_menu")
-async def back_to_main_menu(callback: CallbackQuery):
+async def back_to_main_menu(callback: CallbackQuery, user: Optional[dict]):
     """Возврат в главное меню"""
-    user = await db.get_user_by_telegram_id(callback.from_user.id)
-    
     await callback.message.delete()
     await callback.message.answer(
         "Главное меню:",
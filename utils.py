@@ -79,6 +79,34 @@ def calculate_hours(start: datetime, end: datetime) -> float:
     return delta.total_seconds() / 3600
 
 
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_minutes(dt: datetime) -> int:
+    """Перевод datetime в целое число минут от эпохи"""
+    return int((dt - EPOCH).total_seconds() // 60)
+
+
+def from_epoch_minutes(minutes: int) -> datetime:
+    """Перевод минут от эпохи обратно в datetime"""
+    return EPOCH + timedelta(minutes=minutes)
+
+
+def minutes_of_day(time_str: str) -> int:
+    """Минуты от начала суток для времени ЧЧ:ММ"""
+    hours, minutes = time_str.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def to_datetime(value) -> datetime:
+    """datetime из значения БД: datetime, минуты эпохи или строка ISO"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, int):
+        return from_epoch_minutes(value)
+    return datetime.fromisoformat(value)
+
+
 def calculate_price(hours: float, price_per_hour: float) -> float:
     """Расчет стоимости аренды"""
     return round(hours * price_per_hour, 2)
@@ -105,7 +133,9 @@ def get_status_emoji(status: str) -> str:
         'pending': '⏳',
         'confirmed': '✅',
         'cancelled': '❌',
-        'completed': '✔️'
+        'completed': '✔️',
+        'rejected': '🚫',
+        'expired': '⌛'
     }
     return status_map.get(status, '❓')
 
@@ -116,7 +146,9 @@ def get_status_text(status: str) -> str:
         'pending': 'Ожидает подтверждения',
         'confirmed': 'Подтверждено',
         'cancelled': 'Отменено',
-        'completed': 'Завершено'
+        'completed': 'Завершено',
+        'rejected': 'Отклонено поставщиком',
+        'expired': 'Истекло без ответа'
     }
     return status_map.get(status, 'Неизвестно')
 
@@ -176,10 +208,8 @@ def validate_price(price_str: str) -> Optional[float]:
 
 def format_booking_info(booking: dict, user_type: str = 'customer') -> str:
     """Форматирование информации о бронировании"""
-    from datetime import datetime
-    
-    start = datetime.fromisoformat(booking['start_time'])
-    end = datetime.fromisoformat(booking['end_time'])
+    start = to_datetime(booking['start_time'])
+    end = to_datetime(booking['end_time'])
     
     hours = calculate_hours(start, end)
     
@@ -218,6 +248,24 @@ def format_spot_info(spot: dict) -> str:
     return info
 
 
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+
+def format_availability_rule(rule: dict) -> str:
+    """Описание правила доступности: дни недели, время и период действия"""
+    days = ", ".join(name for i, name in enumerate(WEEKDAYS) if rule['weekdays'] >> i & 1)
+    start_h, start_m = divmod(rule['start_minute'], 60)
+    end_h, end_m = divmod(rule['end_minute'], 60)
+    text = f"{days} {start_h:02d}:{start_m:02d}-{end_h:02d}:{end_m:02d}"
+    
+    valid_from = from_epoch_minutes(rule['valid_from'] * 24 * 60)
+    if rule['until_day'] is not None:
+        text += f", {format_date(valid_from)} - {format_date(from_epoch_minutes(rule['until_day'] * 24 * 60))}"
+    else:
+        text += f", с {format_date(valid_from)}"
+    return text
+
+
 def format_user_info(user: dict) -> str:
     """Форматирование информации о пользователе"""
     info = f"👤 <b>{user['full_name']}</b>\n\n"
@@ -0,0 +1,131 @@
+import asyncio
+import hmac
+import logging
+from typing import List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """
+    Прием апдейтов через webhook.
+    HTTP-обработчик только проверяет секрет и кладет апдейт в ограниченную очередь,
+    а фиксированное число воркеров передает апдейты в тот же Dispatcher.
+    Это ограничивает одновременную нагрузку на SQLite при всплесках.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str = WEBHOOK_PATH,
+                 secret: Optional[str] = WEBHOOK_SECRET, queue_size: int = WEBHOOK_QUEUE_SIZE,
+                 workers: int = WEBHOOK_WORKERS):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.workers_count = workers
+        self._workers: List[asyncio.Task] = []
+
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/healthz', self.handle_health)
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret:
+            token = request.headers.get(SECRET_HEADER, '')
+            if not hmac.compare_digest(token, self.secret):
+                return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception as e:
+            logger.warning(f"Некорректный апдейт: {e}")
+            return web.Response(status=400)
+
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже
+            self.rejected += 1
+            return web.Response(status=503)
+
+        self.received += 1
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _on_startup(self, app: web.Application):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp)
+
+        if WEBHOOK_URL:
+            await self.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + self.path,
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                max_connections=self.workers_count
+            )
+            logger.info(f"Webhook установлен: {WEBHOOK_URL}")
+        else:
+            logger.info("WEBHOOK_URL не задан: setWebhook не вызывается (локальный режим)")
+
+    async def _on_shutdown(self, app: web.Application):
+        # Дорабатываем уже принятые апдейты
+        await self.queue.join()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queue.qsize(),
+            'received': self.received,
+            'rejected': self.rejected,
+            'processed': self.processed,
+            'failed': self.failed,
+        }
+
+    async def run(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+        """Запуск HTTP-сервера до отмены задачи"""
+        runner = web.AppRunner(self.build_app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        logger.info(f"Webhook-сервер слушает {host}:{port}{self.path}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()